@@ -0,0 +1,123 @@
+# Compare the speed of EKFSLAM with hand-written ("analytic") and automatically differentiated ("autodiff") Jacobians
+#
+# Run with JAX in 64-bit precision (autodiff needs the models to run on JAX):
+#   JAX_ENABLE_X64=True USE_JAX=True python -m python.benchmark_jacobians --num-landmarks 50
+#
+# Both modes are run on the JAX backend, and the analytic Jacobians are also run on the default NumPy backend (in a
+# subprocess, since the backend is chosen at import time), which is the path used without USE_JAX.
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from python.lib import backend
+from python.lib.ekf import EKFSLAM
+from python.lib.robot import move
+from python.lib.sensors import RangeBearingSensor
+
+
+def run(jacobians, num_steps, num_landmarks, seed=0):
+    """
+    Run EKFSLAM on a simulated circle through a field of landmarks, timing prediction and update steps
+
+    :param jacobians: "analytic" or "autodiff"
+    :param num_steps: number of steps (one prediction and one scan update each)
+    :param num_landmarks: number of landmarks, all observed in every scan
+    :param seed: random seed
+    :return: estimator, prediction times [s] and update times [s] of the steps
+    """
+
+    rng = np.random.RandomState(seed)
+    landmarks = rng.uniform(-10, 10, (num_landmarks, 2))
+
+    est = EKFSLAM(landmark_capacity=num_landmarks, jacobians=jacobians)
+    est.P = np.diag([0.01, 0.01, 0.001])
+    est.Q = np.diag([0.05 ** 2, np.deg2rad(1.) ** 2])
+    est.R = np.diag([0.1 ** 2, np.deg2rad(2.) ** 2])
+
+    # simulate all measurements first, so that only the estimator is timed (on the JAX backend the simulation runs
+    # eagerly on JAX, whose asynchronous work would otherwise overlap the timed steps)
+    r_true = np.zeros(3)
+    U = np.array([0.1, np.deg2rad(3.)])
+    Y_steps = []
+    for _ in range(num_steps):
+        r_true = np.asarray(move(r_true, U, np.zeros(2)))
+        Y = np.asarray(RangeBearingSensor.observe_range_bearing_batch(r_true, landmarks))
+        Y_steps.append(Y + rng.randn(num_landmarks, 2) * np.sqrt(np.diag(est.R)))
+
+    landmark_ids = list(range(num_landmarks))
+    prediction_times, update_times = [], []
+    for Y in Y_steps:
+        t_start = time.perf_counter()
+        est.state_and_state_cov_propagation(U)
+        t_predicted = time.perf_counter()
+        est.range_bearing_scan_update(Y, landmark_ids)
+        t_updated = time.perf_counter()
+
+        prediction_times.append(t_predicted - t_start)
+        update_times.append(t_updated - t_predicted)
+
+    return est, np.array(prediction_times), np.array(update_times)
+
+
+def report(label, num_landmarks, warm_up_time, prediction_times, update_times):
+    # medians, which are robust to the occasional slow step (e.g. another process being scheduled)
+    print("{:<26} warm-up {:8.3f} s  prediction {:8.1f} us/step  update {:8.1f} us/landmark".format(
+        label, warm_up_time, 1e6 * np.median(prediction_times), 1e6 * np.median(update_times) / num_landmarks))
+
+
+def benchmark(jacobians, num_steps, num_landmarks):
+    """
+    Warm up, then time a run
+
+    :return: estimator, warm-up time [s], prediction times [s] and update times [s] of the steps
+    """
+
+    t_start = time.perf_counter()
+    run(jacobians, 2, num_landmarks)      # warm up (compiles the autodiff Jacobians)
+    warm_up_time = time.perf_counter() - t_start
+
+    est, prediction_times, update_times = run(jacobians, num_steps, num_landmarks)
+
+    return est, warm_up_time, prediction_times, update_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare analytic and autodiff Jacobians in EKFSLAM")
+    parser.add_argument("--num-steps", type=int, default=100)
+    parser.add_argument("--num-landmarks", type=int, default=20)
+    parser.add_argument("--analytic-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.analytic_only or not backend.USE_JAX:
+        _, warm_up_time, prediction_times, update_times = benchmark("analytic", args.num_steps, args.num_landmarks)
+        report("analytic (NumPy backend)" if not backend.USE_JAX else "analytic (JAX backend)", args.num_landmarks,
+               warm_up_time, prediction_times, update_times)
+        if not backend.USE_JAX and not args.analytic_only:
+            print("Set USE_JAX=True and JAX_ENABLE_X64=True to compare with autodiff Jacobians")
+        return
+
+    # the default path: analytic Jacobians on the NumPy backend
+    env = dict(os.environ)
+    env.pop("USE_JAX", None)
+    subprocess.run([sys.executable, "-m", "python.benchmark_jacobians", "--analytic-only",
+                    "--num-steps", str(args.num_steps), "--num-landmarks", str(args.num_landmarks)], env=env,
+                   check=True)
+
+    results = {}
+    for jacobians in ("analytic", "autodiff"):
+        est, warm_up_time, prediction_times, update_times = benchmark(jacobians, args.num_steps, args.num_landmarks)
+        results[jacobians] = est
+        report("{} (JAX backend)".format(jacobians), args.num_landmarks, warm_up_time, prediction_times, update_times)
+
+    print("Largest difference of the estimates: X {:.2e}, P {:.2e}".format(
+        np.abs(results["analytic"].X - results["autodiff"].X).max(),
+        np.abs(results["analytic"].P - results["autodiff"].P).max()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# Check the analytic Jacobians against automatic differentiation at many random points, and compare their speed
+#
+# Run with JAX in 64-bit precision:
+#   JAX_ENABLE_X64=True USE_JAX=True python -m python.check_jacobians --num-points 10000
+
+import argparse
+import sys
+
+from python.lib.jacobian_check import check_jacobians, format_reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the analytic Jacobians against automatic differentiation")
+    parser.add_argument("--num-points", type=int, default=2000, help="number of random points per Jacobian")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tol", type=float, default=1e-9, help="largest allowed absolute error")
+    args = parser.parse_args()
+
+    reports = check_jacobians(args.num_points, args.seed)
+    print(format_reports(reports))
+
+    failed = [r for r in reports if not r.max_error <= args.tol]
+    for r in failed:
+        print("{}: error {:.2e} at point {} entry {}: {}".format(r.name, r.max_error, r.index, r.entry, r.point))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
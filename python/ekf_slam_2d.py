@@ -1,33 +1,40 @@
 # This script simulates a robot performing SLAM in 2D
 
 import numpy as np
-from jax.config import config
 import random
-from matplotlib import pyplot as plt
-import matplotlib.transforms as mtransforms
 import time
 
 from python.lib.robot import move
 from python.lib.sensors import RangeBearingSensor as rbs
 from python.lib.ekf import EKFSLAM
-from python.lib.utils import confidence_ellipse
+from python.lib.fastslam import FastSLAM
+from python.lib.history import HistoryRecorder
+from python.lib.monitor import ConsistencyMonitor
+from python.lib.scheduler import Scheduler
+from python.lib.transforms import PoseContext
+from python.lib.world import LandmarkGrid, generate_landmarks
 
-# check that JAX is set to 64-bit precision
-assert config.values["jax_enable_x64"]
+# NB: matplotlib is imported on first use rather than here, and JAX is only imported by the library when USE_JAX is set,
+# so that importing this module (e.g. from worker processes that never plot) stays fast.
 
 
-def display(r, estimator, landmarks_true, landmarks_est, raw_measurements, sim_time):
+def display(r, estimator, landmark_ids, landmarks_true, landmarks_est, raw_measurements, sim_time):
     """
     Display robot and landmarks
 
     :param r: robot pose
     :param estimator: estimator object, which contains state estimates and state covariance matrix
-    :param landmarks_true: list of true landmark locations
-    :param landmarks_est: list of estimated landmark locations
-    :param raw_measurements: sensor measurements of landmarks
+    :param landmark_ids: IDs of the measured landmarks
+    :param landmarks_true: true locations of the measured landmarks
+    :param landmarks_est: estimated locations of the measured landmarks
+    :param raw_measurements: sensor measurements of the landmarks
     :param sim_time: simulation time
     """
 
+    from matplotlib import pyplot as plt
+    import matplotlib.transforms as mtransforms
+    from python.lib.utils import confidence_ellipse
+
     fig = plt.figure()
 
     # plot true robot states
@@ -43,6 +50,11 @@ def display(r, estimator, landmarks_true, landmarks_est, raw_measurements, sim_t
     plt.plot(r_x_est, r_y_est, ".g")
     plt.plot([r_x_est, r_x_est + length * np.cos(r_alpha_est)], [r_y_est, r_y_est + length * np.sin(r_alpha_est)], "-g")
 
+    # plot recent estimated trajectory (view of the history buffer, no copy)
+    if getattr(estimator, "history", None) is not None:
+        poses = estimator.history.samples()["pose"]
+        plt.plot(poses[:, 0], poses[:, 1], "-g", alpha=0.4)
+
     # plot 2 sigma robot state uncertainty bounds
     confidence_ellipse(mean=estimator.X[:2], cov=estimator.P[:2, :2], ax=plt.gca(), n_std=2, facecolor="none", edgecolor="g", alpha=0.4)
     # confidence_ellipse(mean=estimator.X[:2], cov=np.array([[0.3, 0.], [0., 0.2]]), ax=plt.gca(), n_std=2, facecolor="none", edgecolor="k", alpha=0.4)
@@ -56,7 +68,7 @@ def display(r, estimator, landmarks_true, landmarks_est, raw_measurements, sim_t
         meas_dist, meas_angle = raw_measurements[j]
         plt.plot(landmk_x, landmk_y, "xb")
         plt.text(landmk_x, landmk_y, '{landmk_id}: ({dist:0.2f},{angle:0.1f})'.
-                 format(landmk_id=j, dist=meas_dist, angle=np.rad2deg(meas_angle)),
+                 format(landmk_id=landmark_ids[j], dist=meas_dist, angle=np.rad2deg(meas_angle)),
                  transform=trans_offset)
 
         # plot estimated landmarks
@@ -105,24 +117,45 @@ def main():
     min_y = 0.
     max_y = 10.
     num_landmarks = 2
-    landmarks_true = np.random.random_sample((num_landmarks, 2))
-    landmarks_true[:, 0] = min_x + landmarks_true[:, 0] * (max_x - min_x)
-    landmarks_true[:, 1] = min_y + landmarks_true[:, 1] * (max_y - min_y)
+    landmarks_true = generate_landmarks(num_landmarks, (min_x, min_y, max_x, max_y), seed=20)
+
+    # range-bearing sensor: only the landmarks within max range and field of view are measured, found with a spatial
+    # grid, so that sensing cost does not grow with the size of the landmark field
+    max_range = 20.             # [m]
+    field_of_view = 2 * np.pi   # [rad]
+    world = LandmarkGrid(landmarks_true, cell_size=max_range)
+
+    # SLAM estimator: "ekf" (EKF-SLAM) or "fastslam" (particle filter, for strongly nonlinear motion such as
+    # circle_with_noise)
+    estimator_type = "ekf"
 
-    # EKF-SLAM estimator
+    if estimator_type == "ekf":
+        est = EKFSLAM(landmark_capacity=num_landmarks)
+    elif estimator_type == "fastslam":
+        est = FastSLAM(num_particles=200, landmark_capacity=num_landmarks, seed=20)
+    else:
+        raise ValueError("Use valid estimator type")
 
-    est = EKFSLAM()
     est.X = np.concatenate([r_true, est.X[3:]])     # we know the true robot pose initially
     est.P = np.zeros((3, 3)) * 1.
     est.Q = np.array([[u_x_stddev ** 2, 0], [0, u_alpha_stddev ** 2]])
     est.R = np.array([[range_meas_stddev ** 2, 0], [0, bearing_meas_stddev ** 2]])
 
-    # simulate robot
-    for i in range(int(sim_duration / time_step)):
-        t_start = time.time()
+    # keep a bounded-memory history of the estimates (every step for the last 4096 steps, and downsampled before that)
+    est.history = HistoryRecorder(capacity=4096, landmark_ids=range(num_landmarks))
+
+    # report when the filter becomes inconsistent (NIS of the updates, and NEES using the true robot pose)
+    est.monitor = ConsistencyMonitor(window=20, on_alert=lambda alert: print("Consistency alert:", alert))
+
+    # generate control input
+    control_input_type = "straight_with_noise"
+
+    def read_odometry(t):
+        """
+        Generate the control input at time t, and move the (true) robot
+        """
 
-        # generate control input
-        control_input_type = "straight_with_noise"
+        nonlocal r_true, d_alpha
 
         if control_input_type == "straight_with_noise":
             u = [2. * time_step, 0]
@@ -152,28 +185,48 @@ def main():
         # move robot
         r_true = move(r_true, u, n)
 
-        # propagate EKF
-        est.state_and_state_cov_propagation(u)
+        return u
 
-        print("States:", est.X, "\nP:", est.P)
+    raw_measurements = []
+    visible_ids = []
+    visible_landmarks = np.zeros((0, 2))
 
-        # sensor readings of environment
-        raw_measurements = [rbs.observe_range_bearing(r_true, landmarks_true[j, :])
-                            for j in range(landmarks_true.shape[0])]        # TODO: add some noise to the measurements
+    def read_range_bearing(t):
+        """
+        Generate the range-bearing sensor readings of the landmarks in view at time t
+        """
 
-        # measurement update of EKF
-        # TODO: need to first add the landmarks before we can update them
-        # [est.measurement_update_range_bearing(y, ii) for ii, y in enumerate(raw_measurements)]
+        nonlocal visible_landmarks
 
-        # estimated landmark positions (by using estimated robot pose and inverse sensor measurements)
-        landmarks_est = [rbs.inv_observe_range_bearing(r_true, m) for m in raw_measurements]        # TODO: use estimated robot pose?
+        ids, visible_landmarks = world.visible(r_true, max_range, field_of_view)
+        visible_ids[:] = ids.tolist()
+        raw_measurements[:] = list(np.asarray(rbs.observe_range_bearing_batch(np.asarray(r_true), visible_landmarks,
+                                                                              ctx=PoseContext(r_true))))
+        # TODO: add some noise to the measurements
+
+        return np.array(raw_measurements).reshape(-1, 2), list(visible_ids)
+
+    def on_update(t, estimator):
+        print("Time:", t, "Pose:", estimator.X[:3], "Pose std:", np.sqrt(np.diag(estimator.robot_covariance())))
+        estimator.monitor.record_pose_error(estimator.X[:3] - r_true, estimator.robot_covariance(), step=t)
+        print("NIS (window mean):", estimator.monitor.mean_nis(), "NEES (window mean):", estimator.monitor.mean_nees())
 
-        print(time.time() - t_start)
+        # estimated landmark positions (by using estimated robot pose and inverse sensor measurements)
+        ctx = PoseContext(r_true)
+        landmarks_est = [rbs.inv_observe_range_bearing(r_true, m, ctx=ctx) for m in raw_measurements]        # TODO: use estimated robot pose?
 
         # plot robot and map
-        if i % 5 == 0:
-            print(i, "current pose:", r_true, ", control input:", u, ", noise:", n)
-            display(r_true, est, landmarks_true, landmarks_est, raw_measurements, i)
+        print(t, "current pose:", r_true)
+        display(r_true, estimator, visible_ids, visible_landmarks, landmarks_est, raw_measurements, t)
+
+    # simulate robot, with the EKF propagated at the odometry rate and updated at the measurement rate
+    scheduler = Scheduler(est, on_update=on_update)
+    scheduler.add_control_source(time_step, read_odometry, offset=time_step)
+    scheduler.add_measurement_source(measurement_period, read_range_bearing, offset=time_step)
+
+    t_start = time.time()
+    scheduler.run(until=sim_duration)
+    print(time.time() - t_start)
 
 
 if __name__ == "__main__":
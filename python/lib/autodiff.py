@@ -0,0 +1,187 @@
+# Jacobians of the motion and sensor models by automatic differentiation (jax.jacfwd), as an alternative to the
+# hand-written ones
+#
+# The Jacobian functions are jit-compiled, mapped over landmarks with jax.vmap, and cached per model function and
+# signature, so that compilation is paid once per process (and again only for new array shapes). The models must be
+# traceable by JAX, so USE_JAX must be set. JAX is imported on first use.
+#
+# Each call of a compiled function has a fixed cost per argument and result (of the order of microseconds), which is
+# significant next to the small 3 x 3 and per-landmark arithmetic of a step. The robot propagation (pose, F_x and P_rr)
+# and the linearisation of a range-bearing scan (innovations and Jacobians) are therefore each one compiled function,
+# with inputs and outputs packed into a single vector.
+
+from functools import lru_cache
+
+import numpy as onp
+
+from python.lib import backend
+from python.lib.kernels import NumpyKernels
+from python.lib.sensors import RangeBearingSensor
+
+
+def check_autodiff_available():
+    """
+    Check that the models run on JAX, so that they can be differentiated
+    """
+
+    if not backend.USE_JAX:
+        raise RuntimeError("Autodiff Jacobians need the models to run on JAX: set USE_JAX=True (and "
+                           "JAX_ENABLE_X64=True)")
+
+
+@lru_cache(maxsize=None)
+def value_and_jacobians(function, argnums, in_axes=None):
+    """
+    Compiled function returning the value of function and its Jacobians w.r.t. the arguments argnums
+
+    Results are cached per (function, argnums, in_axes), and jax.jit caches the compiled code per argument shapes and
+    dtypes, so each model is traced and compiled once per process.
+
+    :param function: model function, traceable by JAX
+    :param argnums: tuple of indices of the arguments to differentiate w.r.t.
+    :param in_axes: if given, the function is mapped over these axes of the arguments (see jax.vmap), e.g. (None, 0) to
+    evaluate it for one robot pose and many landmarks
+    :return: compiled function f(*args) -> (value, (J_0, J_1, ...))
+    """
+
+    import jax
+
+    def evaluate(*args):
+        return function(*args), jax.jacfwd(function, argnums=argnums)(*args)
+
+    if in_axes is not None:
+        evaluate = jax.vmap(evaluate, in_axes=in_axes)
+
+    return jax.jit(evaluate)
+
+
+@lru_cache(maxsize=None)
+def robot_propagation_function(state_propagation):
+    """
+    Compiled propagation of the robot pose and its covariance
+
+    :param state_propagation: state transition function f(X, U, n), traceable by JAX
+    :return: compiled function of the packed vector (X_r (3), U (2), n (2), P_rr (9), Q (4)) returning the packed vector
+    (f(X_r, U, n) (3), F_x (9), F_x P_rr F_x^T + F_n Q F_n^T (9))
+    """
+
+    import jax
+    import jax.numpy as jnp
+
+    def propagate(packed):
+        X_r, U, n = packed[:3], packed[3:5], packed[5:7]
+        P_rr, Q = packed[7:16].reshape(3, 3), packed[16:20].reshape(2, 2)
+
+        F_x, F_n = jax.jacfwd(state_propagation, argnums=(0, 2))(X_r, U, n)
+        P_rr_new = jnp.dot(jnp.dot(F_x, P_rr), F_x.T) + jnp.dot(jnp.dot(F_n, Q), F_n.T)
+
+        return jnp.concatenate([state_propagation(X_r, U, n), F_x.ravel(), ((P_rr_new + P_rr_new.T) / 2).ravel()])
+
+    return jax.jit(propagate)
+
+
+def robot_propagation(state_propagation, X_r, U, n, P_rr, Q):
+    """
+    Propagate the robot pose and its covariance one time step, with F_x and F_n by automatic differentiation (one
+    compiled call)
+
+    :param state_propagation: state transition function f(X, U, n) (e.g. EKFSLAM.state_propagation)
+    :param X_r: robot pose (3,)
+    :param U: control input (2,)
+    :param n: input noise (2,)
+    :param P_rr: covariance of the robot pose (3, 3)
+    :param Q: covariance of the input noise (2, 2)
+    :return: f(X_r, U, n) (3,), F_x (3, 3) and the propagated (symmetrised) P_rr (3, 3) (NumPy arrays)
+    """
+
+    packed = onp.concatenate([onp.asarray(a, dtype=onp.float64).ravel() for a in (X_r, U, n, P_rr, Q)])
+    result = onp.asarray(robot_propagation_function(state_propagation)(packed))
+
+    return result[:3], result[3:12].reshape(3, 3), result[12:].reshape(3, 3)
+
+
+def inverse_observation_jacobians(X_r, Y):
+    """
+    Landmark positions from range-bearing measurements, and the Jacobians of the inverse observation function w.r.t.
+    robot pose and measurement (mapped over the measurements)
+
+    :param X_r: robot pose (3,)
+    :param Y: range-bearing measurements (K, 2)
+    :return: L (K, 2), G_r (K, 2, 3) and G_y (K, 2, 2) (NumPy arrays)
+    """
+
+    L, (G_r, G_y) = value_and_jacobians(RangeBearingSensor.inv_observe_range_bearing, (0, 1), (None, 0))(
+        onp.asarray(X_r, dtype=onp.float64), onp.asarray(Y, dtype=onp.float64))
+
+    return onp.asarray(L), onp.asarray(G_r), onp.asarray(G_y)
+
+
+@lru_cache(maxsize=None)
+def range_bearing_linearisation_function():
+    """
+    Compiled linearisation of range-bearing measurements
+
+    :return: compiled function of the packed vector (X_r (3), L (2K), Y (2K)) returning the packed vector
+    (innovations z (2K), H_R (6K), H_L (4K)), with the bearing innovations wrapped to [-pi, pi)
+    """
+
+    import jax
+    import jax.numpy as jnp
+
+    observe = value_and_jacobians(RangeBearingSensor.observe_range_bearing, (0, 1), (None, 0))
+
+    def linearise(packed):
+        K = (packed.shape[0] - 3) // 4
+        X_r, L, Y = packed[:3], packed[3:3 + 2 * K].reshape(K, 2), packed[3 + 2 * K:].reshape(K, 2)
+
+        h, (H_R, H_L) = observe(X_r, L)
+        z = Y - h
+        z = z.at[:, 1].set((z[:, 1] + jnp.pi) % (2 * jnp.pi) - jnp.pi)
+
+        return jnp.concatenate([z.ravel(), H_R.ravel(), H_L.ravel()])
+
+    return jax.jit(linearise)
+
+
+class AutodiffKernels(NumpyKernels):
+    """
+    Measurement update kernels with the observation Jacobians derived from RangeBearingSensor.observe_range_bearing
+    by automatic differentiation (see kernels.NumpyKernels for the interface)
+    """
+
+    name = "autodiff"
+    uses_pose_context = False
+
+    @staticmethod
+    def observe_jacobians(X_r, L, ctx=None):
+        """
+        Predicted range-bearing measurements of landmarks and the Jacobians of the observation function
+
+        :param X_r: robot pose (3,)
+        :param L: landmark positions in world ref frame (K, 2)
+        :param ctx: not used (the compiled function computes the trigonometry of the pose itself)
+        :return: h (K, 2), H_R (K, 2, 3) w.r.t. robot pose and H_L (K, 2, 2) w.r.t. landmark position
+        """
+
+        h, (H_R, H_L) = value_and_jacobians(RangeBearingSensor.observe_range_bearing, (0, 1), (None, 0))(
+            onp.asarray(X_r, dtype=onp.float64), onp.asarray(L, dtype=onp.float64))
+
+        return onp.array(h), onp.asarray(H_R), onp.asarray(H_L)
+
+    @staticmethod
+    def linearise(X_r, L, Y, ctx=None):
+        """
+        Innovations and Jacobians of range-bearing measurements of landmarks (one compiled call)
+
+        :param X_r: robot pose (3,)
+        :param L: landmark positions in world ref frame (K, 2)
+        :param Y: measurements (K, 2)
+        :param ctx: not used
+        :return: innovations z (K, 2), H_R (K, 2, 3) and H_L (K, 2, 2)
+        """
+
+        K = Y.shape[0]
+        packed = onp.concatenate([onp.asarray(a, dtype=onp.float64).ravel() for a in (X_r[:3], L, Y)])
+        result = onp.array(range_bearing_linearisation_function()(packed))
+
+        return result[:2 * K].reshape(K, 2), result[2 * K:8 * K].reshape(K, 2, 3), result[8 * K:].reshape(K, 2, 2)
@@ -0,0 +1,25 @@
+# Array backend selection shared by the library modules
+
+import os
+
+# Set USE_JAX to run the library on jax.numpy (needed for automatic differentiation), otherwise NumPy is used.
+# JAX is only imported when it is requested, so that NumPy-only runs do not pay its import cost.
+USE_JAX = bool(os.environ.get("USE_JAX", False))
+
+
+def check_jax_x64():
+    """
+    Check that JAX is set to 64-bit precision
+
+    :return:
+    """
+
+    from jax import config
+    assert config.jax_enable_x64, "Set JAX_ENABLE_X64=True to run JAX in 64-bit precision"
+
+
+if USE_JAX:
+    import jax.numpy as np
+    check_jax_x64()
+else:
+    import numpy as np
@@ -0,0 +1,108 @@
+# Batch simulation of drones flying a random walk, mirroring the C++ simulator (sim::Drone in src/vehicles.cpp and
+# main.cpp)
+#
+# Every time step each velocity component changes by a sample of N(0, (0.2 MAX_VEL)^2), then the position is integrated
+# with the new velocity. Records have the same layout as the C++ Pose struct written to sim.dat (format '=3f3fi':
+# position, velocity, time step), so files written here can be read by plot_sim_data.py.
+
+import struct
+
+import numpy as np
+
+SIMULATION_TIMESTEP = 0.02      # timestep of the simulation [s] (Core::SIMULATION_TIMESTEP)
+SIMULATION_DURATION = 5.        # length of the simulation [s] (Core::SIMULATION_DURATION)
+MAX_VEL = 0.5                   # [m/s] (sim::Drone::MAX_VEL)
+
+STRUCT_FMT = "=3f3fi"           # float[3], float[3], int
+RECORD_DTYPE = np.dtype([("pos", "=f4", (3,)), ("vel", "=f4", (3,)), ("timestep", "=i4")])
+
+assert RECORD_DTYPE.itemsize == struct.calcsize(STRUCT_FMT)
+
+
+def simulate_drones(num_drones, num_timesteps=int(SIMULATION_DURATION / SIMULATION_TIMESTEP), seeds=None,
+                    time_step=SIMULATION_TIMESTEP, max_vel=MAX_VEL, pos=None, vel=None):
+    """
+    Simulate several drones, each with its own random number generator, in one vectorised computation
+
+    As in main.cpp, record t holds the state before step t is applied, so record 0 is the initial state.
+
+    :param num_drones: number of drones K
+    :param num_timesteps: number of time steps T
+    :param seeds: one seed per drone (K values). Drone k's trajectory only depends on seeds[k], so it is the same when
+    simulated with other drones. If None, drones are seeded 0, ..., K - 1.
+    :param time_step: simulation time step [s]
+    :param max_vel: maximum velocity [m/s], which sets the velocity random walk standard deviation to 0.2 max_vel
+    :param pos: initial positions (K, 3) or (3,) [m]. Defaults to zero.
+    :param vel: initial velocities (K, 3) or (3,) [m/s]. Defaults to zero.
+    :return: records (K, T) of RECORD_DTYPE
+    """
+
+    if seeds is None:
+        seeds = range(num_drones)
+
+    seeds = list(seeds)
+    if len(seeds) != num_drones:
+        raise ValueError("Need one seed per drone")
+
+    # random changes in velocity of the T - 1 steps between the recorded states
+    d_vel = np.empty((num_drones, max(num_timesteps - 1, 0), 3))
+    for k, seed in enumerate(seeds):
+        d_vel[k] = np.random.default_rng(seed).normal(0., 0.2 * max_vel, size=d_vel.shape[1:])
+
+    pos_0 = np.broadcast_to(np.zeros(3) if pos is None else pos, (num_drones, 3))
+    vel_0 = np.broadcast_to(np.zeros(3) if vel is None else vel, (num_drones, 3))
+
+    # vel[t] = vel[0] + sum of the velocity changes before t, and pos[t + 1] = pos[t] + time_step * vel[t + 1]
+    vels = np.empty((num_drones, num_timesteps, 3))
+    vels[:, :1] = vel_0[:, None]
+    np.cumsum(d_vel, axis=1, out=vels[:, 1:])
+    vels[:, 1:] += vel_0[:, None]
+
+    positions = np.empty_like(vels)
+    positions[:, :1] = pos_0[:, None]
+    np.cumsum(time_step * vels[:, 1:], axis=1, out=positions[:, 1:])
+    positions[:, 1:] += pos_0[:, None]
+
+    records = np.empty((num_drones, num_timesteps), dtype=RECORD_DTYPE)
+    records["pos"] = positions
+    records["vel"] = vels
+    records["timestep"] = np.arange(num_timesteps)
+
+    return records
+
+
+def write_sim_data(path, records):
+    """
+    Write records in the binary layout of sim.dat
+
+    :param path: file path
+    :param records: records of one drone (T,), or of several drones (K, T), written one drone after the other
+    :return:
+    """
+
+    np.ascontiguousarray(records, dtype=RECORD_DTYPE).tofile(path)
+
+
+def read_sim_data(path, num_drones=1):
+    """
+    Read records from a file in the binary layout of sim.dat (e.g. written by the C++ simulator or write_sim_data)
+
+    :param path: file path
+    :param num_drones: number of drones in the file (records are split into equal blocks, one per drone)
+    :return: records (T,) if num_drones is 1, otherwise (K, T)
+    """
+
+    records = np.fromfile(path, dtype=RECORD_DTYPE)
+
+    return records if num_drones == 1 else records.reshape(num_drones, -1)
+
+
+def records_to_tracks(records):
+    """
+    Convert records to state tracks
+
+    :param records: records (..., T) of RECORD_DTYPE
+    :return: tracks (..., T, 6) of [position; velocity] (float64)
+    """
+
+    return np.concatenate([records["pos"], records["vel"]], axis=-1).astype(np.float64)
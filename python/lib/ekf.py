@@ -1,14 +1,13 @@
-import os
-if os.environ.get("USE_JAX", False):
-    import jax.numpy as np
-    from jax.config import config
-    # check that JAX is set to 64-bit precision
-    assert config.values["jax_enable_x64"]
-else:
-    import numpy as np
-
-from python.lib.robot import move
+import numbers
+
+import numpy as onp
+
+from python.lib.autodiff import check_autodiff_available, inverse_observation_jacobians, robot_propagation
+from python.lib.backend import np
+from python.lib.kernels import get_kernels
+from python.lib.robot import move_batch
 from python.lib.sensors import RangeBearingSensor
+from python.lib.transforms import PoseContext
 
 
 class EKFSLAM:
@@ -16,14 +15,50 @@ class EKFSLAM:
     This EKF-SLAM estimator is based on https://jinyongjeong.github.io/images/post/SLAM/lec05_EKF_SLAM/EKF.pdf.
     """
 
-    def __init__(self):
+    def __init__(self, landmark_capacity=0, dtype=onp.float64, kernels=None, jacobians="analytic"):
+        """
+        :param landmark_capacity: number of landmarks to preallocate space for in the state vector and state
+        covariance matrix. Space is grown automatically (by doubling) if more landmarks are added.
+        :param dtype: data type of the state covariance matrix. With np.float32 (mixed precision), P takes half the
+        memory, while the 3x3 robot pose block and the innovation solves are still computed in float64.
+        :param kernels: kernel backend used by the measurement update: "numpy", "numba" or "auto" (see
+        kernels.get_kernels). If None, it is taken from the EKF_KERNELS environment variable (default "numpy").
+        :param jacobians: "analytic" to use the hand-written Jacobians, or "autodiff" to derive them from
+        state_propagation and the range-bearing observation functions with JAX (jit-compiled and cached per process,
+        see autodiff.py; needs USE_JAX). With "autodiff", kernels defaults to "autodiff".
+        """
+
+        if jacobians not in ("analytic", "autodiff"):
+            raise ValueError("Unknown Jacobians: {}".format(jacobians))
+        if jacobians == "autodiff":
+            check_autodiff_available()
+            kernels = "autodiff" if kernels is None else kernels
+        self.jacobians = jacobians
+
+        # X and P are stored in preallocated buffers (always mutable NumPy arrays, even when the models run on JAX),
+        # so that adding landmarks writes into spare space rather than rebuilding P. self.X and self.P are views of
+        # the active part of these buffers.
+        self.dtype = onp.dtype(dtype)
+        self._dim = 3
+        self._F_pending = None
+        self._X_buf = onp.zeros(3 + 2 * landmark_capacity, dtype=onp.float64)
+        self._P_buf = onp.zeros((3 + 2 * landmark_capacity, 3 + 2 * landmark_capacity), dtype=self.dtype)
+
+        # in mixed precision, the robot pose block of P is kept in float64 here (and rounded into P)
+        self._P_rr = None if self.dtype == onp.float64 else onp.zeros((3, 3))
+
+        # version of the robot pose estimate, incremented whenever the estimator changes it, and the memoised
+        # PoseContext of the pose (see pose_context)
+        self._pose_version = 0
+        self._pose_ctx = None
+
         # state vector (start off not seeing any landmarks).
         # In general X = [R; M], where R (x, y, angle) is the robot pose and M (L_0, ..., L_n) are the landmark
         # positions.
-        self.X = np.array([0, 0, 0.], dtype=np.float64)
+        self.X = onp.array([0, 0, 0.], dtype=onp.float64)
 
         # state covariance matrix
-        self.P = np.zeros((3, 3), dtype=np.float64)
+        self.P = onp.zeros((3, 3), dtype=onp.float64)
 
         # process noise covariance matrix
         self.Q = np.eye(2, 2, dtype=np.float64)
@@ -37,6 +72,156 @@ class EKFSLAM:
         # Landmark index is calculated from its index in this list. ID of landmark is the value stored in the list.
         self.landmark_lookup = []
 
+        # number of prediction steps run so far, and the step at which each landmark (by ID) was last observed and
+        # how many times it has been observed. These are used by the landmark pruning policies.
+        self.num_steps = 0
+        self.landmark_last_observed = {}
+        self.landmark_num_observations = {}
+
+        # If True, prediction only propagates the robot pose block of P on every time step, and accumulates the product
+        # of the F_x Jacobians. The product is applied to the O(n) robot to map cross covariance only once, when P is
+        # next needed (a measurement update, adding or removing landmarks, or reading self.P).
+        self.defer_cross_covariance = False
+
+        # If set, the number of landmarks is kept at or below max_landmarks whenever landmarks are added, by removing
+        # the landmarks selected by landmark_pruning_policy(estimator, num_landmarks_to_remove).
+        self.max_landmarks = None
+        self.landmark_pruning_policy = farthest_landmarks
+
+        # optional log of the robot pose estimates and Jacobians of each prediction step, for smoothing (see
+        # smoother.TrajectoryLog)
+        self.trajectory_log = None
+
+        # optional consistency monitor (see monitor.ConsistencyMonitor), which records the NIS of every update
+        self.monitor = None
+
+        # optional bounded-memory history of the robot pose, its covariance and selected landmarks, recorded at the
+        # start of every prediction step (see history.HistoryRecorder)
+        self.history = None
+
+        # kernels for the observation Jacobians, innovation and covariance update (NumPy, or compiled with numba)
+        self.kernels = get_kernels(kernels)
+
+    @property
+    def X(self):
+        """
+        State vector [R; M] (view of the active part of the preallocated state buffer)
+        """
+
+        return self._X_buf[:self._dim]
+
+    @X.setter
+    def X(self, X):
+        X = onp.asarray(X, dtype=onp.float64)
+
+        if X.ndim != 1 or X.shape[0] < 3 or (X.shape[0] - 3) % 2 != 0:
+            raise ValueError("X must be a vector of the robot pose (3 states) followed by 2 states per landmark")
+
+        self._reserve(X.shape[0])
+        self._dim = X.shape[0]
+        self._X_buf[:self._dim] = X
+        self._pose_version += 1
+
+    @property
+    def P(self):
+        """
+        State covariance matrix (view of the active part of the preallocated covariance buffer)
+        """
+
+        self.flush_propagation()
+
+        return self._P_buf[:self._dim, :self._dim]
+
+    @P.setter
+    def P(self, P):
+        P = onp.asarray(P, dtype=onp.float64)
+
+        if P.shape != (self._dim, self._dim):
+            raise ValueError("P must have shape ({n}, {n}) to match X".format(n=self._dim))
+
+        self._F_pending = None
+        self._P_buf[:self._dim, :self._dim] = P
+        if self._P_rr is not None:
+            self._P_rr = P[:3, :3].copy()
+
+    def robot_covariance(self):
+        """
+        Covariance of the robot pose (float64, also in mixed precision)
+
+        :return: P_rr (3x3)
+        """
+
+        return self._P_buf[:3, :3].astype(onp.float64) if self._P_rr is None else self._P_rr.copy()
+
+    def pose_context(self):
+        """
+        PoseContext (sin, cos, rotation matrix) of the robot pose estimate, shared by the sensor and Jacobian functions
+        evaluated at it. It is memoised until the estimator next changes the pose (prediction, measurement update or
+        setting X). After writing to X[:3] in place, set X again so that the change is seen.
+
+        :return: PoseContext
+        """
+
+        if self._pose_ctx is None or self._pose_ctx.version != self._pose_version:
+            self._pose_ctx = PoseContext(self.X[:3].copy(), self._pose_version)
+
+        return self._pose_ctx
+
+    def _reserve(self, dim):
+        """
+        Ensure the state buffers can hold at least dim states, growing them (by doubling) if necessary
+
+        :param dim: required number of states
+        :return:
+        """
+
+        capacity = self._X_buf.shape[0]
+        if dim <= capacity:
+            return
+
+        new_capacity = max(dim, 2 * capacity)
+        X_buf = onp.zeros(new_capacity, dtype=self._X_buf.dtype)
+        P_buf = onp.zeros((new_capacity, new_capacity), dtype=self._P_buf.dtype)
+        X_buf[:self._dim] = self._X_buf[:self._dim]
+        P_buf[:self._dim, :self._dim] = self._P_buf[:self._dim, :self._dim]
+        self._X_buf, self._P_buf = X_buf, P_buf
+
+    def _adopt_buffers(self, X, P_buf, P_rr=None):
+        """
+        Take over a covariance buffer (e.g. a memory map) and set the state vector, without copying P
+
+        :param X: state vector (n,)
+        :param P_buf: state covariance matrix (n x n) of the estimator's dtype, used as the covariance buffer
+        :param P_rr: covariance of the robot pose in float64 (used in mixed precision; defaults to P_buf[:3, :3])
+        :return:
+        """
+
+        X = onp.asarray(X, dtype=onp.float64)
+        n = X.shape[0]
+
+        if X.ndim != 1 or n < 3 or (n - 3) % 2 != 0:
+            raise ValueError("X must be a vector of the robot pose (3 states) followed by 2 states per landmark")
+        if P_buf.shape != (n, n) or P_buf.dtype != self.dtype:
+            raise ValueError("P_buf must be a ({n}, {n}) array of {dtype}".format(n=n, dtype=self.dtype))
+
+        self._X_buf = X.copy()
+        self._P_buf = P_buf
+        self._dim = n
+        self._F_pending = None
+        if self._P_rr is not None:
+            self._P_rr = onp.array(P_buf[:3, :3] if P_rr is None else P_rr, dtype=onp.float64)
+        self._pose_version += 1
+
+    def reserve_landmarks(self, num_landmarks):
+        """
+        Preallocate space for a total of num_landmarks landmarks, so that adding them does not reallocate X and P
+
+        :param num_landmarks: total number of landmarks to make space for
+        :return:
+        """
+
+        self._reserve(3 + 2 * num_landmarks)
+
     def get_num_landmarks(self):
         """
         Return number of landmarks
@@ -54,28 +239,253 @@ class EKFSLAM:
         :return:
         """
 
-        return self.landmark_lookup[i + 3]
+        return self.landmark_lookup[i]
+
+    def get_landmark_index(self, landmark_id):
+        """
+        Get the index of the landmark with the given ID
+
+        :param landmark_id: landmark ID
+        :return: landmark index (its states are X[3 + 2*i: 3 + 2*(i+1)])
+        """
+
+        return self.landmark_lookup.index(landmark_id)
 
     def new_landmark_range_bearing(self, y_meas, landmark_id=None):
         """
         Append new landmark to the state vector and state covariance matrix
 
-        This assumes a measurement is obtained using a range-bearing sensor
+        This assumes a measurement is obtained using a range-bearing sensor. The landmark mean is obtained from the
+        inverse observation function g(X_r, y) and, with G_r and G_y the Jacobians of g w.r.t. robot pose and
+        measurement, the covariance is augmented with:
+
+            P_LL = G_r P_rr G_r^T + G_y R G_y^T
+            P_Lx = G_r P_rx
 
-        :param landmark_id: unique value. If None, a unique value is created here
+        where x is the existing state (robot and map). This is O(n) and is written into the preallocated space of P.
+
+        :param landmark_id: unique value (if None, one more than the largest integer ID in the map)
         :param y_meas: measurement of new landmark using range-bearing sensor
-        :return:
+        :return: ID of the new landmark
         """
 
         if landmark_id is None:
-            raise NotImplementedError("Need to still implement this. Must generate a new unique ID.")
+            landmark_id = max((int(l) for l in self.landmark_lookup if isinstance(l, numbers.Integral)), default=-1) + 1
 
         if landmark_id in self.landmark_lookup:
             raise ValueError("Landmark ID already exists. Must be unique.")
 
+        self.flush_propagation()
+        n = self._dim
+        self._reserve(n + 2)
+
+        X_r = self._X_buf[:3]
+        x_r, y_r, alpha_r = X_r
+        rho, psi = y_meas
+        ctx = self.pose_context()
+
+        if self.jacobians == "autodiff":
+            L, G_r, G_y = inverse_observation_jacobians(X_r, onp.asarray(y_meas, dtype=onp.float64).reshape(1, 2))
+            L_i, G_r, G_y = L[0], G_r[0], G_y[0]
+        else:
+            L_i = RangeBearingSensor.inv_observe_range_bearing(X_r, onp.asarray(y_meas, dtype=onp.float64), ctx=ctx)
+            G_r = RangeBearingSensor.jacobian_G_X_r(x_r=x_r, y_r=y_r, alpha_r=alpha_r, rho=rho, psi=psi, ctx=ctx)
+            G_y = RangeBearingSensor.jacobian_G_y_i(x_r=x_r, y_r=y_r, alpha_r=alpha_r, rho=rho, psi=psi, ctx=ctx)
+
+        # cross covariance of new landmark and all existing states (robot and map)
+        P_Lx = np.dot(G_r, self._P_buf[:3, :n])
+
+        # covariance of new landmark
+        P_LL = np.dot(np.dot(G_r, self.robot_covariance()), G_r.T) + np.dot(np.dot(G_y, self.R), G_y.T)
+
+        self._X_buf[n:n + 2] = L_i
+        self._P_buf[n:n + 2, :n] = P_Lx
+        self._P_buf[:n, n:n + 2] = P_Lx.T
+        self._P_buf[n:n + 2, n:n + 2] = (P_LL + P_LL.T) / 2
+        self._dim = n + 2
+
         self.landmark_lookup.append(landmark_id)
+        self._landmarks_observed([landmark_id])
+        self.enforce_max_landmarks()
 
-        # self.X = np.concatenate([self.X, L_est_i])
+        return landmark_id
+
+    def new_landmarks_range_bearing(self, Y_meas, landmark_ids):
+        """
+        Append several new landmarks, observed in the same range-bearing scan, to the state vector and state covariance
+        matrix in one step
+
+        This is equivalent to calling new_landmark_range_bearing for each landmark in turn, but the K landmark means
+        and stacked Jacobians G_r (2K x 3) and G_y are computed in one vectorised pass and the state grows by 2K at
+        once:
+
+            P_LL = G_r P_rr G_r^T + blockdiag(G_y_k R G_y_k^T)
+            P_Lx = G_r P_rx
+
+        :param Y_meas: range-bearing measurements of the new landmarks (K, 2)
+        :param landmark_ids: unique IDs of the new landmarks (K values)
+        :return:
+        """
+
+        Y_meas = onp.asarray(Y_meas, dtype=onp.float64).reshape(-1, 2)
+        landmark_ids = list(landmark_ids)
+        K = Y_meas.shape[0]
+
+        if len(landmark_ids) != K:
+            raise ValueError("Need one landmark ID per measurement")
+
+        if len(set(landmark_ids)) != K or any(landmark_id in self.landmark_lookup for landmark_id in landmark_ids):
+            raise ValueError("Landmark ID already exists. Must be unique.")
+
+        if K == 0:
+            return
+
+        self._append_landmarks(*self._landmark_initialisation(self._X_buf[:3], Y_meas), landmark_ids)
+
+    def _append_landmarks(self, L, G_r, P_LL_y, landmark_ids):
+        """
+        Append new landmarks to the state vector and state covariance matrix
+
+        :param L: initial landmark positions (K, 2)
+        :param G_r: Jacobians of the landmark positions w.r.t. the robot pose (K, 2, 3)
+        :param P_LL_y: landmark covariances due to measurement noise (K, 2, 2)
+        :param landmark_ids: unique IDs of the new landmarks (K values)
+        :return:
+        """
+
+        K = len(landmark_ids)
+        self.flush_propagation()
+        n = self._dim
+        self._reserve(n + 2 * K)
+
+        G_r = onp.asarray(G_r).reshape(2 * K, 3)
+
+        # cross covariance of new landmarks and all existing states (robot and map)
+        P_Lx = onp.dot(G_r, self._P_buf[:3, :n])
+
+        # covariance of new landmarks (correlated with each other through the robot pose)
+        P_LL = onp.dot(onp.dot(G_r, self.robot_covariance()), G_r.T)
+        diag = onp.arange(K)
+        P_LL.reshape(K, 2, K, 2)[diag, :, diag, :] += P_LL_y
+
+        self._X_buf[n:n + 2 * K] = onp.asarray(L).ravel()
+        self._P_buf[n:n + 2 * K, :n] = P_Lx
+        self._P_buf[:n, n:n + 2 * K] = P_Lx.T
+        self._P_buf[n:n + 2 * K, n:n + 2 * K] = (P_LL + P_LL.T) / 2
+        self._dim = n + 2 * K
+
+        self.landmark_lookup.extend(landmark_ids)
+        self._landmarks_observed(landmark_ids)
+        self.enforce_max_landmarks()
+
+    def _landmark_initialisation(self, X_r, Y_meas):
+        """
+        Initial estimates of new landmarks from range-bearing measurements
+
+        :param X_r: robot pose estimate
+        :param Y_meas: range-bearing measurements (K, 2)
+        :return: landmark positions L (K, 2), Jacobians G_r (K, 2, 3) of the landmark positions w.r.t. the robot pose,
+        and the landmark covariances due to measurement noise, G_y R G_y^T (K, 2, 2)
+        """
+
+        if self.jacobians == "autodiff":
+            L, G_r, G_y = inverse_observation_jacobians(X_r, Y_meas)
+        else:
+            L = onp.asarray(RangeBearingSensor.inv_observe_range_bearing_batch(X_r, Y_meas))
+            G_r = onp.asarray(RangeBearingSensor.jacobian_G_X_r_batch(X_r, Y_meas))
+            G_y = onp.asarray(RangeBearingSensor.jacobian_G_y_i_batch(X_r, Y_meas))
+
+        return L, G_r, onp.einsum("kij,jl,kml->kim", G_y, self.R, G_y)
+
+    def _model_landmark_initialisation(self, model, X_r, Y_meas):
+        """
+        Initial estimates of new landmarks from the measurements of a sensor model (see _landmark_initialisation)
+
+        :param model: sensor model that can initialise landmarks (sensor_models.SensorModel)
+        :param X_r: robot pose estimate
+        :param Y_meas: measurements (K, model.dim)
+        :return: see _landmark_initialisation
+        """
+
+        L = onp.asarray(model.inverse_observe(X_r, Y_meas))
+        G_r, G_y = (onp.asarray(G) for G in model.inverse_jacobians(X_r, Y_meas))
+        R = onp.asarray(model.R, dtype=onp.float64)
+
+        return L, G_r, onp.einsum("kij,jl,kml->kim", G_y, R, G_y)
+
+    def _landmarks_observed(self, landmark_ids):
+        """
+        Record that landmarks were observed at the current step
+
+        :param landmark_ids: IDs of observed landmarks
+        :return:
+        """
+
+        for landmark_id in landmark_ids:
+            self.landmark_last_observed[landmark_id] = self.num_steps
+            self.landmark_num_observations[landmark_id] = self.landmark_num_observations.get(landmark_id, 0) + 1
+
+    def remove_landmarks(self, landmark_ids):
+        """
+        Remove (marginalise out) landmarks from the state vector and state covariance matrix
+
+        Marginalising a Gaussian just drops the rows and columns of the removed states, so the remaining states are
+        compacted in place within the preallocated buffers and the landmark indices are remapped.
+
+        :param landmark_ids: IDs of the landmarks to remove
+        :return:
+        """
+
+        remove = set(landmark_ids)
+        missing = remove.difference(self.landmark_lookup)
+        if missing:
+            raise ValueError("Unknown landmark IDs: {}".format(sorted(missing, key=str)))
+
+        if not remove:
+            return
+
+        self.flush_propagation()
+        keep = onp.ones(self._dim, dtype=bool)
+        for i, landmark_id in enumerate(self.landmark_lookup):
+            if landmark_id in remove:
+                keep[3 + 2 * i: 3 + 2 * (i + 1)] = False
+
+        # copy each contiguous run of kept states to its new position, first the rows and then the columns, so that no
+        # temporary copy of the full covariance matrix is needed
+        n = self._dim
+        edges = onp.flatnonzero(onp.diff(onp.concatenate([[False], keep, [False]]).astype(onp.int8)))
+        runs = list(zip(edges[::2], edges[1::2]))
+        dst = 0
+        for start, stop in runs:
+            self._X_buf[dst:dst + stop - start] = self._X_buf[start:stop]
+            self._P_buf[dst:dst + stop - start, :n] = self._P_buf[start:stop, :n]
+            dst += stop - start
+        m = dst
+        dst = 0
+        for start, stop in runs:
+            self._P_buf[:m, dst:dst + stop - start] = self._P_buf[:m, start:stop]
+            dst += stop - start
+        self._dim = m
+
+        self.landmark_lookup = [landmark_id for landmark_id in self.landmark_lookup if landmark_id not in remove]
+        for landmark_id in remove:
+            self.landmark_last_observed.pop(landmark_id, None)
+            self.landmark_num_observations.pop(landmark_id, None)
+
+    def enforce_max_landmarks(self):
+        """
+        Remove landmarks selected by the pruning policy until there are at most max_landmarks landmarks
+
+        :return: IDs of the removed landmarks
+        """
+
+        if self.max_landmarks is None or self.get_num_landmarks() <= self.max_landmarks:
+            return []
+
+        landmark_ids = list(self.landmark_pruning_policy(self, self.get_num_landmarks() - self.max_landmarks))
+        self.remove_landmarks(landmark_ids)
+
+        return landmark_ids
 
     @staticmethod
     def jacobian_f_X_r(x_u, x_n, alpha_r, alpha_u, alpha_n):
@@ -90,8 +500,10 @@ class EKFSLAM:
         :return:
         """
 
-        return np.array([[1, 0, -(x_n + x_u)*np.sin(alpha_n + alpha_r + alpha_u)],
-                        [0, 1,  (x_n + x_u)*np.cos(alpha_n + alpha_r + alpha_u)],
+        s, c = np.sin(alpha_n + alpha_r + alpha_u), np.cos(alpha_n + alpha_r + alpha_u)
+
+        return np.array([[1, 0, -(x_n + x_u)*s],
+                        [0, 1,  (x_n + x_u)*c],
                         [0, 0, 1]])
 
     @staticmethod
@@ -107,16 +519,49 @@ class EKFSLAM:
         :return:
         """
 
-        return np.array([[np.cos(alpha_n + alpha_r + alpha_u), -(x_n + x_u)*np.sin(alpha_n + alpha_r + alpha_u)],
-                        [np.sin(alpha_n + alpha_r + alpha_u),  (x_n + x_u)*np.cos(alpha_n + alpha_r + alpha_u)],
+        s, c = np.sin(alpha_n + alpha_r + alpha_u), np.cos(alpha_n + alpha_r + alpha_u)
+
+        return np.array([[c, -(x_n + x_u)*s],
+                        [s,  (x_n + x_u)*c],
                         [0, 1]])
 
+    @staticmethod
+    def jacobian_f_X_r_batch(x_u, x_n, alpha_r, alpha_u, alpha_n):
+        """
+        Vectorised version of jacobian_f_X_r. The arguments are broadcast together.
+
+        :return: Jacobians (..., 3, 3)
+        """
+
+        d_x, angle = np.broadcast_arrays(np.asarray(x_n + x_u), np.asarray(alpha_n + alpha_r + alpha_u))
+        one, zero = np.ones_like(angle), np.zeros_like(angle)
+
+        return np.stack([np.stack([one, zero, -d_x * np.sin(angle)], axis=-1),
+                         np.stack([zero, one, d_x * np.cos(angle)], axis=-1),
+                         np.stack([zero, zero, one], axis=-1)], axis=-2)
+
+    @staticmethod
+    def jacobian_f_N_batch(x_u, x_n, alpha_r, alpha_u, alpha_n):
+        """
+        Vectorised version of jacobian_f_N. The arguments are broadcast together.
+
+        :return: Jacobians (..., 3, 2)
+        """
+
+        d_x, angle = np.broadcast_arrays(np.asarray(x_n + x_u), np.asarray(alpha_n + alpha_r + alpha_u))
+        one, zero = np.ones_like(angle), np.zeros_like(angle)
+
+        return np.stack([np.stack([np.cos(angle), -d_x * np.sin(angle)], axis=-1),
+                         np.stack([np.sin(angle), d_x * np.cos(angle)], axis=-1),
+                         np.stack([zero, one], axis=-1)], axis=-2)
+
     @staticmethod
     def state_propagation(X, U, n=None):
         """
         Propagate the state estimates forward one time step using the control input
 
-        :param X: previous states
+        :param X: previous states. Leading dimensions of X, U and n are broadcast together, so a batch of states (e.g.
+        sigma points) can be propagated in one call.
         :param U: control input (d_x, d_alpha)
         :param n: perturbation to control input (d_x, d_alpha)
         :return:
@@ -124,12 +569,12 @@ class EKFSLAM:
 
         # ----------  propagate state vector (update robot pose but leave landmarks unchanged) -------
 
-        r = X[:3]
+        r = X[..., :3]
         if n is None:
             n = np.array([0, 0])
-        r_new = move(r, U, n)
+        r_new = move_batch(r, np.asarray(U), np.asarray(n))
         # X[:3] = r_new
-        X_new = np.concatenate((r_new, X[3:]))
+        X_new = np.concatenate((r_new, X[..., 3:]), axis=-1)
 
         return X_new
 
@@ -141,43 +586,137 @@ class EKFSLAM:
         :return:
         """
 
-        # ----------  propagate state vector (update robot pose but leave landmarks unchanged) -------
-
-        self.X = self.state_propagation(self.X, U)
-
-        # ----------- propagate state covariance matrix ------------------
-
         # The full state cov matrix propagation can be done as follows:
         # P_new = np.dot(np.dot(F_x, P), F_x.T) + np.dot(np.dot(F_n, N), F_n.T)
         # However, this is less efficient that way due to many zeros, since the landmarks do not move their
         # covariance is always zero and are unaffected by process noise. We can partition P as follows:
-        # P = [[P_rr, P_rm], [P_mr, P_mm]]. P_mm will always be zero.
+        # P = [[P_rr, P_rm], [P_mr, P_mm]]. P_mm is left unchanged.
+
+        self._accumulate_propagation(self._robot_step(U))
+
+    def state_and_state_cov_propagation_many(self, U_list):
+        """
+        Propagate the state estimates and state covariance matrix forward over several time steps, applying one
+        control input per time step
+
+        This gives the same result as calling state_and_state_cov_propagation for each control input, but the robot
+        to map cross covariance P_rm is only propagated once, using the product of the F_x Jacobians of all steps.
+
+        :param U_list: control inputs (d_x, d_alpha), in the order they are applied
+        :return:
+        """
+
+        for U in U_list:
+            self._accumulate_propagation(self._robot_step(U), flush=False)
+
+        if not self.defer_cross_covariance:
+            self.flush_propagation()
+
+    def _accumulate_propagation(self, F_x, flush=True):
+        """
+        Accumulate the F_x Jacobian of a time step into the product of Jacobians pending for the cross covariance
+
+        :param F_x: Jacobian of the state transition function w.r.t. robot pose
+        :param flush: whether to apply the pending product straight away (unless in deferred mode)
+        :return:
+        """
+
+        self._F_pending = F_x if self._F_pending is None else onp.dot(F_x, self._F_pending)
+
+        if flush and not self.defer_cross_covariance:
+            self.flush_propagation()
+
+    def flush_propagation(self):
+        """
+        Apply the pending product of F_x Jacobians to the cross covariance of robot pose and landmarks
+
+        :return:
+        """
+
+        if self._F_pending is not None:
+            F_x, self._F_pending = self._F_pending, None
+            self._cross_cov_propagation(F_x)
+
+    def _robot_step(self, U):
+        """
+        Propagate the robot pose and its covariance one time step, recording the step in history and trajectory_log
+        (if set)
+
+        :param U: control input (d_x, d_alpha)
+        :return: Jacobian F_x of the state transition function w.r.t. robot pose
+        """
+
+        if self.history is not None:
+            self.history.record(self)
+
+        self._pose_version += 1
+        if self.trajectory_log is None:
+            return self._robot_propagation(U)
+
+        X_r, P_rr = self.X[:3].copy(), self.robot_covariance()
+        F_x = self._robot_propagation(U)
+        self.trajectory_log.record(self.num_steps, X_r, P_rr, F_x, self.X[:3], self.robot_covariance())
+
+        return F_x
+
+    def _robot_propagation(self, U):
+        """
+        Propagate the robot pose and its covariance P_rr forward one time step (O(1))
+
+        :param U: control input (d_x, d_alpha)
+        :return: Jacobian F_x of the state transition function w.r.t. robot pose
+        """
 
         x_u, alpha_u = U
         x_n, alpha_n = 0, 0     # N     # TODO: do we have access to this?
-        alpha_r = self.X[2]     # TODO: should we use the state estimate from the previous timestep rather?
+        alpha_r = self.X[2]     # Jacobians are evaluated at the robot pose from the previous timestep
 
-        F_x = self.jacobian_f_X_r(x_u=x_u, x_n=x_n, alpha_r=alpha_r, alpha_u=alpha_u, alpha_n=alpha_n)
-        F_n = self.jacobian_f_N(x_u=x_u, x_n=x_n, alpha_r=alpha_r, alpha_u=alpha_u, alpha_n=alpha_n)
+        self.num_steps += 1
 
-        # update covariance of robot pose
-        P_rr = self.P[:3, :3]
-        P_rr_new = np.dot(np.dot(F_x, P_rr), F_x.T) + np.dot(np.dot(F_n, self.Q), F_n.T)
-        self.P[:3, :3] = P_rr_new
+        # ----------  propagate state vector (update robot pose but leave landmarks unchanged) -------
 
-        # only update cross variance elements if there are landmarks present
-        if self.X.shape[0] > 3:
-            # update cross variance of robot pose and landmarks (P_rm)
-            # NB: this step has algorithmic complexity of O(n)
-            P_rm = self.P[:2, 3:]
-            P_rm_new = np.dot(F_x, P_rm)
-            self.P[:2, 3:] = P_rm_new
+        if self.jacobians == "autodiff":
+            # pose, Jacobians and covariance of the robot pose all from one compiled call
+            X_r_new, F_x, P_rr_new = robot_propagation(self.state_propagation, self.X[:3], U, [x_n, alpha_n],
+                                                       self.robot_covariance(), self.Q)
+            self.X[:3] = X_r_new
+        else:
+            F_x = self.jacobian_f_X_r(x_u=x_u, x_n=x_n, alpha_r=alpha_r, alpha_u=alpha_u, alpha_n=alpha_n)
+            F_n = self.jacobian_f_N(x_u=x_u, x_n=x_n, alpha_r=alpha_r, alpha_u=alpha_u, alpha_n=alpha_n)
+            self.X[:3] = self.state_propagation(self.X[:3], U)
+
+            # ----------- propagate covariance of robot pose ------------------
+
+            F_x, F_n = onp.asarray(F_x), onp.asarray(F_n)
+            P_rr = self.robot_covariance()
+            P_rr_new = onp.dot(onp.dot(F_x, P_rr), F_x.T) + onp.dot(onp.dot(F_n, onp.asarray(self.Q)), F_n.T)
+
+            # symmetrise to ensure positive semi definite (NB: we could also store just a triangular matrix instead)
+            P_rr_new = (P_rr_new + P_rr_new.T) / 2
+
+        self._P_buf[:3, :3] = P_rr_new
+        if self._P_rr is not None:
+            self._P_rr = P_rr_new
 
-            # update cross variance of landmarks and robot pose (P_mr)
-            self.P[3:, :2] = P_rm_new.T
+        return F_x
 
-        # transpose to ensure positive semi definite (NB: we could also store just a triangular matrix instead)
-        self.P = (self.P + self.P.T) / 2    # TODO: should use 0.5P + o.5P.T instead
+    def _cross_cov_propagation(self, F_x):
+        """
+        Propagate the cross covariance of robot pose and landmarks (P_rm and P_mr)
+
+        NB: this step has algorithmic complexity of O(n)
+
+        :param F_x: Jacobian of the state transition function w.r.t. robot pose (or product of several of them)
+        :return:
+        """
+
+        P = self._P_buf[:self._dim, :self._dim]
+
+        # only update cross variance elements if there are landmarks present
+        if P.shape[0] > 3:
+            P_rm_new = onp.dot(F_x, P[:3, 3:])
+            P[:3, 3:] = P_rm_new
+            P[3:, :3] = P_rm_new.T
 
     def measurement_update_range_bearing(self, y_meas_i, i):
         """
@@ -188,22 +727,313 @@ class EKFSLAM:
         :return:
         """
 
-        # TODO: should create a hash code/ID for each landmark so that we can look up its position in the state vector
+        self.measurement_update_range_bearing_batch(onp.asarray(y_meas_i, dtype=onp.float64).reshape(1, 2), [i])
+
+    def measurement_update_range_bearing_batch(self, Y_meas, indices):
+        """
+        Perform one joint measurement update with range-bearing measurements of several landmarks
+
+        The measurements are linearised at the current estimate with one call of the observation kernel for all of
+        them, and the covariance is updated once (a rank-2K update, see _stacked_update).
+
+        :param Y_meas: range-bearing measurements (K, 2)
+        :param indices: indices of the landmarks that the measurements correspond to (K values)
+        :return:
+        """
+
+        Y_meas = onp.asarray(Y_meas, dtype=onp.float64).reshape(-1, 2)
+        l = 3 + 2 * onp.asarray(indices, dtype=onp.int64).reshape(-1)
+        if l.shape[0] != Y_meas.shape[0]:
+            raise ValueError("Need one landmark index per measurement")
+        if l.shape[0] == 0:
+            return
+
+        block, R_blocks = self._linearise_range_bearing(Y_meas, l)
+        self._stacked_update([block], R_blocks)
+        self._landmarks_observed([self.landmark_lookup[i] for i in (l - 3) // 2])
+
+    def _linearise_range_bearing(self, Y_meas, l):
+        """
+        Linearise range-bearing measurements of landmarks at the current estimate, with the observation kernel
+
+        This and _linearise are the linearisations of all batched and joint updates, so subclasses with another
+        linearisation (e.g. UKFSLAM) override them.
+
+        :param Y_meas: range-bearing measurements (K, 2)
+        :param l: state indices of the landmarks (K,)
+        :return: (z, H_R, H_L, l), see _stacked_update, and the noise covariance of each measurement (K, 2, 2)
+        """
+
+        ctx = self.pose_context() if self.kernels.uses_pose_context else None
+        z, H_R, H_L = self.kernels.linearise(self.X[:3], self.X[l[:, None] + onp.arange(2)], Y_meas, ctx=ctx)
+
+        return (z, H_R, H_L, l), onp.broadcast_to(onp.asarray(self.R, dtype=onp.float64), (l.shape[0], 2, 2))
+
+    def _linearise(self, model, Y_meas, l=None):
+        """
+        Linearise the measurements of a sensor model at the current estimate, with its Jacobians
+
+        :param model: sensor model (sensor_models.SensorModel)
+        :param Y_meas: measurements (K, model.dim)
+        :param l: state indices of the observed landmarks (K,), or None for models that observe the robot pose only
+        :return: (z, H_R, H_L, l), see _stacked_update, and the noise covariance of each measurement (K, m, m)
+        """
+
+        X_r = self.X[:3].copy()
+        K = Y_meas.shape[0]
+
+        if l is None:
+            h = onp.asarray(model.observe(X_r))
+            H_R = onp.broadcast_to(onp.asarray(model.jacobians(X_r)[0]), (K, model.dim, 3))
+            H_L = None
+        else:
+            L = self.X[l[:, None] + onp.arange(2)]
+            h = onp.asarray(model.observe(X_r, L))
+            H_R, H_L = (onp.asarray(H) for H in model.jacobians(X_r, L))
+
+        z = Y_meas - h
+        for a in model.angles:
+            z[:, a] = (z[:, a] + onp.pi) % (2 * onp.pi) - onp.pi
+
+        return (z, H_R, H_L, l), onp.broadcast_to(onp.asarray(model.R, dtype=onp.float64), (K, model.dim, model.dim))
+
+    def _stacked_update(self, blocks, R_blocks):
+        """
+        Update with stacked measurements, each depending only on the robot pose and (optionally) one landmark
+
+        H is only non-zero for the robot pose and the observed landmark of each measurement, so
+        P H^T = P[:, r] H_R^T + P[:, L] H_L^T is O(n M), and Z = H P H^T + R only needs the rows of P H^T of the robot
+        pose and the observed landmarks. These are computed in float64, also in mixed precision.
+
+        :param blocks: list of (z (K, m), H_R (K, m, 3), H_L (K, m, 2) or None, landmark state indices l (K,) or None)
+        :param R_blocks: measurement noise covariance of each measurement, in the order of the blocks
+        :return:
+        """
+
+        P = self.P
+
+        # robot columns of P in float64 (also in mixed precision)
+        P_xr = onp.array(P[:, :3], dtype=onp.float64)
+        P_xr[:3] = self.robot_covariance()
+
+        PH_T = []
+        for z, H_R, H_L, l in blocks:
+            PH_T_b = onp.einsum("ni,kmi->nkm", P_xr, H_R)
+            if H_L is not None:
+                P_xl = onp.asarray(P[:, l[:, None] + onp.arange(2)], dtype=onp.float64)     # (n, K, 2)
+                PH_T_b += onp.einsum("nkj,kmj->nkm", P_xl, H_L)
+            PH_T.append(PH_T_b.reshape(PH_T_b.shape[0], -1))
+        PH_T = onp.concatenate(PH_T, axis=1)
+
+        # Z = H P H^T + R, one block row of H at a time
+        Z = []
+        for z, H_R, H_L, l in blocks:
+            HPH_T = onp.einsum("kmi,iM->kmM", H_R, PH_T[:3])
+            if H_L is not None:
+                HPH_T += onp.einsum("kmj,kjM->kmM", H_L, PH_T[l[:, None] + onp.arange(2)])
+            Z.append(HPH_T.reshape(-1, PH_T.shape[1]))
+        Z = onp.concatenate(Z, axis=0)
+        start = 0
+        for R in R_blocks:
+            Z[start:start + R.shape[0], start:start + R.shape[0]] += R
+            start += R.shape[0]
+
+        self._kalman_update(PH_T, (Z + Z.T) / 2, onp.concatenate([z.ravel() for z, _, _, _ in blocks]))
+
+    def _kalman_update(self, PH_T, Z, z):
+        """
+        Update the state vector and state covariance matrix with a measurement
+
+        :param PH_T: cross covariance of the states and the predicted measurement, P H^T (n x m)
+        :param Z: innovation covariance (m x m)
+        :param z: innovation residual (m,)
+        :return:
+        """
+
+        P = self.P
+        P_rr = self.robot_covariance()
 
-        # calculate innovation residual for landmark i
-        L_i_est = self.X[3 + 2*i: 3 + 2*(i+1)]      # get states of this landmark
-        x_r, y_r, alpha_r = self.X[:3]
-        # R = angle_to_rotation_matrix(alpha_r)
-        h_i = RangeBearingSensor.observe_range_bearing(alpha_r, np.array([x_r, y_r]), L_i_est)       # TODO: NB: this was initially calculated using inv_observe_range_bearing instead of observe_range_bearing. Need to recalculate!
-        z_i = y_meas_i - h_i
-        
-        # calculate innovation covariance
-        H_R = self.jacobian_H_X_r(x_r=x_r, y_r=y_r, alpha_r=alpha_r, l_i_x=L_i_est[0], l_i_y=L_i_est[1])
-        H_L_i = self.jacobian_H_L_i(x_r=x_r, y_r=y_r, alpha_r=alpha_r, l_i_x=L_i_est[0], l_i_y=L_i_est[1])
-        H = np.array([H_R, H_L_i])
-        P_innov = np.array([[], []])
-        Z_i = np.dot(np.dot(H, P_innov), H.T) + self.R
+        # With the Cholesky factorisation Z = C C^T and W = P H^T C^-T, the Kalman gain is K = W C^-1 and the
+        # covariance update P - K Z K^T = P - W W^T is a symmetric rank-m update
+        C = onp.linalg.cholesky(Z)
+        W = onp.linalg.solve(C, PH_T.T).T
+
+        # whitened innovation C^-1 z, whose squared norm is the normalised innovation squared z^T Z^-1 z
+        v = onp.linalg.solve(C, z)
+        if self.monitor is not None:
+            self.monitor.record_whitened_innovation(v, self.num_steps)
+
+        # update state vector and state covariance matrix
+        self.X += onp.dot(W, v)
+        self._pose_version += 1
+        self.kernels.symmetric_rank_update(P, W.astype(self.dtype))
+
+        if self._P_rr is not None:
+            # keep robot pose block in float64, and keep variances non-negative despite rounding of the update
+            self._P_rr = P_rr - onp.dot(W[:3], W[:3].T)
+            P[:3, :3] = self._P_rr
+            diag = onp.arange(P.shape[0])
+            P[diag, diag] = onp.maximum(P[diag, diag], 0)
+
+    def joint_update(self, measurements):
+        """
+        Update with the measurements of several sensors (e.g. all those arriving in the same time step) in one joint
+        update, rather than one update per sensor
+
+        All measurements are linearised at the current estimate, and their innovations, Jacobians and noise are stacked
+        (H = [H_1; H_2; ...], R = blockdiag(R_1, R_2, ...)), so the O(n^2) covariance update is done once, as a single
+        rank-M update (M = total measurement dimension). As in measurement_update_range_bearing, H is only non-zero for
+        the robot pose and the observed landmark of each measurement, so P H^T is O(n M).
+
+        Landmarks not in the map are added after the update, each from the first measurement of it by a sensor model
+        that can initialise landmarks (model.initialises_landmarks), and are skipped if there is none. All measurements
+        are checked before the estimate is changed, so an invalid one leaves it as it was.
+
+        :param measurements: (model, Y, landmark_ids) for each sensor, where model is a sensor_models.SensorModel,
+        Y its measurements (K, model.dim) and landmark_ids the IDs of the measured landmarks (K values), or None for
+        models that observe the robot pose only
+        :return: IDs of the skipped landmarks
+        """
+
+        index = {landmark_id: i for i, landmark_id in enumerate(self.landmark_lookup)}
+        groups = []
+        new = {}        # new landmark ID -> (model, measurement), for the first measurement that can initialise it
+        unknown = []
+
+        for model, Y_meas, landmark_ids in measurements:
+            Y_meas = onp.asarray(Y_meas, dtype=onp.float64).reshape(-1, model.dim)
+
+            if model.observes_landmarks:
+                landmark_ids = list(landmark_ids)
+                if len(landmark_ids) != Y_meas.shape[0]:
+                    raise ValueError("Need one landmark ID per measurement")
+
+                for k, landmark_id in enumerate(landmark_ids):
+                    if landmark_id not in index:
+                        unknown.append(landmark_id)
+                        if model.initialises_landmarks and landmark_id not in new:
+                            new[landmark_id] = (model, Y_meas[k])
+
+            groups.append((model, Y_meas, landmark_ids))
+
+        blocks = []
+        R_blocks = []
+        observed = []
+
+        for model, Y_meas, landmark_ids in groups:
+            if model.observes_landmarks:
+                known = [k for k, landmark_id in enumerate(landmark_ids) if landmark_id in index]
+                if not known:
+                    continue
+
+                l = 3 + 2 * onp.array([index[landmark_ids[k]] for k in known])
+                block, R = self._linearise(model, Y_meas[known], l)
+                observed.extend(landmark_ids[k] for k in known)
+            else:
+                block, R = self._linearise(model, Y_meas)
+
+            blocks.append(block)
+            R_blocks.extend(R)
+
+        if blocks:
+            self._stacked_update(blocks, R_blocks)
+            self._landmarks_observed(observed)
+
+        # initialise the new landmarks of each model together
+        by_model = {}
+        for landmark_id, (model, y) in new.items():
+            by_model.setdefault(model, ([], []))
+            by_model[model][0].append(y)
+            by_model[model][1].append(landmark_id)
+
+        for model, (Y_meas, landmark_ids) in by_model.items():
+            self._append_landmarks(*self._model_landmark_initialisation(model, self.X[:3], onp.stack(Y_meas)),
+                                   landmark_ids)
+
+        return list(dict.fromkeys(landmark_id for landmark_id in unknown if landmark_id not in new))
+
+    def range_bearing_scan_update(self, Y_meas, landmark_ids):
+        """
+        Process a range-bearing scan: update with the landmarks seen before (in one joint update, see
+        measurement_update_range_bearing_batch) and add the new ones (in one step)
+
+        :param Y_meas: range-bearing measurements (K, 2)
+        :param landmark_ids: IDs of the measured landmarks (K values)
+        :return:
+        """
+
+        Y_meas = onp.asarray(Y_meas, dtype=onp.float64).reshape(-1, 2)
+        new = [k for k, landmark_id in enumerate(landmark_ids) if landmark_id not in self.landmark_lookup]
+        new_set = set(new)
+        known = [k for k in range(len(landmark_ids)) if k not in new_set]
+
+        self.measurement_update_range_bearing_batch(Y_meas[known],
+                                                    [self.get_landmark_index(landmark_ids[k]) for k in known])
+        self.new_landmarks_range_bearing(Y_meas[new], [landmark_ids[k] for k in new])
+
+
+# ------------- landmark pruning policies -------------
+# Each policy selects num_landmarks landmarks (by ID) to remove, e.g. for use as EKFSLAM.landmark_pruning_policy.
+
+
+def landmark_distances(estimator):
+    """
+    Compute the distance from the estimated robot position to each landmark estimate
+
+    :param estimator: EKFSLAM estimator
+    :return: distances, in the order of estimator.landmark_lookup
+    """
+
+    L = estimator.X[3:].reshape(-1, 2)
+
+    return onp.hypot(L[:, 0] - estimator.X[0], L[:, 1] - estimator.X[1])
+
+
+def farthest_landmarks(estimator, num_landmarks):
+    """
+    Select the landmarks farthest from the estimated robot position
+
+    :param estimator: EKFSLAM estimator
+    :param num_landmarks: number of landmarks to select
+    :return: landmark IDs
+    """
+
+    order = onp.argsort(-landmark_distances(estimator), kind="stable")
+
+    return [estimator.landmark_lookup[i] for i in order[:num_landmarks]]
+
+
+def least_recently_observed_landmarks(estimator, num_landmarks):
+    """
+    Select the landmarks that have not been observed for the longest time
+
+    :param estimator: EKFSLAM estimator
+    :param num_landmarks: number of landmarks to select
+    :return: landmark IDs
+    """
+
+    return sorted(estimator.landmark_lookup, key=lambda l: estimator.landmark_last_observed[l])[:num_landmarks]
+
+
+def least_observed_landmarks(estimator, num_landmarks):
+    """
+    Select the landmarks that have been observed the fewest times
+
+    :param estimator: EKFSLAM estimator
+    :param num_landmarks: number of landmarks to select
+    :return: landmark IDs
+    """
+
+    return sorted(estimator.landmark_lookup, key=lambda l: estimator.landmark_num_observations[l])[:num_landmarks]
+
+
+def landmarks_beyond(estimator, distance):
+    """
+    Select all landmarks further than a distance from the estimated robot position
+
+    :param estimator: EKFSLAM estimator
+    :param distance: distance [m]
+    :return: landmark IDs
+    """
 
-        # calculate Kalman gains
-        # K = np.zeros((3 + ))
-        
+    return [estimator.landmark_lookup[i] for i in onp.flatnonzero(landmark_distances(estimator) > distance)]
@@ -0,0 +1,438 @@
+# FastSLAM (Rao-Blackwellised particle filter) estimator, with the same interface as EKFSLAM
+#
+# Each particle is a robot pose hypothesis with an independent 2x2 EKF per landmark, so it copes with strongly nonlinear
+# trajectories (e.g. the circle_with_noise profile of ekf_slam_2d) that a single linearisation point does not.
+
+import numbers
+
+import numpy as onp
+
+from python.lib.robot import move_batch
+from python.lib.sensors import RangeBearingSensor
+
+
+class FastSLAM:
+    """
+    FastSLAM 1.0 with known data association (landmark IDs)
+
+    Particles are stored as arrays rather than objects: poses (M, 3) and log_weights (M,). The landmark estimates of all
+    particles live in one shared pool (means (S, 2) and covariances (S, 2, 2)), and particle m refers to its estimate of
+    landmark j through map_index[m, j]. Resampling therefore only copies rows of map_index, not whole maps; a pool
+    entry that is shared by several particles is copied only when one of them updates it (copy-on-write, tracked with
+    a reference count per pool entry). landmark_means and landmark_covs gather the per-particle maps as (M, N, 2) and
+    (M, N, 2, 2) arrays.
+
+    All particles are propagated, weighted and updated in vectorised passes, and resampling is systematic, done when
+    the effective sample size falls below resample_threshold * M.
+    """
+
+    def __init__(self, num_particles=100, landmark_capacity=0, resample_threshold=0.5, seed=None):
+        """
+        :param num_particles: number of particles M
+        :param landmark_capacity: number of landmarks to preallocate space for (grown by doubling if needed)
+        :param resample_threshold: resample when the effective sample size is below this fraction of M
+        :param seed: seed of the random number generator used for the process noise and resampling
+        """
+
+        M = num_particles
+        capacity = max(landmark_capacity, 1)
+
+        self.num_particles = M
+        self.resample_threshold = resample_threshold
+        self.rng = onp.random.RandomState(seed)
+
+        # particles
+        self.poses = onp.zeros((M, 3))
+        self.log_weights = onp.full(M, -onp.log(M))
+
+        # landmark pool, shared by the particles. Pool entries with a reference count of 0 are free.
+        self._map_index = onp.zeros((M, capacity), dtype=onp.intp)
+        self._means = onp.zeros((M * capacity, 2))
+        self._covs = onp.zeros((M * capacity, 2, 2))
+        self._refcounts = onp.zeros(M * capacity, dtype=onp.intp)
+
+        # process noise covariance matrix (for control input [x; alpha])
+        self.Q = onp.eye(2)
+
+        # measurement noise covariance matrix
+        self.R = onp.eye(2)
+
+        # store lookup table of the landmarks (as in EKFSLAM)
+        self.landmark_lookup = []
+
+        self.num_steps = 0
+        self.landmark_last_observed = {}
+        self.landmark_num_observations = {}
+
+        # optional bounded-memory history, recorded at the start of every prediction step (as in EKFSLAM)
+        self.history = None
+
+    @property
+    def landmark_means(self):
+        """
+        Landmark position estimates of each particle (M, N, 2) (a copy)
+        """
+
+        return self._means[self._map_index[:, :self.get_num_landmarks()]]
+
+    @property
+    def landmark_covs(self):
+        """
+        Landmark covariances of each particle (M, N, 2, 2) (a copy)
+        """
+
+        return self._covs[self._map_index[:, :self.get_num_landmarks()]]
+
+    @property
+    def weights(self):
+        """
+        Normalised particle weights (M,)
+        """
+
+        return onp.exp(self.log_weights)
+
+    @property
+    def X(self):
+        """
+        Weighted mean state [R; M] over the particles (the robot heading is a circular mean)
+        """
+
+        w = self.weights
+        alpha = onp.arctan2(onp.dot(w, onp.sin(self.poses[:, 2])), onp.dot(w, onp.cos(self.poses[:, 2])))
+        L = onp.einsum("m,mnk->nk", w, self.landmark_means)
+
+        return onp.concatenate([onp.dot(w, self.poses[:, :2]), [alpha], L.ravel()])
+
+    @X.setter
+    def X(self, X):
+        """
+        Set the pose of all particles (and their landmark positions, if X includes the current landmarks)
+        """
+
+        X = onp.asarray(X, dtype=onp.float64)
+
+        if X.ndim != 1 or X.shape[0] not in (3, 3 + 2 * self.get_num_landmarks()):
+            raise ValueError("X must be the robot pose (3 states), optionally followed by 2 states per landmark")
+
+        self.poses[:] = X[:3]
+        if X.shape[0] > 3:
+            # shared pool entries receive the same value from each particle, so no copy is needed
+            self._means[self._map_index[:, :self.get_num_landmarks()]] = X[3:].reshape(-1, 2)
+
+    @property
+    def P(self):
+        """
+        Covariance of the state over the particles (spread of the particle states plus the mean landmark covariances)
+        """
+
+        X = self.X
+        N = self.get_num_landmarks()
+        w = self.weights
+
+        X_particles = onp.concatenate([self.poses, self.landmark_means.reshape(self.num_particles, 2 * N)], axis=1)
+        d_X = X_particles - X
+        d_X[:, 2] = (d_X[:, 2] + onp.pi) % (2 * onp.pi) - onp.pi
+
+        P = onp.dot(w * d_X.T, d_X)
+        covs = onp.einsum("m,mnij->nij", w, self.landmark_covs)
+        for j in range(N):
+            P[3 + 2 * j:5 + 2 * j, 3 + 2 * j:5 + 2 * j] += covs[j]
+
+        return P
+
+    @P.setter
+    def P(self, P):
+        """
+        Sample the particle poses around their mean pose with covariance P[:3, :3], and set the landmark covariances of
+        all particles to the landmark blocks on the diagonal of P
+        """
+
+        P = onp.asarray(P, dtype=onp.float64)
+        N = self.get_num_landmarks()
+
+        if P.shape != (3 + 2 * N, 3 + 2 * N):
+            raise ValueError("P must have shape ({n}, {n}) to match X".format(n=3 + 2 * N))
+
+        self.poses[:] = self.X[:3] + self.rng.multivariate_normal(onp.zeros(3), P[:3, :3], size=self.num_particles)
+        for j in range(N):
+            self._covs[self._map_index[:, j]] = P[3 + 2 * j:5 + 2 * j, 3 + 2 * j:5 + 2 * j]
+
+    def robot_covariance(self):
+        """
+        Covariance of the robot pose over the particles
+
+        :return: P_rr (3x3)
+        """
+
+        d_X = self.poses - self.X[:3]
+        d_X[:, 2] = (d_X[:, 2] + onp.pi) % (2 * onp.pi) - onp.pi
+
+        return onp.dot(self.weights * d_X.T, d_X)
+
+    def get_num_landmarks(self):
+        """
+        Return number of landmarks
+
+        :return:
+        """
+
+        return len(self.landmark_lookup)
+
+    def get_landmark_id(self, i):
+        """
+        Get the ID of the ith landmark
+
+        :param i: landmark index
+        :return:
+        """
+
+        return self.landmark_lookup[i]
+
+    def get_landmark_index(self, landmark_id):
+        """
+        Get the index of the landmark with the given ID
+
+        :param landmark_id: landmark ID
+        :return: landmark index (its states are X[3 + 2*i: 3 + 2*(i+1)])
+        """
+
+        return self.landmark_lookup.index(landmark_id)
+
+    def _landmarks_observed(self, landmark_ids):
+        for landmark_id in landmark_ids:
+            self.landmark_last_observed[landmark_id] = self.num_steps
+            self.landmark_num_observations[landmark_id] = self.landmark_num_observations.get(landmark_id, 0) + 1
+
+    def _allocate(self, num_entries):
+        """
+        Find free entries in the landmark pool, growing the pool (by doubling) if necessary
+
+        :param num_entries: number of entries needed
+        :return: indices of the entries (their reference counts are set to 1)
+        """
+
+        free = onp.flatnonzero(self._refcounts == 0)
+        if free.shape[0] < num_entries:
+            size = self._refcounts.shape[0]
+            new_size = max(2 * size, size - free.shape[0] + num_entries)
+            self._means = onp.concatenate([self._means, onp.zeros((new_size - size, 2))])
+            self._covs = onp.concatenate([self._covs, onp.zeros((new_size - size, 2, 2))])
+            self._refcounts = onp.concatenate([self._refcounts, onp.zeros(new_size - size, dtype=onp.intp)])
+            free = onp.flatnonzero(self._refcounts == 0)
+
+        entries = free[:num_entries]
+        self._refcounts[entries] = 1
+
+        return entries
+
+    def _write_landmarks(self, indices, means, covs):
+        """
+        Write updated landmark estimates of all particles, copying pool entries that are shared with other particles
+
+        :param indices: landmark indices (K,) (unique)
+        :param means: landmark means (M, K, 2)
+        :param covs: landmark covariances (M, K, 2, 2)
+        :return:
+        """
+
+        entries = self._map_index[:, indices]
+        shared = self._refcounts[entries] > 1
+        if shared.any():
+            onp.subtract.at(self._refcounts, entries[shared], 1)
+            entries[shared] = self._allocate(onp.count_nonzero(shared))
+            self._map_index[:, indices] = entries
+
+        self._means[entries] = means
+        self._covs[entries] = covs
+
+    def state_propagation(self, U):
+        """
+        Move all particles with control input U and a sample of the process noise each
+
+        :param U: control input (d_x, d_alpha)
+        :return:
+        """
+
+        if self.history is not None:
+            self.history.record(self)
+
+        N = self.rng.multivariate_normal(onp.zeros(2), self.Q, size=self.num_particles)
+        self.poses = onp.array(move_batch(self.poses, onp.asarray(U, dtype=onp.float64), N))
+        self.num_steps += 1
+
+    def state_and_state_cov_propagation(self, U):
+        """
+        Prediction step (same interface as EKFSLAM). The particle spread represents the pose uncertainty.
+
+        :param U: control input (d_x, d_alpha)
+        :return:
+        """
+
+        self.state_propagation(U)
+
+    def state_and_state_cov_propagation_many(self, U_list):
+        """
+        Run several prediction steps
+
+        :param U_list: control inputs
+        :return:
+        """
+
+        for U in U_list:
+            self.state_propagation(U)
+
+    def new_landmark_range_bearing(self, y_meas, landmark_id=None):
+        """
+        Add a new landmark to the map of every particle, initialised from a range-bearing measurement
+
+        :param y_meas: measurement of new landmark using range-bearing sensor
+        :param landmark_id: unique value (if None, one more than the largest integer ID in the map)
+        :return: ID of the new landmark
+        """
+
+        if landmark_id is None:
+            landmark_id = max((int(l) for l in self.landmark_lookup if isinstance(l, numbers.Integral)), default=-1) + 1
+
+        self.new_landmarks_range_bearing(onp.asarray(y_meas, dtype=onp.float64).reshape(1, 2), [landmark_id])
+
+        return landmark_id
+
+    def new_landmarks_range_bearing(self, Y_meas, landmark_ids):
+        """
+        Add several new landmarks, observed in the same range-bearing scan, to the map of every particle
+
+        Particle m initialises landmark k at g(X_r_m, y_k) with covariance G_y R G_y^T, where G_y is the Jacobian of the
+        inverse observation function w.r.t. the measurement at the particle's pose.
+
+        :param Y_meas: range-bearing measurements (K, 2)
+        :param landmark_ids: IDs of the new landmarks (K unique values)
+        :return:
+        """
+
+        Y_meas = onp.asarray(Y_meas, dtype=onp.float64).reshape(-1, 2)
+        K = Y_meas.shape[0]
+        if K == 0:
+            return
+
+        if len(set(landmark_ids)) != K or any(landmark_id in self.landmark_lookup for landmark_id in landmark_ids):
+            raise ValueError("Landmark IDs must be unique.")
+
+        X_r = self.poses[:, None]
+        means = onp.asarray(RangeBearingSensor.inv_observe_range_bearing_batch(X_r, Y_meas))
+        G_y = onp.asarray(RangeBearingSensor.jacobian_G_y_i_batch(X_r, Y_meas))
+        covs = onp.matmul(onp.matmul(G_y, self.R), onp.swapaxes(G_y, -1, -2))
+
+        N = self.get_num_landmarks()
+        if N + K > self._map_index.shape[1]:
+            grown = onp.zeros((self.num_particles, max(2 * self._map_index.shape[1], N + K)), dtype=onp.intp)
+            grown[:, :N] = self._map_index[:, :N]
+            self._map_index = grown
+
+        entries = self._allocate(self.num_particles * K).reshape(self.num_particles, K)
+        self._map_index[:, N:N + K] = entries
+        self._means[entries] = means
+        self._covs[entries] = (covs + onp.swapaxes(covs, -1, -2)) / 2
+
+        self.landmark_lookup.extend(landmark_ids)
+        self._landmarks_observed(landmark_ids)
+
+    def _update(self, Y_meas, indices):
+        """
+        Update the landmark EKFs and weights of all particles with measurements of known landmarks
+
+        :param Y_meas: range-bearing measurements (K, 2)
+        :param indices: indices of the measured landmarks (K unique values)
+        :return:
+        """
+
+        indices = onp.asarray(indices, dtype=onp.intp)
+        entries = self._map_index[:, indices]
+        L = self._means[entries]        # (M, K, 2)
+        S = self._covs[entries]         # (M, K, 2, 2)
+
+        X_r = self.poses[:, None]
+        z = Y_meas - onp.asarray(RangeBearingSensor.observe_range_bearing_batch(X_r, L))
+        z[..., 1] = (z[..., 1] + onp.pi) % (2 * onp.pi) - onp.pi     # wrap bearing residual to [-pi, pi)
+        H = onp.asarray(RangeBearingSensor.jacobian_H_L_i_batch(X_r, L))
+
+        # innovation covariance Z = H S H^T + R and Kalman gain K = S H^T Z^-1 = (Z^-1 H S)^T (S and Z are symmetric)
+        HS = onp.matmul(H, S)
+        Z = onp.matmul(HS, onp.swapaxes(H, -1, -2)) + self.R
+        K = onp.swapaxes(onp.linalg.solve(Z, HS), -1, -2)
+
+        means = L + onp.matmul(K, z[..., None])[..., 0]
+        covs = S - onp.matmul(K, HS)
+        covs = (covs + onp.swapaxes(covs, -1, -2)) / 2
+
+        # importance weights: likelihood of the measurements, N(z; 0, Z)
+        Z_inv_z = onp.linalg.solve(Z, z[..., None])[..., 0]
+        log_likelihood = -0.5 * (onp.sum(z * Z_inv_z, axis=-1) + onp.log(onp.linalg.det(2 * onp.pi * Z)))
+        log_weights = self.log_weights + onp.sum(log_likelihood, axis=1)
+        self.log_weights = log_weights - onp.logaddexp.reduce(log_weights)
+
+        self._write_landmarks(indices, means, covs)
+
+    def effective_sample_size(self):
+        """
+        Effective number of particles, 1 / sum(w^2)
+
+        :return:
+        """
+
+        return 1. / onp.sum(self.weights ** 2)
+
+    def resample(self):
+        """
+        Systematic resampling. Particles share the landmark pool entries of the particle they were drawn from.
+
+        :return:
+        """
+
+        M = self.num_particles
+        cumulative = onp.cumsum(self.weights)
+        cumulative[-1] = 1.
+        selected = onp.searchsorted(cumulative, (self.rng.uniform() + onp.arange(M)) / M)
+
+        self.poses = self.poses[selected]
+        self._map_index = self._map_index[selected]
+        self.log_weights = onp.full(M, -onp.log(M))
+        self._refcounts = onp.bincount(self._map_index[:, :self.get_num_landmarks()].ravel(),
+                                       minlength=self._refcounts.shape[0])
+
+    def _resample_if_needed(self):
+        if self.effective_sample_size() < self.resample_threshold * self.num_particles:
+            self.resample()
+
+    def measurement_update_range_bearing(self, y_meas_i, i):
+        """
+        Perform measurement update with selected landmark using range-bearing sensor
+
+        :param y_meas_i: measurement of ith landmark
+        :param i: index of the landmark that the measurement corresponds to
+        :return:
+        """
+
+        self._update(onp.asarray(y_meas_i, dtype=onp.float64).reshape(1, 2), [i])
+        self._landmarks_observed([self.landmark_lookup[i]])
+        self._resample_if_needed()
+
+    def range_bearing_scan_update(self, Y_meas, landmark_ids):
+        """
+        Process a range-bearing scan: update with the landmarks seen before (in one vectorised pass) and add the new
+        ones
+
+        :param Y_meas: range-bearing measurements (K, 2)
+        :param landmark_ids: IDs of the measured landmarks (K unique values)
+        :return:
+        """
+
+        Y_meas = onp.asarray(Y_meas, dtype=onp.float64).reshape(-1, 2)
+        known = [k for k, landmark_id in enumerate(landmark_ids) if landmark_id in self.landmark_lookup]
+        new = [k for k, landmark_id in enumerate(landmark_ids) if landmark_id not in self.landmark_lookup]
+
+        if known:
+            self._update(Y_meas[known], [self.get_landmark_index(landmark_ids[k]) for k in known])
+            self._landmarks_observed([landmark_ids[k] for k in known])
+            self._resample_if_needed()
+
+        self.new_landmarks_range_bearing(Y_meas[new], [landmark_ids[k] for k in new])
@@ -0,0 +1,193 @@
+# Time-indexed input buffer around EKFSLAM, allowing late (out of order) controls and measurements to be fused
+
+import bisect
+from collections import deque
+
+import numpy as np
+
+CONTROL = 0
+MEASUREMENT = 1
+
+
+class Checkpoint:
+    """
+    Snapshot of the estimator state after all buffered inputs up to (and including) key have been applied
+
+    Prediction only changes the robot pose and the robot rows/columns of P. So if no measurement update or change of
+    landmarks happened since the previous full checkpoint (base), only X and the robot rows P[:3, :] are stored and
+    the rest of P is taken from base.
+    """
+
+    def __init__(self, key, estimator, base=None):
+        self.key = key
+        self.X = estimator.X.copy()
+        self.landmark_lookup = list(estimator.landmark_lookup)
+        self.num_steps = estimator.num_steps
+        self.landmark_last_observed = dict(estimator.landmark_last_observed)
+        self.landmark_num_observations = dict(estimator.landmark_num_observations)
+
+        self.base = base
+        if base is None:
+            self.P = estimator.P.copy()
+            self.P_rows = None
+        else:
+            self.P = None
+            self.P_rows = estimator.P[:3, :].copy()
+
+    def restore(self, estimator):
+        """
+        Restore estimator state from this checkpoint
+
+        :param estimator: EKFSLAM estimator
+        :return:
+        """
+
+        estimator.X = self.X
+        if self.base is None:
+            estimator.P = self.P
+        else:
+            P = self.base.P.copy()
+            P[:3, :] = self.P_rows
+            P[:, :3] = self.P_rows.T
+            estimator.P = P
+        estimator.landmark_lookup = list(self.landmark_lookup)
+        estimator.num_steps = self.num_steps
+        estimator.landmark_last_observed = dict(self.landmark_last_observed)
+        estimator.landmark_num_observations = dict(self.landmark_num_observations)
+
+
+class FixedLagBuffer:
+    """
+    Time-indexed buffer of controls and range-bearing measurements driving an EKFSLAM estimator
+
+    Inputs are applied as soon as they arrive. The estimator state is checkpointed into a ring of max_checkpoints
+    checkpoints, at most one every checkpoint_interval seconds. When an input arrives late (older than inputs that
+    have already been applied), the estimator is rolled back to the newest checkpoint before it and the buffered
+    inputs since then are replayed with the late input in its place. Inputs older than the oldest checkpoint can no
+    longer be fused and are rejected.
+
+    Inputs with the same timestamp are applied controls first, then measurements, each in order of arrival. A control
+    at time t moves the robot to its pose at time t.
+    """
+
+    def __init__(self, estimator, checkpoint_interval=0.1, max_checkpoints=20, start_time=-np.inf):
+        """
+        :param estimator: EKFSLAM estimator, initialised with its state at start_time
+        :param checkpoint_interval: minimum time between checkpoints [s]
+        :param max_checkpoints: number of checkpoints kept. Together with checkpoint_interval this sets the lag [s]
+        :param start_time: time of the estimator's initial state [s]
+        """
+
+        self.estimator = estimator
+        self.checkpoint_interval = checkpoint_interval
+
+        self._count = 0         # arrival counter, to keep inputs with equal timestamps in order of arrival
+        self._keys = []         # sorted keys (t, kind, count) of inputs newer than the oldest checkpoint
+        self._payloads = []     # inputs, in the same order as self._keys
+        self._last_key = (start_time, -1, -1)
+        self._dirty = False     # whether P changed beyond the robot rows since the last full checkpoint
+
+        self.checkpoints = deque(maxlen=max_checkpoints)
+        self.checkpoints.append(Checkpoint(self._last_key, estimator))
+
+    @property
+    def time(self):
+        """
+        Time of the newest input applied to the estimator [s]
+        """
+
+        return self._last_key[0]
+
+    def add_control(self, t, U):
+        """
+        Add control input (applied at time t)
+
+        :param t: timestamp [s]
+        :param U: control input (d_x, d_alpha)
+        :return: False if the input is too old to be fused, otherwise True
+        """
+
+        return self._add(t, CONTROL, U)
+
+    def add_measurement(self, t, y_meas, landmark_id):
+        """
+        Add range-bearing measurement of a landmark. Landmarks not yet in the state are initialised from it.
+
+        :param t: timestamp [s]
+        :param y_meas: range-bearing measurement
+        :param landmark_id: ID of the observed landmark
+        :return: False if the measurement is too old to be fused, otherwise True
+        """
+
+        return self._add(t, MEASUREMENT, (y_meas, landmark_id))
+
+    def _add(self, t, kind, payload):
+        key = (t, kind, self._count)
+        self._count += 1
+
+        if key < self.checkpoints[0].key:
+            return False
+
+        i = bisect.bisect_right(self._keys, key)
+        self._keys.insert(i, key)
+        self._payloads.insert(i, payload)
+
+        if key > self._last_key:
+            self._apply(key, payload)
+            self._checkpoint()
+        else:
+            self._replay(key)
+
+        return True
+
+    def _apply(self, key, payload):
+        est = self.estimator
+
+        if key[1] == CONTROL:
+            est.state_and_state_cov_propagation(payload)
+        else:
+            y_meas, landmark_id = payload
+            if landmark_id in est.landmark_lookup:
+                est.measurement_update_range_bearing(y_meas, est.get_landmark_index(landmark_id))
+            else:
+                est.new_landmark_range_bearing(y_meas, landmark_id=landmark_id)
+            self._dirty = True
+
+        self._last_key = key
+
+    def _checkpoint(self):
+        """
+        Take a checkpoint if checkpoint_interval has passed since the newest one, and drop inputs older than the
+        oldest checkpoint
+        """
+
+        newest = self.checkpoints[-1]
+        if self._last_key[0] - newest.key[0] < self.checkpoint_interval:
+            return
+
+        base = newest if newest.base is None else newest.base
+        if self._dirty or base.X.shape != self.estimator.X.shape:
+            base = None
+        self.checkpoints.append(Checkpoint(self._last_key, self.estimator, base))
+        self._dirty = False
+
+        num_old = bisect.bisect_right(self._keys, self.checkpoints[0].key)
+        del self._keys[:num_old]
+        del self._payloads[:num_old]
+
+    def _replay(self, key):
+        """
+        Roll back to the newest checkpoint before key and replay the buffered inputs from there
+        """
+
+        while self.checkpoints[-1].key >= key:
+            self.checkpoints.pop()
+        checkpoint = self.checkpoints[-1]
+        checkpoint.restore(self.estimator)
+        self._last_key = checkpoint.key
+        self._dirty = False
+
+        start = bisect.bisect_right(self._keys, checkpoint.key)
+        for input_key, payload in list(zip(self._keys[start:], self._payloads[start:])):
+            self._apply(input_key, payload)
+            self._checkpoint()
@@ -0,0 +1,395 @@
+# Batch graph-SLAM: nonlinear least squares over the whole trajectory and map, on a sparse normal equation system
+#
+# The factor graph has a prior on the first pose, an odometry factor between consecutive poses (robot.move) and a
+# range-bearing factor per observation (RangeBearingSensor.observe_range_bearing). Each iteration linearises all
+# factors with the analytic Jacobians (vectorised over factors), assembles the sparse Jacobian J and solves
+# (J^T J + lambda D) dx = -J^T e with a sparse LU factorisation, using a fill-reducing column ordering.
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+from python.lib.ekf import EKFSLAM
+from python.lib.robot import move_batch
+from python.lib.sensors import RangeBearingSensor
+
+
+def _wrap(angle):
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+def _whitening(cov):
+    """
+    Whitening matrices W with W^T W = cov^-1 (inverse Cholesky factors)
+
+    :param cov: covariances (..., m, m)
+    :return: W (..., m, m)
+    """
+
+    return np.linalg.inv(np.linalg.cholesky(cov))
+
+
+def _block_indices(rows, cols, shape):
+    """
+    Row and column indices of the entries of dense blocks in a sparse matrix
+
+    :param rows: first row of each block (K,)
+    :param cols: first column of each block (K,)
+    :param shape: block shape (a, b)
+    :return: row indices and column indices (K * a * b,)
+    """
+
+    a, b = shape
+    row_indices = rows[:, None, None] + np.arange(a)[None, :, None] + np.zeros(b, dtype=int)[None, None, :]
+    col_indices = cols[:, None, None] + np.arange(b)[None, None, :] + np.zeros(a, dtype=int)[None, :, None]
+
+    return row_indices.ravel(), col_indices.ravel()
+
+
+class GraphSLAM:
+    """
+    Batch SLAM estimator: records odometry and range-bearing observations, then optimises all poses and landmarks
+
+    Poses are indexed 0 (the initial pose) to T (after T odometry steps). Landmarks are indexed in order of first
+    observation, with IDs in landmark_lookup (as in EKFSLAM). New poses and landmarks are initialised by dead reckoning
+    and inverse observation, which gives the starting point of the optimisation.
+
+    GraphSLAM has the recording methods of the recursive estimators (state_and_state_cov_propagation[_many] and
+    range_bearing_scan_update), so a run can be recorded by a Scheduler and then optimised.
+    """
+
+    def __init__(self, Q, R, prior_pose=(0., 0., 0.), prior_cov=None, lateral_std=1e-3):
+        """
+        :param Q: process noise covariance matrix (for control input [x; alpha])
+        :param R: measurement noise covariance matrix
+        :param prior_pose: prior of the initial pose
+        :param prior_cov: covariance of the prior (defaults to a tight prior, anchoring the map)
+        :param lateral_std: standard deviation of sideways motion per odometry step [m]. The motion model has no
+        sideways noise, which would make the odometry covariance singular.
+        """
+
+        self.Q = np.asarray(Q, dtype=np.float64)
+        self.R = np.asarray(R, dtype=np.float64)
+        self.prior_pose = np.asarray(prior_pose, dtype=np.float64)
+        self.prior_cov = np.eye(3) * 1e-9 if prior_cov is None else np.asarray(prior_cov, dtype=np.float64)
+        self.lateral_std = lateral_std
+
+        self.landmark_lookup = []
+
+        self._poses = [self.prior_pose.copy()]
+        self._landmarks = []
+        self._controls = []
+        self._obs_poses = []
+        self._obs_landmarks = []
+        self._obs_Y = []
+
+    @property
+    def poses(self):
+        """
+        Pose estimates (T + 1, 3)
+        """
+
+        return np.array(self._poses)
+
+    @property
+    def landmarks(self):
+        """
+        Landmark position estimates (N, 2)
+        """
+
+        return np.array(self._landmarks).reshape(-1, 2)
+
+    @property
+    def X(self):
+        """
+        Latest pose and landmark estimates, in the layout of EKFSLAM.X
+        """
+
+        return np.concatenate([self._poses[-1], self.landmarks.ravel()])
+
+    def get_num_landmarks(self):
+        """
+        Return number of landmarks
+
+        :return:
+        """
+
+        return len(self.landmark_lookup)
+
+    def get_landmark_index(self, landmark_id):
+        """
+        Get the index of the landmark with the given ID
+
+        :param landmark_id: landmark ID
+        :return: landmark index
+        """
+
+        return self.landmark_lookup.index(landmark_id)
+
+    def add_odometry(self, U):
+        """
+        Add an odometry step, and a new pose initialised by dead reckoning
+
+        :param U: control input (d_x, d_alpha)
+        :return: index of the new pose
+        """
+
+        U = np.asarray(U, dtype=np.float64)
+        self._controls.append(U)
+        self._poses.append(np.asarray(move_batch(self._poses[-1], U, np.zeros(2))))
+
+        return len(self._poses) - 1
+
+    def add_range_bearing(self, y_meas, landmark_id, pose_index=None):
+        """
+        Add a range-bearing observation of a landmark. New landmarks are initialised by inverse observation.
+
+        :param y_meas: range-bearing measurement
+        :param landmark_id: ID of the observed landmark
+        :param pose_index: index of the pose the observation was made from (defaults to the latest pose)
+        :return:
+        """
+
+        if pose_index is None:
+            pose_index = len(self._poses) - 1
+
+        y_meas = np.asarray(y_meas, dtype=np.float64)
+        if landmark_id not in self.landmark_lookup:
+            self.landmark_lookup.append(landmark_id)
+            self._landmarks.append(np.asarray(RangeBearingSensor.inv_observe_range_bearing_batch(
+                self._poses[pose_index], y_meas)))
+
+        self._obs_poses.append(pose_index)
+        self._obs_landmarks.append(self.get_landmark_index(landmark_id))
+        self._obs_Y.append(y_meas)
+
+    def add_scan(self, Y_meas, landmark_ids, pose_index=None):
+        """
+        Add the range-bearing observations of a scan
+
+        :param Y_meas: range-bearing measurements (K, 2)
+        :param landmark_ids: IDs of the measured landmarks (K values)
+        :param pose_index: index of the pose the scan was made from (defaults to the latest pose)
+        :return:
+        """
+
+        for y_meas, landmark_id in zip(np.asarray(Y_meas, dtype=np.float64).reshape(-1, 2), landmark_ids):
+            self.add_range_bearing(y_meas, landmark_id, pose_index)
+
+    def state_and_state_cov_propagation(self, U):
+        """
+        Record an odometry step (recording interface of the recursive estimators)
+        """
+
+        self.add_odometry(U)
+
+    def state_and_state_cov_propagation_many(self, U_list):
+        """
+        Record several odometry steps (recording interface of the recursive estimators)
+        """
+
+        for U in U_list:
+            self.add_odometry(U)
+
+    def range_bearing_scan_update(self, Y_meas, landmark_ids):
+        """
+        Record a scan from the latest pose (recording interface of the recursive estimators)
+        """
+
+        self.add_scan(Y_meas, landmark_ids)
+
+    def _odometry_whitening(self, poses):
+        """
+        Whitening matrices of the odometry factors, from the covariance F_n Q F_n^T of the motion noise plus sideways
+        noise, at the given poses
+
+        The covariance rotates with the heading. It is evaluated once per optimisation and then held fixed, so that
+        the Jacobian of the whitened errors is exact (the usual approximation in graph SLAM).
+
+        :param poses: pose estimates (T + 1, 3)
+        :return: W (T, 3, 3)
+        """
+
+        U = np.array(self._controls).reshape(-1, 2)
+        x_u, alpha_u = U[:, 0], U[:, 1]
+        alpha_r = poses[:-1, 2]
+
+        F_n = np.asarray(EKFSLAM.jacobian_f_N_batch(x_u, 0., alpha_r, alpha_u, 0.)).reshape(-1, 3, 2)
+        angle = alpha_r + alpha_u
+        lateral = np.stack([-np.sin(angle), np.cos(angle), np.zeros_like(angle)], axis=1)
+        cov = np.matmul(np.matmul(F_n, self.Q), F_n.swapaxes(-1, -2)) + \
+            self.lateral_std ** 2 * lateral[:, :, None] * lateral[:, None, :]
+
+        return _whitening(cov)
+
+    def _linearise(self, poses, landmarks, W_odometry):
+        """
+        Whitened errors of all factors and their sparse Jacobian w.r.t. [poses; landmarks]
+
+        :param poses: pose estimates (T + 1, 3)
+        :param landmarks: landmark estimates (N, 2)
+        :param W_odometry: whitening matrices of the odometry factors (T, 3, 3), see _odometry_whitening
+        :return: errors e (m,), Jacobian J (m x n, CSR)
+        """
+
+        num_poses = poses.shape[0]
+        n = 3 * num_poses + 2 * landmarks.shape[0]
+        errors, rows, cols, values = [], [], [], []
+        num_rows = 0
+
+        def add_blocks(row_start, col_starts, blocks):
+            r, c = _block_indices(row_start, col_starts, blocks.shape[1:])
+            rows.append(r)
+            cols.append(c)
+            values.append(blocks.ravel())
+
+        # prior on the first pose
+        W_0 = _whitening(self.prior_cov)
+        e_0 = poses[0] - self.prior_pose
+        e_0[2] = _wrap(e_0[2])
+        errors.append(np.dot(W_0, e_0))
+        add_blocks(np.array([0]), np.array([0]), W_0[None])
+        num_rows += 3
+
+        # odometry factors: e = x[t + 1] - f(x[t], U[t])
+        T = num_poses - 1
+        if T > 0:
+            U = np.array(self._controls)
+            x_u, alpha_u = U[:, 0], U[:, 1]
+            alpha_r = poses[:-1, 2]
+            e = poses[1:] - np.asarray(move_batch(poses[:-1], U, np.zeros(2)))
+            e[:, 2] = _wrap(e[:, 2])
+
+            F_x = np.asarray(EKFSLAM.jacobian_f_X_r_batch(x_u, 0., alpha_r, alpha_u, 0.))
+            W = W_odometry
+
+            row_starts = num_rows + 3 * np.arange(T)
+            errors.append(np.einsum("tij,tj->ti", W, e).ravel())
+            add_blocks(row_starts, 3 * np.arange(T), -np.matmul(W, F_x))
+            add_blocks(row_starts, 3 * np.arange(1, T + 1), W)
+            num_rows += 3 * T
+
+        # range-bearing factors: e = h(x[t], l[j]) - y
+        K = len(self._obs_Y)
+        if K > 0:
+            t, j = np.array(self._obs_poses), np.array(self._obs_landmarks)
+            X_r, L = poses[t], landmarks[j]
+            e = np.asarray(RangeBearingSensor.observe_range_bearing_batch(X_r, L)) - np.array(self._obs_Y)
+            e[:, 1] = _wrap(e[:, 1])
+
+            H_R = np.asarray(RangeBearingSensor.jacobian_H_X_r_batch(X_r, L))
+            H_L = np.asarray(RangeBearingSensor.jacobian_H_L_i_batch(X_r, L))
+            W = _whitening(self.R)
+
+            row_starts = num_rows + 2 * np.arange(K)
+            errors.append(np.dot(e, W.T).ravel())
+            add_blocks(row_starts, 3 * t, np.matmul(W, H_R))
+            add_blocks(row_starts, 3 * num_poses + 2 * j, np.matmul(W, H_L))
+            num_rows += 2 * K
+
+        J = scipy.sparse.coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                                    shape=(num_rows, n)).tocsr()
+
+        return np.concatenate(errors), J
+
+    def cost(self):
+        """
+        Cost (half the sum of squared whitened errors) at the current estimates
+        """
+
+        poses = self.poses
+        e, _ = self._linearise(poses, self.landmarks, self._odometry_whitening(poses))
+
+        return 0.5 * np.dot(e, e)
+
+    def _step(self, poses, landmarks, dx, W_odometry):
+        """
+        Apply a step to the poses and landmarks
+
+        :return: new poses, new landmarks, and their errors, Jacobian and cost
+        """
+
+        new_poses = poses + dx[:poses.size].reshape(-1, 3)
+        new_poses[:, 2] = _wrap(new_poses[:, 2])
+        new_landmarks = landmarks + dx[poses.size:].reshape(-1, 2)
+        new_e, new_J = self._linearise(new_poses, new_landmarks, W_odometry)
+
+        return new_poses, new_landmarks, new_e, new_J, 0.5 * np.dot(new_e, new_e)
+
+    def optimise(self, method="lm", max_iterations=50, tol=1e-10, ordering="COLAMD", damping=1e-4,
+                 max_step_halvings=30):
+        """
+        Optimise all poses and landmarks
+
+        :param method: "gn" (Gauss-Newton) or "lm" (Levenberg-Marquardt, with damping lambda diag(J^T J))
+        :param max_iterations: maximum number of iterations
+        :param tol: stop when the relative decrease of the cost, or the step relative to the estimates, is below tol
+        :param ordering: column ordering of the sparse LU factorisation, to reduce fill-in (see scipy.sparse.linalg.splu
+        permc_spec, e.g. "COLAMD", "MMD_AT_PLUS_A" or "NATURAL")
+        :param damping: initial Levenberg-Marquardt damping lambda
+        :param max_step_halvings: number of times a Gauss-Newton step that increases the cost is halved before it is
+        rejected (the optimisation then stops, not converged)
+        :return: dict with the cost history, number of iterations, whether it converged, and the number of non-zeros of
+        the LU factors of the last solve (a measure of fill-in)
+        """
+
+        if method not in ("gn", "lm"):
+            raise ValueError("Unknown method: {}".format(method))
+
+        poses, landmarks = self.poses, self.landmarks
+
+        W_odometry = self._odometry_whitening(poses)
+        e, J = self._linearise(poses, landmarks, W_odometry)
+        costs = [0.5 * np.dot(e, e)]
+        lambda_ = damping if method == "lm" else 0.
+        converged = False
+        factor_nnz = None
+        iteration = 0
+
+        while iteration < max_iterations and not converged:
+            iteration += 1
+            A = (J.T @ J).tocsc()
+            g = J.T @ e
+
+            while True:
+                A_damped = A + scipy.sparse.diags(lambda_ * A.diagonal()) if lambda_ > 0 else A
+                factor = scipy.sparse.linalg.splu(A_damped.tocsc(), permc_spec=ordering)
+                factor_nnz = factor.L.nnz + factor.U.nnz
+                dx = factor.solve(-g)
+                new_poses, new_landmarks, new_e, new_J, new_cost = self._step(poses, landmarks, dx, W_odometry)
+
+                if method == "gn":
+                    # step increased the cost (e.g. far from the solution, where the linearisation is poor): halve it
+                    for _ in range(max_step_halvings):
+                        if new_cost <= costs[-1]:
+                            break
+                        dx = dx / 2
+                        new_poses, new_landmarks, new_e, new_J, new_cost = self._step(poses, landmarks, dx,
+                                                                                      W_odometry)
+                    break
+
+                if new_cost <= costs[-1]:
+                    break
+
+                # step increased the cost: increase damping and try again
+                lambda_ *= 10
+                if lambda_ > 1e10:
+                    new_poses, new_landmarks, new_e, new_J, new_cost = poses, landmarks, e, J, costs[-1]
+                    break
+
+            if new_cost > costs[-1]:
+                # no step along the Gauss-Newton direction decreases the cost: keep the estimate, not converged
+                break
+
+            step_norm = np.sqrt(np.sum((new_poses - poses) ** 2) + np.sum((new_landmarks - landmarks) ** 2))
+            state_norm = np.sqrt(np.sum(poses ** 2) + np.sum(landmarks ** 2))
+            converged = 0 <= costs[-1] - new_cost <= tol * costs[-1] or step_norm <= tol * (state_norm + tol)
+            poses, landmarks, e, J = new_poses, new_landmarks, new_e, new_J
+            costs.append(new_cost)
+            if method == "lm":
+                lambda_ = max(lambda_ / 10, 1e-12)
+
+        self._poses = list(poses)
+        self._landmarks = list(landmarks)
+
+        return {"cost": costs, "iterations": iteration, "converged": converged, "factor_nnz": factor_nnz}
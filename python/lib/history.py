@@ -0,0 +1,303 @@
+# Bounded-memory history of an estimator's robot pose, robot pose covariance and selected landmarks, for long runs
+#
+# Recent samples are kept at full resolution in a fixed-size ring buffer. Samples that drop out of it are downsampled
+# into buckets (first and last step, count, and the min, max and mean of each quantity), which are kept in further
+# fixed-size ring buffers, each level bucketing the one before. Buckets that drop out of the last level are appended
+# to a file (if a spill path is given) or discarded. Memory use is fixed when the recorder is created.
+
+import numpy as onp
+
+
+def sample_dtype(num_landmarks):
+    """
+    Record type of a full resolution sample
+
+    :param num_landmarks: number of recorded landmarks
+    :return: structured dtype with fields step, pose (3,), P_rr (3, 3) and landmarks (num_landmarks, 2)
+    """
+
+    return onp.dtype([("step", onp.int64),
+                      ("pose", onp.float64, (3,)),
+                      ("P_rr", onp.float64, (3, 3)),
+                      ("landmarks", onp.float64, (num_landmarks, 2))])
+
+
+def bucket_dtype(num_landmarks):
+    """
+    Record type of a bucket of downsampled samples
+
+    :param num_landmarks: number of recorded landmarks
+    :return: structured dtype with fields step_first, step_last, count, landmarks_count (number of samples in which
+    each landmark was in the map), and the _min, _max and _mean of pose, P_rr and landmarks
+    """
+
+    fields = [("step_first", onp.int64), ("step_last", onp.int64), ("count", onp.int64),
+              ("landmarks_count", onp.int64, (num_landmarks,))]
+    for name, shape in (("pose", (3,)), ("P_rr", (3, 3)), ("landmarks", (num_landmarks, 2))):
+        fields += [(name + "_" + statistic, onp.float64, shape) for statistic in ("min", "max", "mean")]
+
+    return onp.dtype(fields)
+
+
+def samples_to_buckets(samples, num_landmarks):
+    """
+    Convert samples to buckets of one sample each
+
+    :param samples: records of sample_dtype(num_landmarks)
+    :param num_landmarks: number of recorded landmarks
+    :return: records of bucket_dtype(num_landmarks)
+    """
+
+    buckets = onp.empty(samples.shape[0], dtype=bucket_dtype(num_landmarks))
+    buckets["step_first"] = samples["step"]
+    buckets["step_last"] = samples["step"]
+    buckets["count"] = 1
+    buckets["landmarks_count"] = ~onp.isnan(samples["landmarks"][..., 0])
+    for name in ("pose", "P_rr", "landmarks"):
+        for statistic in ("min", "max", "mean"):
+            buckets[name + "_" + statistic] = samples[name]
+
+    return buckets
+
+
+def merge_buckets(buckets):
+    """
+    Merge buckets into one. Landmark values are nan while a landmark is not in the map, and are ignored by the
+    statistics (which are nan if there are no values).
+
+    :param buckets: records of a bucket dtype, in step order
+    :return: merged bucket (a record of the same dtype)
+    """
+
+    merged = onp.zeros((), dtype=buckets.dtype)
+    merged["step_first"] = buckets["step_first"][0]
+    merged["step_last"] = buckets["step_last"][-1]
+    merged["count"] = buckets["count"].sum()
+    merged["landmarks_count"] = buckets["landmarks_count"].sum(axis=0)
+
+    # means are weighted by the number of samples each bucket has a value from
+    for name, count in (("pose", buckets["count"][:, None]), ("P_rr", buckets["count"][:, None, None]),
+                        ("landmarks", buckets["landmarks_count"][:, :, None])):
+        merged[name + "_min"] = onp.fmin.reduce(buckets[name + "_min"], axis=0)
+        merged[name + "_max"] = onp.fmax.reduce(buckets[name + "_max"], axis=0)
+
+        mean = buckets[name + "_mean"]
+        total = onp.sum(onp.where(count > 0, mean, 0) * count, axis=0)
+        num = onp.sum(count, axis=0)
+        merged[name + "_mean"] = onp.where(num > 0, total / onp.maximum(num, 1), onp.nan)
+
+    return merged
+
+
+class MirroredRingBuffer:
+    """
+    Fixed-size ring buffer of records, stored twice (at i and i + capacity), so that the buffered records in order are
+    always one contiguous slice: view() is zero-copy
+    """
+
+    def __init__(self, capacity, dtype):
+        """
+        :param capacity: number of records kept
+        :param dtype: record dtype
+        """
+
+        self.capacity = max(capacity, 1)
+        self.count = 0
+        self._buf = onp.zeros(2 * self.capacity, dtype=dtype)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def nbytes(self):
+        return self._buf.nbytes
+
+    def append(self, record):
+        """
+        Append a record
+
+        :param record: record (of the buffer dtype)
+        :return: the record that dropped out of the buffer (a copy), or None
+        """
+
+        i = self.count % self.capacity
+        evicted = self._buf[i].copy() if self.count >= self.capacity else None
+        self._buf[i] = record
+        self._buf[i + self.capacity] = record
+        self.count += 1
+
+        return evicted
+
+    def view(self):
+        """
+        Buffered records, oldest first (a read-only view, valid until the next append)
+        """
+
+        start = self.count % self.capacity if self.count > self.capacity else 0
+        view = self._buf[start:start + len(self)]
+        view.flags.writeable = False
+
+        return view
+
+
+class HistoryRecorder:
+    """
+    Records the robot pose, robot pose covariance and selected landmarks of an estimator, in bounded memory
+
+    Attach it to an estimator (estimator.history = HistoryRecorder()) to record the filtered estimate at the start of
+    every prediction step (i.e. after the measurement updates of the previous step). Only every decimation-th step is
+    recorded. Recording is O(1) in the number of landmarks in the map (apart from looking up the selected landmarks),
+    and does not read the full state covariance matrix.
+
+    samples() gives the recent full resolution samples, buckets(level) the downsampled older ones and spilled() the
+    buckets written to disk, all as structured arrays without copying (e.g. history.samples()["pose"][:, 0]). Records
+    waiting to fill a bucket (fewer than bucket_size) are not in any of these.
+    """
+
+    def __init__(self, capacity=4096, decimation=1, landmark_ids=(), bucket_size=16, num_levels=2,
+                 level_capacity=None, spill_path=None):
+        """
+        :param capacity: number of full resolution samples kept
+        :param decimation: record every decimation-th step
+        :param landmark_ids: IDs of the landmarks to record (nan while a landmark is not in the map)
+        :param bucket_size: number of samples (or buckets of the previous level) merged into one bucket
+        :param num_levels: number of resolution levels, including the full resolution samples
+        :param level_capacity: number of buckets kept per downsampled level (defaults to capacity)
+        :param spill_path: file that buckets dropping out of the last level are appended to (if None, they are
+        discarded)
+        """
+
+        if decimation < 1 or bucket_size < 1 or num_levels < 1:
+            raise ValueError("decimation, bucket_size and num_levels must be at least 1")
+
+        self.decimation = decimation
+        self.landmark_ids = list(landmark_ids)
+        self.bucket_size = bucket_size
+        self.spill_path = spill_path
+
+        K = len(self.landmark_ids)
+        self.sample_dtype = sample_dtype(K)
+        self.bucket_dtype = bucket_dtype(K)
+
+        level_capacity = capacity if level_capacity is None else level_capacity
+        self._samples = MirroredRingBuffer(capacity, self.sample_dtype)
+        self._levels = [MirroredRingBuffer(level_capacity, self.bucket_dtype) for _ in range(num_levels - 1)]
+        self._pending = [[] for _ in self._levels]      # samples or buckets waiting to be merged into a bucket
+        self._sample = onp.zeros((), dtype=self.sample_dtype)
+
+        self.num_offered = 0
+        self.num_spilled = 0
+        self._spill_file = None
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the buffers (fixed)
+        """
+
+        return self._samples.nbytes + sum(level.nbytes for level in self._levels)
+
+    def record(self, estimator, step=None):
+        """
+        Record the current estimate (if this step is not skipped by decimation)
+
+        :param estimator: estimator with X, robot_covariance() and landmark_lookup
+        :param step: step number (defaults to estimator.num_steps)
+        :return: whether the step was recorded
+        """
+
+        self.num_offered += 1
+        if (self.num_offered - 1) % self.decimation != 0:
+            return False
+
+        sample = self._sample
+        sample["step"] = estimator.num_steps if step is None else step
+        X = estimator.X
+        sample["pose"] = X[:3]
+        sample["P_rr"] = estimator.robot_covariance()
+        landmarks = sample["landmarks"]
+        for k, landmark_id in enumerate(self.landmark_ids):
+            if landmark_id in estimator.landmark_lookup:
+                i = 3 + 2 * estimator.landmark_lookup.index(landmark_id)
+                landmarks[k] = X[i:i + 2]
+            else:
+                landmarks[k] = onp.nan
+
+        evicted = self._samples.append(sample)
+        if evicted is not None:
+            self._push(0, evicted)
+
+        return True
+
+    def _push(self, level, record):
+        """
+        Add a record that dropped out of a level to the pending bucket of the next level (or spill it, after the last)
+        """
+
+        if level == len(self._levels):
+            self._spill(record)
+            return
+
+        pending = self._pending[level]
+        pending.append(record)
+        if len(pending) < self.bucket_size:
+            return
+
+        records = onp.array(pending)
+        pending.clear()
+        buckets = samples_to_buckets(records, len(self.landmark_ids)) if level == 0 else records
+
+        evicted = self._levels[level].append(merge_buckets(buckets))
+        if evicted is not None:
+            self._push(level + 1, evicted)
+
+    def _spill(self, record):
+        if self.spill_path is None:
+            return
+
+        if self._spill_file is None:
+            self._spill_file = open(self.spill_path, "wb")
+        self._spill_file.write(record.tobytes())
+        self.num_spilled += 1
+
+    def samples(self):
+        """
+        Recent full resolution samples, oldest first (read-only view of sample_dtype records)
+        """
+
+        return self._samples.view()
+
+    def buckets(self, level=1):
+        """
+        Downsampled buckets of a level, oldest first (read-only view of bucket_dtype records)
+
+        :param level: 1 to num_levels - 1 (each bucket of level l merges bucket_size ** l samples)
+        """
+
+        if not 1 <= level <= len(self._levels):
+            raise ValueError("level must be between 1 and {}".format(len(self._levels)))
+
+        return self._levels[level - 1].view()
+
+    def spilled(self):
+        """
+        Records written to the spill file, oldest first (a read-only memory map of bucket_dtype records, or of
+        sample_dtype records if num_levels is 1)
+        """
+
+        dtype = self.bucket_dtype if self._levels else self.sample_dtype
+        if self._spill_file is not None:
+            self._spill_file.flush()
+        if self.num_spilled == 0:
+            return onp.zeros(0, dtype=dtype)
+
+        return onp.memmap(self.spill_path, dtype=dtype, mode="r", shape=(self.num_spilled,))
+
+    def close(self):
+        """
+        Close the spill file
+        """
+
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
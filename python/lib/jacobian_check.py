@@ -0,0 +1,189 @@
+# Verification of the analytic Jacobians (ekf.py and sensors.py) against automatic differentiation, over many points
+#
+# For each Jacobian, random points are sampled, the autodiff reference is evaluated for all of them in one batched call
+# (jax.vmap(jax.jacfwd(f))) and compared to the analytic Jacobian. The report gives the largest error, where it occurs,
+# and the time taken by the analytic and autodiff Jacobians. Needs USE_JAX (and JAX_ENABLE_X64), so that the models
+# can be differentiated.
+
+import time
+from collections import namedtuple
+
+import numpy as onp
+
+from python.lib import backend
+from python.lib.ekf import EKFSLAM
+from python.lib.sensors import RangeBearingSensor
+
+# name: name of the analytic Jacobian
+# function: model function f(*inputs) that it is the Jacobian of
+# inputs: names of the sampled points passed to function (see sample_points)
+# argnum: index of the input the Jacobian is taken w.r.t.
+# analytic: function analytic(points) returning the analytic Jacobians at all points (N, m, d)
+JacobianCase = namedtuple("JacobianCase", ["name", "function", "inputs", "argnum", "analytic"])
+
+# max_error: largest absolute difference to the autodiff Jacobian
+# index, entry: point and Jacobian entry (row, column) where it occurs
+# point: inputs at that point
+# analytic_time, autodiff_time: time to compute the Jacobians at all points [s] (best of 3, both compiled with jax.jit)
+JacobianReport = namedtuple("JacobianReport", ["name", "num_points", "max_error", "index", "entry", "point",
+                                               "analytic_time", "autodiff_time"])
+
+
+def sample_points(num_points, seed=0, max_range=50.):
+    """
+    Sample random robot poses, controls, noise, landmarks and measurements
+
+    Landmarks are at least 0.5 m from the robot, away from the singularity of the range-bearing Jacobians at range 0.
+
+    :param num_points: number of points
+    :param seed: random seed
+    :param max_range: largest landmark range [m]
+    :return: dict of arrays: X_r (N, 3), U (N, 2), N (N, 2), L (N, 2) and Y (N, 2)
+    """
+
+    rng = onp.random.RandomState(seed)
+    X_r = onp.column_stack([rng.uniform(-100, 100, (num_points, 2)), rng.uniform(-onp.pi, onp.pi, num_points)])
+    U = onp.column_stack([rng.uniform(0, 5, num_points), rng.uniform(-onp.pi / 4, onp.pi / 4, num_points)])
+    N = rng.normal(0, [0.1, 0.05], (num_points, 2))
+    Y = onp.column_stack([rng.uniform(0.5, max_range, num_points), rng.uniform(-onp.pi, onp.pi, num_points)])
+    L = onp.asarray(RangeBearingSensor.inv_observe_range_bearing_batch(X_r, Y))
+
+    return {"X_r": X_r, "U": U, "N": N, "L": L, "Y": Y}
+
+
+def _motion_arguments(points):
+    U, N = points["U"], points["N"]
+
+    return U[:, 0], N[:, 0], points["X_r"][:, 2], U[:, 1], N[:, 1]
+
+
+def _per_point(jacobian, arguments):
+    import jax
+
+    # the single point Jacobian code, mapped over the points
+    return jax.vmap(jacobian)(*arguments)
+
+
+def _sensor_arguments(points, measurement):
+    X_r, Z = points["X_r"], points[measurement]
+
+    return X_r[:, 0], X_r[:, 1], X_r[:, 2], Z[:, 0], Z[:, 1]
+
+
+def default_cases():
+    """
+    Cases for the analytic Jacobians of ekf.py and sensors.py: the single point versions (mapped over the points with
+    jax.vmap) and the vectorised versions
+
+    :return: list of JacobianCase
+    """
+
+    f = EKFSLAM.state_propagation
+    h = RangeBearingSensor.observe_range_bearing
+    g = RangeBearingSensor.inv_observe_range_bearing
+    rbs = RangeBearingSensor
+
+    return [
+        JacobianCase("jacobian_f_X_r", f, ("X_r", "U", "N"), 0,
+                     lambda p: _per_point(EKFSLAM.jacobian_f_X_r, _motion_arguments(p))),
+        JacobianCase("jacobian_f_N", f, ("X_r", "U", "N"), 2,
+                     lambda p: _per_point(EKFSLAM.jacobian_f_N, _motion_arguments(p))),
+        JacobianCase("jacobian_H_X_r", h, ("X_r", "L"), 0,
+                     lambda p: _per_point(rbs.jacobian_H_X_r, _sensor_arguments(p, "L"))),
+        JacobianCase("jacobian_H_L_i", h, ("X_r", "L"), 1,
+                     lambda p: _per_point(rbs.jacobian_H_L_i, _sensor_arguments(p, "L"))),
+        JacobianCase("jacobian_G_X_r", g, ("X_r", "Y"), 0,
+                     lambda p: _per_point(rbs.jacobian_G_X_r, _sensor_arguments(p, "Y"))),
+        JacobianCase("jacobian_G_y_i", g, ("X_r", "Y"), 1,
+                     lambda p: _per_point(rbs.jacobian_G_y_i, _sensor_arguments(p, "Y"))),
+        JacobianCase("jacobian_f_X_r_batch", f, ("X_r", "U", "N"), 0,
+                     lambda p: EKFSLAM.jacobian_f_X_r_batch(*_motion_arguments(p))),
+        JacobianCase("jacobian_f_N_batch", f, ("X_r", "U", "N"), 2,
+                     lambda p: EKFSLAM.jacobian_f_N_batch(*_motion_arguments(p))),
+        JacobianCase("jacobian_H_X_r_batch", h, ("X_r", "L"), 0,
+                     lambda p: rbs.jacobian_H_X_r_batch(p["X_r"], p["L"])),
+        JacobianCase("jacobian_H_L_i_batch", h, ("X_r", "L"), 1,
+                     lambda p: rbs.jacobian_H_L_i_batch(p["X_r"], p["L"])),
+        JacobianCase("jacobian_G_X_r_batch", g, ("X_r", "Y"), 0,
+                     lambda p: rbs.jacobian_G_X_r_batch(p["X_r"], p["Y"])),
+        JacobianCase("jacobian_G_y_i_batch", g, ("X_r", "Y"), 1,
+                     lambda p: rbs.jacobian_G_y_i_batch(p["X_r"], p["Y"])),
+    ]
+
+
+def _timed(function, *args, repeat=3):
+    """
+    Call a (compiled) function, and return its result and the shortest time of repeat calls
+    """
+
+    times = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        result = function(*args).block_until_ready()
+        times.append(time.perf_counter() - t_start)
+
+    return result, min(times)
+
+
+def check_case(case, points):
+    """
+    Compare an analytic Jacobian to autodiff at all points
+
+    :param case: JacobianCase
+    :param points: sampled points (see sample_points)
+    :return: JacobianReport
+    """
+
+    import jax
+
+    inputs = [points[name] for name in case.inputs]
+    reference = jax.jit(jax.vmap(jax.jacfwd(case.function, argnums=case.argnum)))
+    reference(*inputs).block_until_ready()     # compile first, so that only evaluation is timed
+
+    J_autodiff, autodiff_time = _timed(reference, *inputs)
+
+    analytic = jax.jit(case.analytic)
+    analytic(points).block_until_ready()
+    J_analytic, analytic_time = _timed(analytic, points)
+
+    error = onp.abs(onp.asarray(J_analytic) - onp.asarray(J_autodiff))
+    index, row, col = onp.unravel_index(onp.argmax(error), error.shape)
+
+    return JacobianReport(case.name, error.shape[0], float(error[index, row, col]), int(index), (int(row), int(col)),
+                          {name: points[name][index] for name in case.inputs}, analytic_time, autodiff_time)
+
+
+def check_jacobians(num_points=2000, seed=0, cases=None):
+    """
+    Compare the analytic Jacobians to autodiff at num_points random points each
+
+    :param num_points: number of points
+    :param seed: random seed
+    :param cases: list of JacobianCase (defaults to default_cases())
+    :return: list of JacobianReport
+    """
+
+    if not backend.USE_JAX:
+        raise RuntimeError("Set USE_JAX=True (and JAX_ENABLE_X64=True) to differentiate the models with JAX")
+
+    points = sample_points(num_points, seed)
+
+    return [check_case(case, points) for case in (default_cases() if cases is None else cases)]
+
+
+def format_reports(reports):
+    """
+    Format reports as a table
+
+    :param reports: list of JacobianReport
+    :return: str
+    """
+
+    lines = ["{:<22} {:>8} {:>10} {:>8} {:>7} {:>13} {:>13}".format(
+        "jacobian", "points", "max error", "at", "entry", "analytic [ms]", "autodiff [ms]")]
+    for r in reports:
+        lines.append("{:<22} {:>8} {:>10.2e} {:>8} {:>7} {:>13.3f} {:>13.3f}".format(
+            r.name, r.num_points, r.max_error, r.index, "{},{}".format(*r.entry), 1e3 * r.analytic_time,
+            1e3 * r.autodiff_time))
+
+    return "\n".join(lines)
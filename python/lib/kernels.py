@@ -0,0 +1,113 @@
+# Kernels for the per-landmark work of the EKF update: range-bearing Jacobians, innovations and the symmetric rank
+# update of the state covariance matrix.
+#
+# The NumPy kernels below are always available. A compiled (numba) version of each kernel is in kernels_numba.py. It is
+# only imported when requested, since importing numba is slow, and its compiled kernels are cached on disk.
+
+import os
+import warnings
+
+import numpy as np
+
+from python.lib.sensors import RangeBearingSensor
+
+
+class NumpyKernels:
+    name = "numpy"
+    uses_pose_context = True        # whether observe_jacobians uses its ctx argument
+
+    @staticmethod
+    def observe_jacobians(X_r, L, ctx=None):
+        """
+        Predicted range-bearing measurements of landmarks and the Jacobians of the observation function (the vectorised
+        functions of RangeBearingSensor)
+
+        :param X_r: robot pose (3,)
+        :param L: landmark positions in world ref frame (K, 2)
+        :param ctx: PoseContext of X_r (optional, to reuse its sin and cos)
+        :return: h (K, 2), H_R (K, 2, 3) w.r.t. robot pose and H_L (K, 2, 2) w.r.t. landmark position
+        """
+
+        X_r = X_r[:3]
+        h = np.asarray(RangeBearingSensor.observe_range_bearing_batch(X_r, L, ctx=ctx))
+        H_R = np.asarray(RangeBearingSensor.jacobian_H_X_r_batch(X_r, L))
+        H_L = np.asarray(RangeBearingSensor.jacobian_H_L_i_batch(X_r, L))
+
+        return h, H_R, H_L
+
+    @classmethod
+    def linearise(cls, X_r, L, Y, ctx=None):
+        """
+        Innovations and Jacobians of range-bearing measurements of landmarks (observe_jacobians, then innovation)
+
+        :param X_r: robot pose (3,)
+        :param L: landmark positions in world ref frame (K, 2)
+        :param Y: measurements (K, 2)
+        :param ctx: PoseContext of X_r (optional, see observe_jacobians)
+        :return: innovations z (K, 2), H_R (K, 2, 3) and H_L (K, 2, 2)
+        """
+
+        h, H_R, H_L = cls.observe_jacobians(X_r, L, ctx=ctx)
+
+        return cls.innovation(Y, h), H_R, H_L
+
+    @staticmethod
+    def innovation(Y, h):
+        """
+        Innovation (measurement residual) of range-bearing measurements, with bearing wrapped to [-pi, pi)
+
+        :param Y: measurements (K, 2)
+        :param h: predicted measurements (K, 2)
+        :return: innovations (K, 2)
+        """
+
+        z = Y - h
+        z[:, 1] = (z[:, 1] + np.pi) % (2 * np.pi) - np.pi
+
+        return z
+
+    @staticmethod
+    def symmetric_rank_update(P, W):
+        """
+        In place symmetric rank-m update P -= W W^T
+
+        :param P: symmetric matrix (n, n)
+        :param W: (n, m)
+        :return:
+        """
+
+        P -= np.dot(W, W.T)
+
+
+def get_kernels(name=None):
+    """
+    Select kernel backend
+
+    :param name: "numpy", "numba", "auto" (numba if it is installed, otherwise NumPy) or "autodiff" (observation
+    Jacobians by automatic differentiation, needs USE_JAX). If None, the EKF_KERNELS environment variable is used,
+    defaulting to "numpy".
+    :return: kernels
+    """
+
+    if name is None:
+        name = os.environ.get("EKF_KERNELS", "numpy")
+
+    if name == "numpy":
+        return NumpyKernels
+
+    if name == "autodiff":
+        from python.lib.autodiff import AutodiffKernels, check_autodiff_available
+        check_autodiff_available()
+        return AutodiffKernels
+
+    if name not in ("numba", "auto"):
+        raise ValueError("Unknown kernel backend: {}".format(name))
+
+    try:
+        from python.lib.kernels_numba import NumbaKernels
+    except ImportError:
+        if name == "numba":
+            warnings.warn("numba is not installed, falling back to NumPy kernels")
+        return NumpyKernels
+
+    return NumbaKernels
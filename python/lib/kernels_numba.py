@@ -0,0 +1,81 @@
+# Compiled (numba) versions of the kernels in kernels.py. Import via kernels.get_kernels.
+#
+# Kernels are compiled in nopython mode, with parallel loops over landmarks / rows, and cached on disk (in __pycache__)
+# so that only the first process to use them pays the compile cost.
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True, parallel=True)
+def observe_jacobians(X_r, L):
+    K = L.shape[0]
+    h = np.empty((K, 2))
+    H_R = np.empty((K, 2, 3))
+    H_L = np.empty((K, 2, 2))
+
+    for k in prange(K):
+        d_x = L[k, 0] - X_r[0]
+        d_y = L[k, 1] - X_r[1]
+        q = d_x * d_x + d_y * d_y
+        rho = np.sqrt(q)
+
+        h[k, 0] = rho
+        h[k, 1] = (np.arctan2(d_y, d_x) - X_r[2] + np.pi) % (2 * np.pi) - np.pi
+
+        H_L[k, 0, 0] = d_x / rho
+        H_L[k, 0, 1] = d_y / rho
+        H_L[k, 1, 0] = -d_y / q
+        H_L[k, 1, 1] = d_x / q
+
+        H_R[k, 0, 0] = -d_x / rho
+        H_R[k, 0, 1] = -d_y / rho
+        H_R[k, 0, 2] = 0.
+        H_R[k, 1, 0] = d_y / q
+        H_R[k, 1, 1] = -d_x / q
+        H_R[k, 1, 2] = -1.
+
+    return h, H_R, H_L
+
+
+@njit(cache=True)
+def innovation(Y, h):
+    z = Y - h
+    for k in range(z.shape[0]):
+        z[k, 1] = (z[k, 1] + np.pi) % (2 * np.pi) - np.pi
+
+    return z
+
+
+@njit(cache=True, parallel=True)
+def symmetric_rank_update(P, W):
+    # each row i computes the upper triangle entries P[i, i:] and mirrors them into column i (below the diagonal), so
+    # no two threads write to the same element and no n x n temporary is needed
+    n, m = W.shape
+    for i in prange(n):
+        for j in range(i, n):
+            s = 0.
+            for k in range(m):
+                s += W[i, k] * W[j, k]
+            P[i, j] -= s
+            if j != i:
+                P[j, i] -= s
+
+
+class NumbaKernels:
+    name = "numba"
+    uses_pose_context = False
+
+    @staticmethod
+    def observe_jacobians(X_r, L, ctx=None):
+        # the compiled kernel computes the trigonometry of the pose itself, so ctx is not used
+        return observe_jacobians(X_r, L)
+
+    @classmethod
+    def linearise(cls, X_r, L, Y, ctx=None):
+        h, H_R, H_L = cls.observe_jacobians(X_r, L)
+
+        return cls.innovation(Y, h), H_R, H_L
+
+    innovation = staticmethod(innovation)
+    symmetric_rank_update = staticmethod(symmetric_rank_update)
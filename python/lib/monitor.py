@@ -0,0 +1,204 @@
+# Online filter consistency monitor: normalised innovation squared (NIS) and normalised estimation error squared (NEES)
+#
+# A consistent filter has NIS ~ chi-square with m degrees of freedom (m = measurement dimension) and NEES on the robot
+# pose ~ chi-square with 3 degrees of freedom. Values above the bounds mean the filter is overconfident (e.g. diverging),
+# window means below the lower bound mean it is too pessimistic.
+
+import math
+from collections import deque, namedtuple
+
+import numpy as onp
+
+Alert = namedtuple("Alert", ["step", "kind", "value", "lower", "upper"])
+
+
+def normal_quantile(p):
+    """
+    Quantile of the standard normal distribution (by bisection of the CDF, to double precision)
+
+    :param p: probability, 0 < p < 1
+    :return:
+    """
+
+    lower, upper = -40., 40.
+    while upper - lower > 1e-12:
+        middle = (lower + upper) / 2
+        if 0.5 * math.erfc(-middle / math.sqrt(2)) < p:
+            lower = middle
+        else:
+            upper = middle
+
+    return (lower + upper) / 2
+
+
+def chi2_quantile(p, dof):
+    """
+    Quantile of the chi-square distribution (Wilson-Hilferty approximation, exact for 2 degrees of freedom)
+
+    :param p: probability, 0 < p < 1
+    :param dof: degrees of freedom
+    :return:
+    """
+
+    if dof == 2:
+        return -2 * math.log(1 - p)
+
+    c = 2. / (9 * dof)
+
+    return dof * max(1 - c + normal_quantile(p) * math.sqrt(c), 0.) ** 3
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the most recent values, with a running sum (O(1) per value)
+    """
+
+    def __init__(self, size):
+        self.values = onp.zeros(size)
+        self.count = 0
+        self.total = 0.
+
+    def __len__(self):
+        return min(self.count, self.values.shape[0])
+
+    def append(self, value):
+        i = self.count % self.values.shape[0]
+        if self.count >= self.values.shape[0]:
+            self.total -= self.values[i]
+        self.values[i] = value
+        self.total += value
+        self.count += 1
+
+    def to_array(self):
+        """
+        Values in the buffer, oldest first (a copy)
+        """
+
+        size = self.values.shape[0]
+        if self.count <= size:
+            return self.values[:self.count].copy()
+
+        return onp.roll(self.values, -(self.count % size))
+
+
+class ConsistencyMonitor:
+    """
+    Records NIS (from each measurement update) and NEES (when the true robot pose is known) over a sliding window,
+    and raises alerts when they leave their chi-square bounds
+
+    Attach it to an estimator (estimator.monitor = ConsistencyMonitor()) to record the NIS of every update. The NIS is
+    computed from the whitened innovation C^-1 z that the update computes anyway (Z = C C^T), so recording is O(m) per
+    update, independent of the number of landmarks.
+
+    Two checks are made: each value against the upper bound of its own chi-square distribution, and the window sum
+    against the two-sided bounds of chi-square with the summed degrees of freedom. Alerts are kept in self.alerts
+    (the newest max_alerts) and passed to on_alert, if given.
+    """
+
+    def __init__(self, window=100, probability=0.99, on_alert=None, max_alerts=100):
+        """
+        :param window: number of recent values used for the windowed statistics
+        :param probability: probability mass inside the chi-square bounds
+        :param on_alert: optional function on_alert(alert) called with each Alert
+        :param max_alerts: number of recent alerts kept
+        """
+
+        self.probability = probability
+        self.on_alert = on_alert
+        self.alerts = deque(maxlen=max_alerts)
+
+        self.nis = RingBuffer(window)
+        self.nis_dof = RingBuffer(window)
+        self.nees = RingBuffer(window)
+        self.nees_dof = RingBuffer(window)
+
+        self._bounds = {}
+
+    def bounds(self, dof, num_samples=1):
+        """
+        Two-sided chi-square bounds of the mean of num_samples values with dof degrees of freedom in total
+
+        :param dof: total degrees of freedom
+        :param num_samples: number of values averaged
+        :return: lower bound, upper bound
+        """
+
+        key = (dof, num_samples)
+        if key not in self._bounds:
+            tail = (1 - self.probability) / 2
+            self._bounds[key] = (chi2_quantile(tail, dof) / num_samples, chi2_quantile(1 - tail, dof) / num_samples)
+
+        return self._bounds[key]
+
+    def record_whitened_innovation(self, v, step=None):
+        """
+        Record the NIS of a measurement update, z^T Z^-1 z = |v|^2 with v = C^-1 z the whitened innovation
+
+        :param v: whitened innovation (m,)
+        :param step: step number, for alerts
+        :return: NIS
+        """
+
+        value = float(onp.dot(v, v))
+        self._record(self.nis, self.nis_dof, "nis", value, v.shape[0], step)
+
+        return value
+
+    def record_pose_error(self, error, P_rr, step=None):
+        """
+        Record the NEES of the robot pose, e^T P_rr^-1 e
+
+        If P_rr is singular (e.g. shortly after starting from a known pose), the pseudo-inverse is used and the degrees
+        of freedom are the rank of P_rr.
+
+        :param error: estimated minus true robot pose (3,) (the heading error is wrapped here)
+        :param P_rr: estimated robot pose covariance (3x3)
+        :param step: step number, for alerts
+        :return: NEES
+        """
+
+        error = onp.array(error, dtype=onp.float64)
+        error[2] = (error[2] + onp.pi) % (2 * onp.pi) - onp.pi
+        P_rr = onp.asarray(P_rr, dtype=onp.float64)
+        dof = onp.linalg.matrix_rank(P_rr, hermitian=True)
+        if dof == 0:
+            return onp.nan
+
+        value = float(onp.dot(error, onp.dot(onp.linalg.pinv(P_rr, hermitian=True), error)))
+        self._record(self.nees, self.nees_dof, "nees", value, dof, step)
+
+        return value
+
+    def _record(self, values, dofs, kind, value, dof, step):
+        values.append(value)
+        dofs.append(dof)
+
+        upper = self.bounds(dof)[1]
+        if value > upper:
+            self._alert(Alert(step, kind, value, 0., upper))
+
+        num_samples = len(values)
+        if num_samples == values.values.shape[0]:
+            lower, upper = self.bounds(int(round(dofs.total)), num_samples)
+            mean = values.total / num_samples
+            if not lower <= mean <= upper:
+                self._alert(Alert(step, kind + "_window", mean, lower, upper))
+
+    def _alert(self, alert):
+        self.alerts.append(alert)
+        if self.on_alert is not None:
+            self.on_alert(alert)
+
+    def mean_nis(self):
+        """
+        Mean NIS over the window (nan if no updates yet)
+        """
+
+        return self.nis.total / len(self.nis) if len(self.nis) else onp.nan
+
+    def mean_nees(self):
+        """
+        Mean NEES over the window (nan if no poses recorded yet)
+        """
+
+        return self.nees.total / len(self.nees) if len(self.nees) else onp.nan
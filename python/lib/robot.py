@@ -1,13 +1,6 @@
 # robot motion
 
-import os
-if os.environ.get("USE_JAX", False):
-    import jax.numpy as np
-    from jax.config import config
-    # check that JAX is set to 64-bit precision
-    assert config.values["jax_enable_x64"]
-else:
-    import numpy as np
+from python.lib.backend import np
 
 from python.lib.transforms import rigid_transform_local_to_world, angle_to_rotation_matrix
 
@@ -51,3 +44,22 @@ def move(r, u, n):
     # r_new = [d_x_world, d_y_world, alpha + d_alpha]
 
     return r_new
+
+
+def move_batch(R, U, N):
+    """
+    Vectorised version of move. Leading dimensions of R, U and N are broadcast together (e.g. many particles moved
+    with one control input and a perturbation each).
+
+    :param R: current robot poses in world ref frame (..., 3)
+    :param U: control signals in local ref frame (..., 2)
+    :param N: perturbations to control inputs in local ref frame (..., 2)
+    :return: new robot poses in world ref frame (..., 3)
+    """
+
+    d_x_local = U[..., 0] + N[..., 0]
+    alpha_new = R[..., 2] + U[..., 1] + N[..., 1]
+
+    return np.stack([R[..., 0] + d_x_local * np.cos(alpha_new),
+                     R[..., 1] + d_x_local * np.sin(alpha_new),
+                     alpha_new], axis=-1)
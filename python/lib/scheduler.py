@@ -0,0 +1,127 @@
+# Event-driven scheduler that drives an EKFSLAM estimator from sensors running at different rates
+
+import heapq
+import itertools
+
+CONTROL = 0
+MEASUREMENT = 1
+
+
+class Source:
+    """
+    Periodic source of controls (odometry) or range-bearing measurements
+    """
+
+    def __init__(self, kind, period, read, offset=0.):
+        """
+        :param kind: CONTROL or MEASUREMENT
+        :param period: time between readings [s]
+        :param read: function read(t) returning the reading at time t. Control sources return a control input
+        (d_x, d_alpha); measurement sources return (Y, landmark_ids), with Y the (K, 2) range-bearing measurements of
+        the landmarks with the given IDs.
+        :param offset: time of the first reading [s]
+        """
+
+        self.kind = kind
+        self.period = period
+        self.read = read
+        self.offset = offset
+        self.count = 0
+
+    def next_time(self):
+        """
+        Time of the next reading [s] (computed from the reading count so that errors do not accumulate)
+        """
+
+        return self.offset + self.count * self.period
+
+
+class Scheduler:
+    """
+    Drives an EKFSLAM estimator from control and measurement sources, each with its own rate
+
+    Readings are processed in time order using a priority queue. Controls are not applied as they arrive: all controls
+    due before the next measurement are coalesced into a single prediction step (see
+    EKFSLAM.state_and_state_cov_propagation_many), so the O(n) robot to map cross covariance is only propagated once
+    per measurement rather than once per control. Controls and measurements due at the same time are processed
+    controls first.
+    """
+
+    def __init__(self, estimator, on_update=None):
+        """
+        :param estimator: EKFSLAM estimator
+        :param on_update: optional function on_update(t, estimator) called after each measurement update
+        """
+
+        self.estimator = estimator
+        self.on_update = on_update
+        self.time = 0.
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._pending_controls = []
+
+    def add_control_source(self, period, read, offset=0.):
+        """
+        Add a source of control inputs (e.g. odometry)
+
+        :param period: time between control inputs [s]
+        :param read: function read(t) returning the control input (d_x, d_alpha) at time t
+        :param offset: time of the first control input [s]
+        :return: the source
+        """
+
+        return self._add_source(Source(CONTROL, period, read, offset))
+
+    def add_measurement_source(self, period, read, offset=0.):
+        """
+        Add a source of range-bearing measurements
+
+        :param period: time between scans [s]
+        :param read: function read(t) returning (Y, landmark_ids) at time t
+        :param offset: time of the first scan [s]
+        :return: the source
+        """
+
+        return self._add_source(Source(MEASUREMENT, period, read, offset))
+
+    def _add_source(self, source):
+        heapq.heappush(self._queue, (source.next_time(), source.kind, next(self._seq), source))
+
+        return source
+
+    def run(self, until):
+        """
+        Process all readings due up to (and including) time until, then apply any remaining controls
+
+        :param until: end time [s]
+        :return:
+        """
+
+        while self._queue and self._queue[0][0] <= until:
+            t, kind, _, source = heapq.heappop(self._queue)
+            self.time = t
+
+            if kind == CONTROL:
+                self._pending_controls.append(source.read(t))
+            else:
+                self.flush()
+                self.estimator.range_bearing_scan_update(*source.read(t))
+                if self.on_update is not None:
+                    self.on_update(t, self.estimator)
+
+            source.count += 1
+            heapq.heappush(self._queue, (source.next_time(), source.kind, next(self._seq), source))
+
+        self.flush()
+
+    def flush(self):
+        """
+        Apply the pending control inputs as a single prediction step
+
+        :return:
+        """
+
+        if self._pending_controls:
+            self.estimator.state_and_state_cov_propagation_many(self._pending_controls)
+            self._pending_controls = []
@@ -0,0 +1,118 @@
+# Sensor models for the joint measurement update of EKFSLAM (EKFSLAM.joint_update)
+#
+# A sensor model gives, vectorised over measurements:
+#   observe(X_r, L)            predicted measurements (..., m)
+#   jacobians(X_r, L)          Jacobians H_R (..., m, 3) w.r.t. robot pose and H_L (..., m, 2) w.r.t. landmark position
+#   inverse_observe(X_r, Y)    landmark positions from measurements (..., 2), if initialises_landmarks
+#   inverse_jacobians(X_r, Y)  Jacobians G_r (..., 2, 3) and G_y (..., 2, m) of the inverse model
+# and the noise model R (m x m). Components listed in angles are wrapped to [-pi, pi) in innovations. Models that
+# observe the robot pose only (observes_landmarks = False) are passed L = None and return H_L = None.
+
+from python.lib.backend import np
+from python.lib.sensors import RangeBearingSensor
+
+
+class SensorModel:
+    """
+    Base class of sensor models (see the module description for the interface)
+    """
+
+    dim = None
+    angles = ()
+    observes_landmarks = True
+    initialises_landmarks = False
+
+    def __init__(self, R):
+        """
+        :param R: measurement noise covariance matrix (dim x dim)
+        """
+
+        self.R = np.asarray(R, dtype=np.float64).reshape(self.dim, self.dim)
+
+    def observe(self, X_r, L=None):
+        raise NotImplementedError
+
+    def jacobians(self, X_r, L=None):
+        raise NotImplementedError
+
+    def inverse_observe(self, X_r, Y):
+        raise NotImplementedError("{} cannot initialise landmarks".format(type(self).__name__))
+
+    def inverse_jacobians(self, X_r, Y):
+        raise NotImplementedError("{} cannot initialise landmarks".format(type(self).__name__))
+
+
+class RangeBearingModel(SensorModel):
+    """
+    Range [m] and bearing [rad] of a landmark, in the robot's ref frame (RangeBearingSensor)
+    """
+
+    dim = 2
+    angles = (1,)
+    initialises_landmarks = True
+
+    def observe(self, X_r, L=None):
+        return RangeBearingSensor.observe_range_bearing_batch(X_r, L)
+
+    def jacobians(self, X_r, L=None):
+        return RangeBearingSensor.jacobian_H_X_r_batch(X_r, L), RangeBearingSensor.jacobian_H_L_i_batch(X_r, L)
+
+    def inverse_observe(self, X_r, Y):
+        return RangeBearingSensor.inv_observe_range_bearing_batch(X_r, Y)
+
+    def inverse_jacobians(self, X_r, Y):
+        return RangeBearingSensor.jacobian_G_X_r_batch(X_r, Y), RangeBearingSensor.jacobian_G_y_i_batch(X_r, Y)
+
+
+class BearingOnlyModel(SensorModel):
+    """
+    Bearing [rad] of a landmark, in the robot's ref frame (e.g. a camera). A single bearing does not locate a landmark,
+    so landmarks must be initialised by another sensor.
+    """
+
+    dim = 1
+    angles = (0,)
+
+    def observe(self, X_r, L=None):
+        return RangeBearingSensor.observe_range_bearing_batch(X_r, L)[..., 1:]
+
+    def jacobians(self, X_r, L=None):
+        return (RangeBearingSensor.jacobian_H_X_r_batch(X_r, L)[..., 1:, :],
+                RangeBearingSensor.jacobian_H_L_i_batch(X_r, L)[..., 1:, :])
+
+
+class RangeOnlyModel(SensorModel):
+    """
+    Range [m] to a landmark (e.g. a radio beacon). A single range does not locate a landmark, so landmarks must be
+    initialised by another sensor.
+    """
+
+    dim = 1
+
+    def observe(self, X_r, L=None):
+        d = L - X_r[..., :2]
+
+        return np.sqrt(np.sum(d ** 2, axis=-1, keepdims=True))
+
+    def jacobians(self, X_r, L=None):
+        H_L = RangeBearingSensor.jacobian_H_L_i_batch(X_r, L)[..., :1, :]
+        H_R = np.concatenate([-H_L, np.zeros_like(H_L[..., :1])], axis=-1)
+
+        return H_R, H_L
+
+
+class PositionModel(SensorModel):
+    """
+    Absolute position [m] of the robot in the world ref frame (GPS-like)
+    """
+
+    dim = 2
+    observes_landmarks = False
+
+    def observe(self, X_r, L=None):
+        return X_r[..., :2]
+
+    def jacobians(self, X_r, L=None):
+        H_R = np.broadcast_to(np.eye(2, 3), X_r.shape[:-1] + (2, 3))
+
+        return H_R, None
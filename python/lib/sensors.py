@@ -1,51 +1,40 @@
 from python.lib import transforms
-
-import os
-if os.environ.get("USE_JAX", False):
-    import jax.numpy as np
-    from jax.config import config
-    # check that JAX is set to 64-bit precision
-    assert config.values["jax_enable_x64"]
-else:
-    import numpy as np
-from math import sqrt
+from python.lib.backend import np
 
 
 class RangeBearingSensor:
     @staticmethod
-    def observe_range_bearing(X_r, p_world_rect):
+    def observe_range_bearing(X_r, p_world_rect, ctx=None):
         """
         Simulate a range-bearing sensor reading of a landmark in world coordinates
 
         :param X_r: robot pose (true)
         :param p_world_rect: (x, y) rectangular coordinate position of a landmark in world ref frame
+        :param ctx: PoseContext of X_r (optional, to reuse its rotation matrix across landmarks)
         :return: range-bearing (polar coordinate) measurement of a landmark (local ref frame)
         """
 
-        t = X_r[:2]
-        alpha = X_r[2]
+        ctx = transforms.pose_context(X_r, ctx)
 
-        R = transforms.angle_to_rotation_matrix(alpha)
-        return transforms.rect_to_polar(transforms.rigid_transform_world_to_local(R, t, p_world_rect))
+        return transforms.rect_to_polar(transforms.rigid_transform_world_to_local(ctx.R, ctx.t, p_world_rect))
 
     @staticmethod
-    def inv_observe_range_bearing(X_r, p_local_polar):
+    def inv_observe_range_bearing(X_r, p_local_polar, ctx=None):
         """
         Simulate inverse range-bearing sensor reading of a landmark in world coordinates
 
         :param X_r: robot pose (true)
         :param p_local_polar: (range, bearing) polar coordinate position of a landmark in local ref frame
+        :param ctx: PoseContext of X_r (optional, to reuse its rotation matrix across landmarks)
         :return: estimated position of landmark in rectangular coordinates (world ref frame)
         """
 
-        t = X_r[:2]
-        alpha = X_r[2]
+        ctx = transforms.pose_context(X_r, ctx)
 
-        R = transforms.angle_to_rotation_matrix(alpha)
-        return transforms.rigid_transform_local_to_world(R, t, transforms.polar_to_rect(p_local_polar))
+        return transforms.rigid_transform_local_to_world(ctx.R, ctx.t, transforms.polar_to_rect(p_local_polar))
 
     @staticmethod
-    def jacobian_H_X_r(x_r, y_r, alpha_r, l_i_x, l_i_y):
+    def jacobian_H_X_r(x_r, y_r, alpha_r, l_i_x, l_i_y, ctx=None):
         """
         Compute the Jacobian of the range-bearing sensor observation function w.r.t. robot states X_r (x, y, angle)
 
@@ -54,24 +43,24 @@ class RangeBearingSensor:
         :param alpha_r:
         :param l_i_x:
         :param l_i_y:
+        :param ctx: PoseContext of the robot pose (optional, to reuse its sin and cos)
         :return:
         """
-        s_a = np.sin(alpha_r)
-        c_a = np.cos(alpha_r)
+        s_a, c_a = (np.sin(alpha_r), np.cos(alpha_r)) if ctx is None else (ctx.s, ctx.c)
 
         return np.array([
             [((-(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) * s_a - (
-                        (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) * c_a) / sqrt(
+                        (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) * c_a) / np.sqrt(
                 (-(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) ** 2 + (
                             (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) ** 2), (
                          -(-(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) * c_a - (
-                             (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) * s_a) / sqrt(
+                             (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) * s_a) / np.sqrt(
                 (-(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) ** 2 + (
                             (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) ** 2), (
                          (2 * (-l_i_x + x_r) * c_a - 2 * (l_i_y - y_r) * s_a) * (
                              -(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) / 2 + (
                                      -2 * (l_i_x - x_r) * s_a + 2 * (l_i_y - y_r) * c_a) * (
-                                     (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) / 2) / sqrt(
+                                     (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) / 2) / np.sqrt(
                 (-(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) ** 2 + (
                             (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) ** 2)],
             [-((l_i_x - x_r) * s_a - (l_i_y - y_r) * c_a) * c_a / (
@@ -96,7 +85,7 @@ class RangeBearingSensor:
                              (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) ** 2)]])
 
     @staticmethod
-    def jacobian_H_L_i(x_r, y_r, alpha_r, l_i_x, l_i_y):
+    def jacobian_H_L_i(x_r, y_r, alpha_r, l_i_x, l_i_y, ctx=None):
         """
         Compute the Jacobian of the range-bearing sensor observation function w.r.t. landmark L_i position
 
@@ -105,18 +94,18 @@ class RangeBearingSensor:
         :param alpha_r:
         :param l_i_x:
         :param l_i_y:
+        :param ctx: PoseContext of the robot pose (optional, to reuse its sin and cos)
         :return:
         """
-        s_a = np.sin(alpha_r)
-        c_a = np.cos(alpha_r)
+        s_a, c_a = (np.sin(alpha_r), np.cos(alpha_r)) if ctx is None else (ctx.s, ctx.c)
 
         return np.array([
                 [(-(-(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) * s_a + (
-                            (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) * c_a) / sqrt(
+                            (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) * c_a) / np.sqrt(
                     (-(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) ** 2 + (
                                 (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) ** 2), (
                              (-(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) * c_a + (
-                                 (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) * s_a) / sqrt(
+                                 (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) * s_a) / np.sqrt(
                     (-(l_i_x - x_r) * s_a + (l_i_y - y_r) * c_a) ** 2 + (
                                 (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) ** 2)],
                 [((l_i_x - x_r) * s_a - (l_i_y - y_r) * c_a) * c_a / (
@@ -133,7 +122,7 @@ class RangeBearingSensor:
                                  (l_i_x - x_r) * c_a + (l_i_y - y_r) * s_a) ** 2)]])
 
     @staticmethod
-    def jacobian_G_X_r(x_r, y_r, alpha_r, rho, psi):
+    def jacobian_G_X_r(x_r, y_r, alpha_r, rho, psi, ctx=None):
         """
         Compute the Jacobian of the inverse range-bearing sensor observation function w.r.t. robot position
 
@@ -142,14 +131,17 @@ class RangeBearingSensor:
         :param alpha_r: alpha (angle) robot state estimate
         :param rho: range measurement value
         :param psi: bearing measurement value
+        :param ctx: PoseContext of the robot pose (optional, to reuse its sin and cos)
         :return:
         """
+        s_a, c_a = (np.sin(alpha_r), np.cos(alpha_r)) if ctx is None else (ctx.s, ctx.c)
+        s_p, c_p = np.sin(psi), np.cos(psi)
 
-        return np.array([[1, 0, -rho * np.sin(alpha_r) * np.cos(psi) - rho * np.sin(psi) * np.cos(alpha_r)],
-                         [0, 1, -rho * np.sin(alpha_r) * np.sin(psi) + rho * np.cos(alpha_r) * np.cos(psi)]])
+        return np.array([[1, 0, -rho * s_a * c_p - rho * s_p * c_a],
+                         [0, 1, -rho * s_a * s_p + rho * c_a * c_p]])
 
     @staticmethod
-    def jacobian_G_y_i(x_r, y_r, alpha_r, rho, psi):
+    def jacobian_G_y_i(x_r, y_r, alpha_r, rho, psi, ctx=None):
         """
         ompute the Jacobian of the inverse range-bearing sensor observation function w.r.t. range-bearing measurement
 
@@ -158,13 +150,112 @@ class RangeBearingSensor:
         :param alpha_r: alpha (angle) robot state estimate
         :param rho: range measurement value
         :param psi: bearing measurement value
+        :param ctx: PoseContext of the robot pose (optional, to reuse its sin and cos)
         :return:
         """
+        s_a, c_a = (np.sin(alpha_r), np.cos(alpha_r)) if ctx is None else (ctx.s, ctx.c)
+        s_p, c_p = np.sin(psi), np.cos(psi)
 
         return np.array([
-            [-np.sin(alpha_r) * np.sin(psi) + np.cos(alpha_r) * np.cos(psi),
-             -rho * np.sin(alpha_r) * np.cos(psi) - rho * np.sin(psi) * np.cos(alpha_r)],
-            [np.sin(alpha_r) * np.cos(psi) + np.sin(psi) * np.cos(alpha_r),
-             -rho * np.sin(alpha_r) * np.sin(psi) + rho * np.cos(alpha_r) * np.cos(psi)]
+            [-s_a * s_p + c_a * c_p, -rho * s_a * c_p - rho * s_p * c_a],
+            [s_a * c_p + s_p * c_a, -rho * s_a * s_p + rho * c_a * c_p]
         ])
 
+    @staticmethod
+    def inv_observe_range_bearing_batch(X_r, Y):
+        """
+        Vectorised version of inv_observe_range_bearing. Leading dimensions of X_r and Y are broadcast together.
+
+        :param X_r: robot pose(s) (..., 3)
+        :param Y: range-bearing measurements (..., 2)
+        :return: estimated positions of landmarks in rectangular coordinates (world ref frame) (..., 2)
+        """
+
+        rho, psi = Y[..., 0], Y[..., 1]
+        angle = X_r[..., 2] + psi
+
+        return np.stack([X_r[..., 0] + rho * np.cos(angle), X_r[..., 1] + rho * np.sin(angle)], axis=-1)
+
+    @staticmethod
+    def jacobian_G_X_r_batch(X_r, Y):
+        """
+        Vectorised version of jacobian_G_X_r. Leading dimensions of X_r and Y are broadcast together.
+
+        :param X_r: robot pose estimate(s) (..., 3)
+        :param Y: range-bearing measurements (..., 2)
+        :return: Jacobians (..., 2, 3)
+        """
+
+        rho, psi = Y[..., 0], Y[..., 1]
+        angle = X_r[..., 2] + psi
+        one, zero = np.ones_like(angle), np.zeros_like(angle)
+
+        return np.stack([np.stack([one, zero, -rho * np.sin(angle)], axis=-1),
+                         np.stack([zero, one, rho * np.cos(angle)], axis=-1)], axis=-2)
+
+    @staticmethod
+    def jacobian_G_y_i_batch(X_r, Y):
+        """
+        Vectorised version of jacobian_G_y_i. Leading dimensions of X_r and Y are broadcast together.
+
+        :param X_r: robot pose estimate(s) (..., 3)
+        :param Y: range-bearing measurements (..., 2)
+        :return: Jacobians (..., 2, 2)
+        """
+
+        rho, psi = Y[..., 0], Y[..., 1]
+        angle = X_r[..., 2] + psi
+        c_a, s_a = np.cos(angle), np.sin(angle)
+
+        return np.stack([np.stack([c_a, -rho * s_a], axis=-1),
+                         np.stack([s_a, rho * c_a], axis=-1)], axis=-2)
+
+    @staticmethod
+    def observe_range_bearing_batch(X_r, L, ctx=None):
+        """
+        Vectorised version of observe_range_bearing. Leading dimensions of X_r and L are broadcast together.
+
+        :param X_r: robot pose(s) (..., 3)
+        :param L: landmark positions in world ref frame (..., 2)
+        :param ctx: PoseContext of X_r, if it is a single pose (optional, to reuse its sin and cos)
+        :return: range-bearing measurements (local ref frame) (..., 2)
+        """
+
+        d_x, d_y = L[..., 0] - X_r[..., 0], L[..., 1] - X_r[..., 1]
+        c_a, s_a = (np.cos(X_r[..., 2]), np.sin(X_r[..., 2])) if ctx is None else (ctx.c, ctx.s)
+
+        return np.stack([np.sqrt(d_x ** 2 + d_y ** 2), np.arctan2(c_a * d_y - s_a * d_x, c_a * d_x + s_a * d_y)],
+                        axis=-1)
+
+    @staticmethod
+    def jacobian_H_X_r_batch(X_r, L):
+        """
+        Vectorised version of jacobian_H_X_r. Leading dimensions of X_r and L are broadcast together.
+
+        :param X_r: robot pose estimate(s) (..., 3)
+        :param L: landmark position estimates (..., 2)
+        :return: Jacobians (..., 2, 3)
+        """
+
+        H_L = RangeBearingSensor.jacobian_H_L_i_batch(X_r, L)
+        zero = np.zeros_like(H_L[..., 0, 0])
+
+        return np.stack([np.stack([-H_L[..., 0, 0], -H_L[..., 0, 1], zero], axis=-1),
+                         np.stack([-H_L[..., 1, 0], -H_L[..., 1, 1], zero - 1.], axis=-1)], axis=-2)
+
+    @staticmethod
+    def jacobian_H_L_i_batch(X_r, L):
+        """
+        Vectorised version of jacobian_H_L_i. Leading dimensions of X_r and L are broadcast together.
+
+        :param X_r: robot pose estimate(s) (..., 3)
+        :param L: landmark position estimates (..., 2)
+        :return: Jacobians (..., 2, 2)
+        """
+
+        d_x, d_y = L[..., 0] - X_r[..., 0], L[..., 1] - X_r[..., 1]
+        q = d_x ** 2 + d_y ** 2
+        rho = np.sqrt(q)
+
+        return np.stack([np.stack([d_x / rho, d_y / rho], axis=-1),
+                         np.stack([-d_y / q, d_x / q], axis=-1)], axis=-2)
@@ -0,0 +1,268 @@
+# Asyncio service that feeds an EKFSLAM estimator from streams of control and range-bearing messages
+#
+# Messages are JSON objects, one per line:
+#   {"type": "control", "t": 0.02, "u": [d_x, d_alpha]}
+#   {"type": "measurement", "t": 0.5, "y": [[range, bearing], ...], "ids": [landmark_id, ...]}
+
+import asyncio
+import inspect
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from python.lib.sensor_models import RangeBearingModel
+
+CONTROL = "control"
+MEASUREMENT = "measurement"
+
+
+async def iter_file_lines(path, batch_size=1000):
+    """
+    Read the lines of a file without blocking the event loop (lines are read in batches in an executor)
+
+    :param path: file path
+    :param batch_size: number of lines read per executor call
+    :return: async iterator of lines
+    """
+
+    loop = asyncio.get_running_loop()
+
+    def read_batch(f):
+        lines = []
+        for line in f:
+            lines.append(line)
+            if len(lines) == batch_size:
+                break
+
+        return lines
+
+    with open(path) as f:
+        while True:
+            lines = await loop.run_in_executor(None, read_batch, f)
+            if not lines:
+                break
+            for line in lines:
+                yield line
+
+
+async def start_replay_server(path, host="127.0.0.1", port=0, speed=None):
+    """
+    Start a local TCP server that streams the messages of a file to each client that connects
+
+    :param path: file of messages (one JSON message per line)
+    :param host: host to listen on
+    :param port: port to listen on (0 picks a free port; see server.sockets[0].getsockname())
+    :param speed: if set, messages are sent in (message time / speed), otherwise as fast as the client reads them
+    :return: asyncio server
+    """
+
+    async def handle(reader, writer):
+        loop = asyncio.get_running_loop()
+        t_start = loop.time()
+        try:
+            async for line in iter_file_lines(path):
+                if speed is not None:
+                    delay = json.loads(line)["t"] / speed - (loop.time() - t_start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                writer.write(line.encode())
+                await writer.drain()      # wait for a slow client rather than buffering the whole file
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+class EstimatorService:
+    """
+    Feeds an EKFSLAM estimator from asynchronous message streams (e.g. sockets or files)
+
+    Each stream is read into a bounded queue, so a stream is paused (backpressure) rather than buffered without limit
+    when the estimator falls behind. The messages arriving within a tick of the first one are taken as a batch and
+    applied in time order: consecutive controls are coalesced into one prediction step, and the measurements between
+    them (e.g. scans of several sensors at the same time) into one joint update (EKFSLAM.joint_update). The CPU-heavy
+    estimator work runs in a single worker thread, so the event loop (and ingestion) is never blocked by it. Estimates
+    are published at most once per publish_period.
+
+    Messages older than the newest message of an earlier batch (self.time) are dropped and counted in num_dropped. For
+    controls and measurements arriving later than the batch they belong to, wrap the estimator in a FixedLagBuffer
+    instead.
+    """
+
+    def __init__(self, estimator, tick=0.02, max_queue_size=1000, publish_period=0.1, publish=None):
+        """
+        :param estimator: EKFSLAM estimator
+        :param tick: time over which messages are gathered into a batch [s]
+        :param max_queue_size: maximum number of queued messages
+        :param publish_period: minimum time between published estimates [s]
+        :param publish: function (or coroutine function) publish(estimate) called with the dict returned by estimate()
+        """
+
+        self.estimator = estimator
+        self.tick = tick
+        self.publish_period = publish_period
+        self.publish = publish
+
+        self.max_queue_size = max_queue_size
+        self.queue = None       # created in run(), inside the event loop
+        self.time = None        # time of the newest message applied to the estimator
+        self.num_messages = 0   # number of messages applied
+        self.num_dropped = 0    # number of messages dropped for being older than self.time
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._last_publish = None
+
+    def close(self):
+        """
+        Shut down the worker thread (waits for the batch being processed, if any)
+        """
+
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def ingest(self, lines):
+        """
+        Parse messages from a stream and queue them (waits while the queue is full)
+
+        :param lines: async iterable of lines, e.g. an asyncio.StreamReader or iter_file_lines(path)
+        :return:
+        """
+
+        async for line in lines:
+            line = line.strip()
+            if line:
+                await self.queue.put(json.loads(line))
+
+    async def run(self, *streams):
+        """
+        Ingest the given streams and update the estimator until all streams have ended
+
+        :param streams: async iterables of lines
+        :return:
+        """
+
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        ingestion = asyncio.gather(*[self.ingest(stream) for stream in streams])
+
+        try:
+            while not (ingestion.done() and self.queue.empty()):
+                try:
+                    batch = [await asyncio.wait_for(self.queue.get(), self.tick)]
+                except asyncio.TimeoutError:
+                    continue
+
+                # gather the messages of the rest of the tick (unless all streams have ended)
+                await asyncio.wait({ingestion}, timeout=self.tick)
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+
+                await loop.run_in_executor(self._executor, self._process, batch)
+                await self._publish(loop.time())
+
+            await ingestion     # raise any ingestion error
+            await self._publish(None)
+        finally:
+            ingestion.cancel()
+
+    def _process(self, batch):
+        """
+        Apply a batch of messages to the estimator (runs in the worker thread)
+
+        :param batch: list of messages
+        :return:
+        """
+
+        for message in batch:
+            if message["type"] not in (CONTROL, MEASUREMENT):
+                raise ValueError("Unknown message type: {}".format(message["type"]))
+
+        if self.time is not None:
+            num_messages = len(batch)
+            batch = [message for message in batch if message["t"] >= self.time]
+            self.num_dropped += num_messages - len(batch)
+            if not batch:
+                return
+
+        batch.sort(key=lambda message: (message["t"], message["type"] != CONTROL))
+
+        controls = []
+        scans = []
+        for message in batch:
+            if message["type"] == CONTROL:
+                if scans:
+                    self._update(scans)
+                    scans = []
+                controls.append(message["u"])
+            else:
+                if controls:
+                    self.estimator.state_and_state_cov_propagation_many(controls)
+                    controls = []
+                scans.append(message)
+
+        if controls:
+            self.estimator.state_and_state_cov_propagation_many(controls)
+        if scans:
+            self._update(scans)
+
+        self.time = batch[-1]["t"] if self.time is None else max(self.time, batch[-1]["t"])
+        self.num_messages += len(batch)
+
+    def _update(self, scans):
+        """
+        Update the estimator with range-bearing measurement messages, in one joint update
+
+        :param scans: list of measurement messages
+        :return:
+        """
+
+        model = RangeBearingModel(self.estimator.R)
+        self.estimator.joint_update([(model, np.asarray(scan["y"], dtype=np.float64).reshape(-1, 2), scan["ids"])
+                                     for scan in scans])
+
+    def estimate(self):
+        """
+        Current estimate of the robot pose and landmark positions
+
+        :return: dict with time t, robot pose, robot pose covariance and landmark positions by ID
+        """
+
+        X = self.estimator.X
+
+        return {"t": self.time,
+                "pose": X[:3].tolist(),
+                "pose_covariance": self.estimator.P[:3, :3].tolist(),
+                "landmarks": {landmark_id: X[3 + 2 * i: 5 + 2 * i].tolist()
+                              for i, landmark_id in enumerate(self.estimator.landmark_lookup)}}
+
+    async def _publish(self, now):
+        """
+        Publish the current estimate, unless one was published less than publish_period ago
+
+        :param now: current time of the event loop, or None to publish regardless
+        :return:
+        """
+
+        if self.publish is None:
+            return
+
+        if now is not None:
+            if self._last_publish is not None and now - self._last_publish < self.publish_period:
+                return
+            self._last_publish = now
+
+        result = self.publish(self.estimate())
+        if inspect.isawaitable(result):
+            await result
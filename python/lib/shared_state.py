@@ -0,0 +1,289 @@
+# Publication of an estimator's state and covariance to other processes through shared memory, without copying or
+# pickling on the reader side
+#
+# Segment layout (all fields 64 byte aligned):
+#   header: capacity, num_slots, latest slot (-1 before the first publish), number of publishes (int64)
+#   num_slots slots, each: seq, n, step, version, num_landmarks (int64), then X (capacity,), P (capacity * capacity,)
+#   stored as a contiguous n x n matrix, and the landmark IDs ((capacity - 3) / 2,) (int64)
+#
+# The publisher writes each state into the slot after the latest one (a ring of num_slots buffers, 2 by default) and
+# then marks it as the latest. Each slot is guarded by a sequence lock: seq is odd while the slot is written, and is
+# increased again when it is complete. The publisher never waits for readers. A reader takes views of the latest slot,
+# and checks afterwards that seq has not changed (StateView.valid()) to know that what it read was consistent. Views
+# stay valid until the publisher has published num_slots - 1 more states, so a reader slower than that should copy
+# (StateSubscriber.read(copy=True)), which retries until it gets a consistent copy.
+#
+# Needs Python 3.8 (multiprocessing.shared_memory).
+
+from multiprocessing import shared_memory
+
+import numpy as onp
+
+_ALIGNMENT = 64
+_HEADER_FIELDS = 4      # capacity, num_slots, latest, num_publishes
+_SLOT_FIELDS = 5        # seq, n, step, version, num_landmarks
+
+
+def _aligned(num_bytes):
+    return -(-num_bytes // _ALIGNMENT) * _ALIGNMENT
+
+
+def _slot_layout(capacity):
+    """
+    Byte offsets of the fields of a slot, relative to its start, and the slot size
+
+    :param capacity: largest number of states
+    :return: dict of offsets (fields, X, P, ids) and the slot size in bytes
+    """
+
+    offsets = {"fields": 0}
+    offsets["X"] = _aligned(8 * _SLOT_FIELDS)
+    offsets["P"] = offsets["X"] + _aligned(8 * capacity)
+    offsets["ids"] = offsets["P"] + _aligned(8 * capacity * capacity)
+
+    return offsets, offsets["ids"] + _aligned(8 * max((capacity - 3) // 2, 1))
+
+
+def _track(shm, tracked):
+    """
+    Register or unregister a segment with this process' resource tracker, which removes registered segments when the
+    process exits. Consumers must not be registered (it would remove the publisher's segment when they exit), and
+    consumer processes started with multiprocessing share the publisher's tracker, so the publisher registers its
+    segment again before removing it.
+    """
+
+    try:
+        from multiprocessing import resource_tracker
+        (resource_tracker.register if tracked else resource_tracker.unregister)(shm._name, "shared_memory")
+    except (ImportError, AttributeError):
+        pass
+
+
+def _map_slots(buf, capacity, num_slots):
+    """
+    NumPy arrays over the header and slots of a segment
+
+    :return: header (int64 array) and list of slots, each a dict of arrays (fields, X, P, ids)
+    """
+
+    header = onp.ndarray((_HEADER_FIELDS,), dtype=onp.int64, buffer=buf)
+    offsets, slot_size = _slot_layout(capacity)
+    sizes = {"fields": (_SLOT_FIELDS, onp.int64), "X": (capacity, onp.float64),
+             "P": (capacity * capacity, onp.float64), "ids": (max((capacity - 3) // 2, 1), onp.int64)}
+
+    slots = []
+    for k in range(num_slots):
+        start = _aligned(8 * _HEADER_FIELDS) + k * slot_size
+        slots.append({name: onp.ndarray((size,), dtype=dtype, buffer=buf, offset=start + offsets[name])
+                      for name, (size, dtype) in sizes.items()})
+
+    return header, slots
+
+
+class StatePublisher:
+    """
+    Publishes the state vector, state covariance matrix and landmark IDs of an estimator to a shared memory segment
+
+    Call publish(estimator) whenever consumers should see a new state (e.g. from a Scheduler on_update callback).
+    Consumers, in this or other processes, attach to the segment by name with StateSubscriber. Publishing copies X and
+    P once into shared memory and never waits for the consumers.
+    """
+
+    def __init__(self, capacity, name=None, num_slots=2):
+        """
+        :param capacity: largest number of states that can be published (3 + 2 * number of landmarks)
+        :param name: name of the shared memory segment (if None, a unique name is chosen; see self.name)
+        :param num_slots: number of buffers. A reader's views stay valid for num_slots - 1 further publishes.
+        """
+
+        if capacity < 3 or num_slots < 2:
+            raise ValueError("capacity must be at least 3 and num_slots at least 2")
+
+        self.capacity = capacity
+        self.num_slots = num_slots
+
+        _, slot_size = _slot_layout(capacity)
+        self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                               size=_aligned(8 * _HEADER_FIELDS) + num_slots * slot_size)
+        self._header, self._slots = _map_slots(self._shm.buf, capacity, num_slots)
+        self._header[:] = [capacity, num_slots, -1, 0]
+        for slot in self._slots:
+            slot["fields"][:] = 0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def num_published(self):
+        return int(self._header[3])
+
+    def publish(self, estimator, step=None):
+        """
+        Publish the current state of an estimator
+
+        :param estimator: estimator with X, P and landmark_lookup (integer landmark IDs), e.g. EKFSLAM
+        :param step: step number (defaults to estimator.num_steps)
+        :return: version of the published state (1 for the first publish, then increasing by 1)
+        """
+
+        # everything that can fail is checked before the slot is marked as being written
+        X = onp.asarray(estimator.X)
+        n = X.shape[0]
+        if n > self.capacity:
+            raise ValueError("State dimension {} exceeds the capacity of the publisher ({})".format(n, self.capacity))
+
+        P = onp.asarray(estimator.P)
+        if P.shape != (n, n):
+            raise ValueError("State covariance matrix must be {} x {}".format(n, n))
+
+        landmark_ids = onp.asarray(estimator.landmark_lookup)
+        if landmark_ids.size and not onp.issubdtype(landmark_ids.dtype, onp.integer):
+            raise TypeError("Only integer landmark IDs can be published")
+        num_landmarks = landmark_ids.size
+
+        header = self._header
+        slot = self._slots[(int(header[2]) + 1) % self.num_slots]
+        fields = slot["fields"]
+        version = int(header[3]) + 1
+
+        fields[0] += 1      # odd: slot being written
+        try:
+            fields[1:] = [n, estimator.num_steps if step is None else step, version, num_landmarks]
+            slot["X"][:n] = X
+            slot["P"][:n * n].reshape(n, n)[...] = P
+            slot["ids"][:num_landmarks] = landmark_ids
+        finally:
+            # even again, also if writing failed: the slot is then not made the latest, and the changed seq invalidates
+            # any older views of it
+            fields[0] += 1
+
+        header[2] = (int(header[2]) + 1) % self.num_slots
+        header[3] = version
+
+        return version
+
+    def close(self):
+        """
+        Close and remove the segment (consumers that are still attached keep their mapping)
+        """
+
+        if self._shm is None:
+            return
+
+        self._header = self._slots = None
+        self._shm.close()
+        _track(self._shm, True)
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StateView:
+    """
+    Published state, as read-only views into shared memory: X (n,), P (n, n), landmark_ids (num_landmarks,), step and
+    version. The views are only known to be consistent if valid() is still true after they were used.
+    """
+
+    __slots__ = ("X", "P", "landmark_ids", "step", "version", "_fields", "_seq")
+
+    def __init__(self, X, P, landmark_ids, step, version, fields=None, seq=None):
+        self.X = X
+        self.P = P
+        self.landmark_ids = landmark_ids
+        self.step = step
+        self.version = version
+        self._fields = fields
+        self._seq = seq
+
+    def valid(self):
+        """
+        Whether the publisher has not started overwriting this state (always true for copies)
+        """
+
+        return self._fields is None or int(self._fields[0]) == self._seq
+
+
+class StateSubscriber:
+    """
+    Reads the states published by a StatePublisher, from any process
+    """
+
+    def __init__(self, name):
+        """
+        :param name: name of the publisher's shared memory segment (StatePublisher.name)
+        """
+
+        self._shm = shared_memory.SharedMemory(name=name)
+        _track(self._shm, False)
+
+        capacity, num_slots = (int(value) for value in onp.ndarray((2,), dtype=onp.int64, buffer=self._shm.buf))
+        self._header, self._slots = _map_slots(self._shm.buf, capacity, num_slots)
+
+    @property
+    def version(self):
+        """
+        Version of the latest published state (0 before the first publish)
+        """
+
+        return int(self._header[3])
+
+    def read(self, copy=False, max_retries=1000):
+        """
+        Latest published state
+
+        :param copy: return a copy (always consistent) instead of views into shared memory (zero-copy, valid until
+        overwritten)
+        :param max_retries: number of attempts before giving up, if the publisher keeps overwriting the slot being read
+        :return: StateView, or None before the first publish
+        """
+
+        for _ in range(max_retries):
+            latest = int(self._header[2])
+            if latest < 0:
+                return None
+
+            slot = self._slots[latest]
+            fields = slot["fields"]
+            seq = int(fields[0])
+            if seq % 2 == 1:
+                continue
+
+            n, step, version, num_landmarks = (int(value) for value in fields[1:])
+            X, P, ids = slot["X"][:n], slot["P"][:n * n].reshape(n, n), slot["ids"][:num_landmarks]
+            if copy:
+                X, P, ids = X.copy(), P.copy(), ids.copy()
+            else:
+                X, P, ids = (array.view() for array in (X, P, ids))
+                for array in (X, P, ids):
+                    array.flags.writeable = False
+
+            if int(fields[0]) != seq:
+                continue
+
+            return StateView(X, P, ids, step, version, *((None, None) if copy else (fields, seq)))
+
+        raise RuntimeError("Could not read a consistent state in {} attempts".format(max_retries))
+
+    def close(self):
+        """
+        Detach from the segment (views returned by read() must not be used afterwards)
+        """
+
+        if self._shm is None:
+            return
+
+        self._header = self._slots = None
+        self._shm.close()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
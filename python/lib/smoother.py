@@ -0,0 +1,177 @@
+# Rauch-Tung-Striebel smoothing of the robot trajectory of a logged EKFSLAM (or UKFSLAM) run
+
+import numpy as np
+
+
+class TrajectoryLog:
+    """
+    Log of the robot pose estimates of each prediction step of an estimator, for smoothing with rts_smooth
+
+    Only the robot block is stored per step: the filtered pose and covariance before the step, the Jacobian F_x of
+    the step and the predicted pose and covariance after it (O(1) per step, rather than a full P). Arrays grow by
+    doubling, like the estimator's state buffers.
+
+    Usage: estimator.trajectory_log = TrajectoryLog(), run the filter, then log.smooth(estimator).
+    """
+
+    def __init__(self, capacity=1024):
+        """
+        :param capacity: number of steps to preallocate space for
+        """
+
+        capacity = max(capacity, 1)
+        self.num_steps = 0
+        self._steps = np.zeros(capacity, dtype=np.int64)
+        self._X_f = np.zeros((capacity, 3))
+        self._P_f = np.zeros((capacity, 3, 3))
+        self._F = np.zeros((capacity, 3, 3))
+        self._X_p = np.zeros((capacity, 3))
+        self._P_p = np.zeros((capacity, 3, 3))
+
+    def __len__(self):
+        return self.num_steps
+
+    def record(self, step, X_f, P_f, F_x, X_p, P_p):
+        """
+        Record a prediction step
+
+        :param step: step number after the prediction (estimator.num_steps)
+        :param X_f: filtered robot pose before the prediction
+        :param P_f: filtered robot pose covariance before the prediction
+        :param F_x: Jacobian of the state transition function w.r.t. robot pose (or its statistical linearisation)
+        :param X_p: predicted robot pose
+        :param P_p: predicted robot pose covariance
+        :return:
+        """
+
+        i = self.num_steps
+        if i == self._steps.shape[0]:
+            for name in ("_steps", "_X_f", "_P_f", "_F", "_X_p", "_P_p"):
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+
+        self._steps[i] = step
+        self._X_f[i] = X_f
+        self._P_f[i] = P_f
+        self._F[i] = F_x
+        self._X_p[i] = X_p
+        self._P_p[i] = P_p
+        self.num_steps += 1
+
+    @property
+    def steps(self):
+        """
+        Step numbers of the logged predictions (views of the log)
+        """
+
+        return self._steps[:self.num_steps]
+
+    def arrays(self):
+        """
+        Logged quantities (views of the log): X_f (T, 3), P_f (T, 3, 3), F (T, 3, 3), X_p (T, 3), P_p (T, 3, 3)
+        """
+
+        T = self.num_steps
+
+        return self._X_f[:T], self._P_f[:T], self._F[:T], self._X_p[:T], self._P_p[:T]
+
+    def smooth(self, estimator, chunk_size=4096):
+        """
+        Smooth the logged trajectory, ending at the estimator's current robot pose estimate
+
+        The landmark estimates need no smoothing pass: landmarks are static, so the final filtered estimates
+        (estimator.X[3:]) already use all measurements.
+
+        :param estimator: estimator that produced the log
+        :param chunk_size: see rts_smooth
+        :return: see rts_smooth
+        """
+
+        return rts_smooth(self, estimator.X[:3], estimator.robot_covariance(), chunk_size)
+
+
+def _compose_suffixes(C, d, D):
+    """
+    Compose the affine maps f_t(x, P) = (C_t x + d_t, C_t P C_t^T + D_t) into g_t = f_t o f_t+1 o ... o f_L-1, for all t
+    in log2(L) vectorised passes (a parallel suffix scan)
+
+    :param C: (L, 3, 3)
+    :param d: (L, 3)
+    :param D: (L, 3, 3)
+    :return: C, d and D of the composed maps
+    """
+
+    C, d, D = C.copy(), d.copy(), D.copy()
+    L = C.shape[0]
+    shift = 1
+    while shift < L:
+        C_t, C_next = C[:L - shift], C[shift:]
+        C_new = np.matmul(C_t, C_next)
+        d_new = np.einsum("tij,tj->ti", C_t, d[shift:]) + d[:L - shift]
+        D_new = np.matmul(np.matmul(C_t, D[shift:]), C_t.swapaxes(-1, -2)) + D[:L - shift]
+        C[:L - shift], d[:L - shift], D[:L - shift] = C_new, d_new, D_new
+        shift *= 2
+
+    return C, d, D
+
+
+def rts_smooth(log, X_r_final, P_rr_final, chunk_size=4096):
+    """
+    Rauch-Tung-Striebel smoother for the robot trajectory
+
+    For each logged step t (filtered X_f[t], P_f[t]; predicted X_p[t+1], P_p[t+1]), with gain
+    C_t = P_f[t] F_t^T P_p[t+1]^-1:
+
+        X_s[t] = X_f[t] + C_t (X_s[t+1] - X_p[t+1])
+        P_s[t] = P_f[t] + C_t (P_s[t+1] - P_p[t+1]) C_t^T
+
+    The recursion runs backwards over chunks of chunk_size steps. Within a chunk, the gains are computed in one batched
+    operation, and the recursion (an affine map per step) is evaluated for all steps at once by composing the maps with
+    a parallel suffix scan. Headings are unwrapped first, so that differences do not jump by 2 pi.
+
+    Only the robot block is used. Landmarks are handled through the robot marginal: future measurements reach past
+    poses through the motion model, but not through the robot-landmark cross covariances. This is an approximation
+    that needs no per-step P. It removes the step-to-step error of the trajectory, but not the error it shares with the
+    map (e.g. an offset of the map as a whole).
+
+    :param log: TrajectoryLog of T prediction steps
+    :param X_r_final: filtered robot pose after the last step
+    :param P_rr_final: filtered robot pose covariance after the last step
+    :param chunk_size: number of steps processed per vectorised pass (bounds the temporary memory)
+    :return: smoothed robot poses (T + 1, 3) and covariances (T + 1, 3, 3), at the start of each logged step and at
+    the end of the last
+    """
+
+    X_f, P_f, F, X_p, P_p = [array.copy() for array in log.arrays()]
+    T = X_f.shape[0]
+
+    # unwrap headings along the sequence X_f[0], X_p[1], X_f[1], X_p[2], ..., X_final
+    headings = np.empty(2 * T + 1)
+    headings[0:2 * T:2] = X_f[:, 2]
+    headings[1:2 * T:2] = X_p[:, 2]
+    headings[2 * T] = X_r_final[2]
+    headings = np.unwrap(headings)
+    X_f[:, 2] = headings[0:2 * T:2]
+    X_p[:, 2] = headings[1:2 * T:2]
+
+    X_s = np.empty((T + 1, 3))
+    P_s = np.empty((T + 1, 3, 3))
+    X_s[T] = X_r_final
+    X_s[T, 2] = headings[2 * T]
+    P_s[T] = P_rr_final
+
+    for end in range(T, 0, -chunk_size):
+        chunk = slice(max(end - chunk_size, 0), end)
+
+        # C = P_f F^T P_p^-1 (pseudo-inverse, as P_p is singular while the pose is still exactly known)
+        C = np.matmul(np.matmul(P_f[chunk], F[chunk].swapaxes(-1, -2)), np.linalg.pinv(P_p[chunk], hermitian=True))
+        d = X_f[chunk] - np.einsum("tij,tj->ti", C, X_p[chunk])
+        D = P_f[chunk] - np.matmul(np.matmul(C, P_p[chunk]), C.swapaxes(-1, -2))
+
+        C, d, D = _compose_suffixes(C, d, D)
+        X_s[chunk] = np.einsum("tij,j->ti", C, X_s[end]) + d
+        P_s[chunk] = np.matmul(np.matmul(C, P_s[end]), C.swapaxes(-1, -2)) + D
+
+    P_s = (P_s + P_s.swapaxes(-1, -2)) / 2
+
+    return X_s, P_s
@@ -0,0 +1,267 @@
+# Compact binary snapshots of EKFSLAM estimator state, for resuming or forking long runs
+#
+# File layout: magic, header length (uint32), JSON header, padding to a 64 byte boundary, then the X and P sections.
+# P is stored either packed (upper triangle, row by row) or unpacked (full matrix). Sections can be zlib compressed.
+# Uncompressed sections are aligned, so they can be memory-mapped.
+
+import json
+import numbers
+import struct
+import zlib
+
+import numpy as np
+
+from python.lib.ekf import EKFSLAM
+
+MAGIC = b"EKFSLAM\x00"
+ALIGNMENT = 64
+
+
+def _packed_row_start(i, n):
+    """
+    Offset of row i of the packed upper triangle of an n x n matrix
+    """
+
+    return i * n - i * (i - 1) // 2
+
+
+def _encode_landmark_id(landmark_id):
+    """
+    JSON value of a landmark ID: integers (including NumPy integers) and strings as they are, tuples of IDs as
+    {"tuple": [...]}
+
+    :param landmark_id: landmark ID
+    :return: JSON-serialisable value
+    """
+
+    if isinstance(landmark_id, str):
+        return landmark_id
+    if isinstance(landmark_id, numbers.Integral) and not isinstance(landmark_id, (bool, np.bool_)):
+        return int(landmark_id)
+    if isinstance(landmark_id, tuple):
+        return {"tuple": [_encode_landmark_id(value) for value in landmark_id]}
+
+    raise TypeError("Cannot save landmark ID {!r} of type {}: IDs must be integers, strings or tuples of them"
+                    .format(landmark_id, type(landmark_id).__name__))
+
+
+def _decode_landmark_id(value):
+    """
+    Landmark ID from its JSON value (see _encode_landmark_id). Lists, which older snapshots saved for tuples, are
+    restored as tuples.
+    """
+
+    if isinstance(value, dict):
+        return tuple(_decode_landmark_id(v) for v in value["tuple"])
+    if isinstance(value, list):
+        return tuple(_decode_landmark_id(v) for v in value)
+
+    return value
+
+
+def save_snapshot(estimator, path, dtype=np.float64, packed=True, compress=False):
+    """
+    Save the state of an EKFSLAM estimator (X, P, Q, R, landmark lookup table and landmark statistics)
+
+    Landmark IDs must be integers (Python or NumPy, restored as Python integers), strings or tuples of these.
+
+    :param estimator: EKFSLAM estimator
+    :param path: file path
+    :param dtype: data type used to store P (e.g. np.float32 to halve the size). X is always stored as float64.
+    :param packed: store only the upper triangle of P (about half the size). Unpacked, uncompressed float64 snapshots
+    can be restored lazily (see Snapshot.to_estimator).
+    :param compress: zlib compress X and P
+    :return:
+    """
+
+    lookup = estimator.landmark_lookup
+    landmark_ids = [_encode_landmark_id(landmark_id) for landmark_id in lookup]
+
+    X = np.ascontiguousarray(estimator.X, dtype=np.float64)
+    P = estimator.P
+    n = X.shape[0]
+    dtype = np.dtype(dtype)
+
+    if packed:
+        P_data = np.concatenate([P[i, i:] for i in range(n)]).astype(dtype)
+    else:
+        P_data = np.ascontiguousarray(P, dtype=dtype)
+
+    sections = [X.tobytes(), P_data.tobytes()]
+    if compress:
+        sections = [zlib.compress(section) for section in sections]
+
+    header = {"n": n,
+              "dtype": dtype.str,
+              "packed": packed,
+              "compressed": compress,
+              "section_sizes": [len(section) for section in sections],
+              "Q": np.asarray(estimator.Q).tolist(),
+              "R": np.asarray(estimator.R).tolist(),
+              "estimator_dtype": estimator.dtype.str,
+              "P_rr": estimator.robot_covariance().tolist(),
+              "landmark_lookup": landmark_ids,
+              "num_steps": estimator.num_steps,
+              "landmark_last_observed": [estimator.landmark_last_observed.get(l) for l in lookup],
+              "landmark_num_observations": [estimator.landmark_num_observations.get(l) for l in lookup]}
+    header = json.dumps(header).encode()
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for section in sections:
+            f.write(b"\x00" * (-f.tell() % ALIGNMENT))
+            f.write(section)
+
+
+def load_snapshot(path, mmap=True):
+    """
+    Load a snapshot saved with save_snapshot
+
+    :param path: file path
+    :param mmap: memory-map uncompressed sections, so that P is only read from disk when (and where) it is accessed
+    :return: Snapshot
+    """
+
+    return Snapshot(path, mmap)
+
+
+class Snapshot:
+    """
+    Estimator state loaded from a snapshot file
+
+    For uncompressed snapshots loaded with mmap=True, P_data is a read-only memory map of the stored covariance
+    (packed upper triangle or full matrix), so blocks can be read with covariance_block without reading all of P.
+    """
+
+    def __init__(self, path, mmap=True):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Not an EKF-SLAM snapshot: {}".format(path))
+            header_size, = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_size).decode())
+
+            offsets = []
+            offset = f.tell()
+            for size in header["section_sizes"]:
+                offset += -offset % ALIGNMENT
+                offsets.append(offset)
+                offset += size
+
+            n = header["n"]
+            dtype = np.dtype(header["dtype"])
+            P_shape = (n * (n + 1) // 2,) if header["packed"] else (n, n)
+
+            if header["compressed"]:
+                data = []
+                for offset, size in zip(offsets, header["section_sizes"]):
+                    f.seek(offset)
+                    data.append(zlib.decompress(f.read(size)))
+                self.X = np.frombuffer(data[0], dtype=np.float64).copy()
+                self.P_data = np.frombuffer(data[1], dtype=dtype).reshape(P_shape)
+            elif mmap:
+                self.X = np.array(np.memmap(path, dtype=np.float64, mode="r", offset=offsets[0], shape=(n,)))
+                self.P_data = np.memmap(path, dtype=dtype, mode="r", offset=offsets[1], shape=P_shape)
+            else:
+                f.seek(offsets[0])
+                self.X = np.fromfile(f, dtype=np.float64, count=n)
+                f.seek(offsets[1])
+                self.P_data = np.fromfile(f, dtype=dtype, count=int(np.prod(P_shape))).reshape(P_shape)
+
+        self.path = path
+        self.n = n
+        self.packed = header["packed"]
+        self.compressed = header["compressed"]
+        self.P_offset = offsets[1]
+        self.Q = np.array(header["Q"])
+        self.R = np.array(header["R"])
+        self.estimator_dtype = np.dtype(header.get("estimator_dtype", "<f8"))
+        self.P_rr = np.array(header["P_rr"]) if "P_rr" in header else None
+        self.landmark_lookup = [_decode_landmark_id(value) for value in header["landmark_lookup"]]
+        self.num_steps = header["num_steps"]
+        self.landmark_last_observed = dict(zip(self.landmark_lookup, header["landmark_last_observed"]))
+        self.landmark_num_observations = dict(zip(self.landmark_lookup, header["landmark_num_observations"]))
+
+    def covariance_block(self, rows, cols):
+        """
+        Read a block of P
+
+        :param rows: slice of rows
+        :param cols: slice of columns
+        :return: block of P (float64)
+        """
+
+        if not self.packed:
+            return np.array(self.P_data[rows, cols], dtype=np.float64)
+
+        rows = np.arange(self.n)[rows]
+        cols = np.arange(self.n)[cols]
+
+        # P[i, j] is stored in row min(i, j) of the packed upper triangle
+        i, j = np.meshgrid(rows, cols, indexing="ij")
+        a, b = np.minimum(i, j), np.maximum(i, j)
+
+        return np.asarray(self.P_data[_packed_row_start(a, self.n) + b - a], dtype=np.float64)
+
+    def covariance(self, chunk_rows=1024):
+        """
+        Read the full covariance matrix P, unpacking it a chunk of rows at a time
+
+        :param chunk_rows: number of stored rows read from disk at a time
+        :return: P (n x n, float64)
+        """
+
+        n = self.n
+        P = np.empty((n, n))
+        self._unpack_into(P, chunk_rows)
+
+        return P
+
+    def _unpack_into(self, P, chunk_rows=1024):
+        n = self.n
+        if not self.packed:
+            for start in range(0, n, chunk_rows):
+                P[start:start + chunk_rows] = self.P_data[start:start + chunk_rows]
+            return
+
+        for start in range(0, n, chunk_rows):
+            stop = min(start + chunk_rows, n)
+            chunk = np.asarray(self.P_data[_packed_row_start(start, n):_packed_row_start(stop, n)], dtype=np.float64)
+            offset = 0
+            for i in range(start, stop):
+                P[i, i:] = chunk[offset:offset + n - i]
+                P[i:, i] = P[i, i:]
+                offset += n - i
+
+    def to_estimator(self, lazy=True):
+        """
+        Create an EKFSLAM estimator with the state from this snapshot
+
+        The estimator has the dtype of the one that was saved (e.g. float32 for mixed precision), with its float64 robot
+        pose covariance. If lazy, and the snapshot is unpacked, uncompressed and stored in that dtype, the estimator's
+        covariance buffer is a copy-on-write memory map of the file: pages of P are only read when accessed, and pages
+        that the estimator modifies are copied privately (the file is never changed). This allows many estimators to be
+        forked from one large snapshot quickly, sharing the unmodified parts of P.
+
+        :param lazy: memory-map P (copy-on-write) where possible
+        :return: EKFSLAM estimator
+        """
+
+        est = EKFSLAM(dtype=self.estimator_dtype)
+
+        if lazy and not (self.packed or self.compressed) and self.P_data.dtype == est.dtype:
+            P_buf = np.memmap(self.path, dtype=est.dtype, mode="c", offset=self.P_offset, shape=(self.n, self.n))
+        else:
+            P_buf = np.empty((self.n, self.n), dtype=est.dtype)
+            self._unpack_into(P_buf)
+        est._adopt_buffers(self.X, P_buf, self.P_rr)
+
+        est.Q = self.Q.copy()
+        est.R = self.R.copy()
+        est.landmark_lookup = list(self.landmark_lookup)
+        est.num_steps = self.num_steps
+        est.landmark_last_observed = dict(self.landmark_last_observed)
+        est.landmark_num_observations = dict(self.landmark_num_observations)
+
+        return est
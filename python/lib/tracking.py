@@ -0,0 +1,154 @@
+# Steady-state constant velocity Kalman filter for drone position / velocity tracks (e.g. from sim.dat)
+#
+# The model matches the drone random walk (see drone_sim.py): per axis, with state [p; v],
+#   v[t + 1] = v[t] + w[t],    p[t + 1] = p[t] + dt v[t + 1],    w ~ N(0, process_std^2)
+# and noisy measurements of the position (and optionally the velocity). The axes are independent and identical, so
+# the filter is solved for one axis and applied to all three.
+
+from functools import lru_cache
+
+import numpy as np
+
+from python.lib.drone_sim import MAX_VEL, SIMULATION_TIMESTEP
+
+
+def constant_velocity_model(time_step, process_std):
+    """
+    Transition matrix and process noise covariance of one axis
+
+    :param time_step: time step [s]
+    :param process_std: standard deviation of the velocity change per time step [m/s]
+    :return: F (2x2), Q (2x2)
+    """
+
+    F = np.array([[1., time_step], [0., 1.]])
+    G = np.array([time_step, 1.])       # effect of the velocity change on [p; v]
+
+    return F, process_std ** 2 * np.outer(G, G)
+
+
+def measurement_model(position_std, velocity_std=None):
+    """
+    Measurement matrix and noise covariance of one axis
+
+    :param position_std: standard deviation of position measurements [m]
+    :param velocity_std: standard deviation of velocity measurements [m/s], or None if velocity is not measured
+    :return: H (m x 2), R (m x m)
+    """
+
+    if velocity_std is None:
+        return np.array([[1., 0.]]), np.array([[position_std ** 2]])
+
+    return np.eye(2), np.diag([position_std ** 2, velocity_std ** 2])
+
+
+@lru_cache(maxsize=128)
+def steady_state_gain(time_step, process_std, position_std, velocity_std=None, tol=1e-14, max_iterations=100000):
+    """
+    Steady-state Kalman gain of one axis, from the solution of the discrete algebraic Riccati equation
+
+        P = F P F^T + Q - F P H^T (H P H^T + R)^-1 H P F^T
+
+    (solved by fixed-point iteration). Results are cached per noise configuration, and returned read-only.
+
+    :param time_step: time step [s]
+    :param process_std: standard deviation of the velocity change per time step [m/s]
+    :param position_std: standard deviation of position measurements [m]
+    :param velocity_std: standard deviation of velocity measurements [m/s], or None if velocity is not measured
+    :param tol: convergence tolerance (on the change of P, relative to P)
+    :param max_iterations: maximum number of iterations
+    :return: gain K (2 x m) and steady-state predicted covariance P (2x2)
+    """
+
+    F, Q = constant_velocity_model(time_step, process_std)
+    H, R = measurement_model(position_std, velocity_std)
+
+    P = Q.copy()
+    for _ in range(max_iterations):
+        PH_T = np.dot(P, H.T)
+        K = np.linalg.solve(np.dot(H, PH_T) + R, PH_T.T).T
+        P_new = np.dot(np.dot(F, P - np.dot(K, PH_T.T)), F.T) + Q
+        P_new = (P_new + P_new.T) / 2
+        converged = np.abs(P_new - P).max() <= tol * np.abs(P_new).max()
+        P = P_new
+        if converged:
+            break
+    else:
+        raise RuntimeError("Riccati iteration did not converge")
+
+    PH_T = np.dot(P, H.T)
+    K = np.linalg.solve(np.dot(H, PH_T) + R, PH_T.T).T
+    K.setflags(write=False)
+    P.setflags(write=False)
+
+    return K, P
+
+
+def _linear_recursion(A, Y):
+    """
+    Solve X[t] = A X[t - 1] + Y[t] (with X[-1] = 0) along axis -3 of Y, for all t at once
+
+    This is a parallel prefix scan: after round j, each X[t] holds the sum over the last 2^(j+1) terms
+    A^(t-s) Y[s], so only log2(T) vectorised passes over the track are needed, rather than a step-by-step loop.
+
+    :param A: (d x d)
+    :param Y: (..., T, a, d)
+    :return: X (..., T, a, d)
+    """
+
+    X = Y.copy()
+    T = X.shape[-3]
+    A_power = A
+    shift = 1
+    while shift < T:
+        X[..., shift:, :, :] += np.einsum("ij,...j->...i", A_power, X[..., :-shift, :, :])
+        A_power = np.dot(A_power, A_power)
+        shift *= 2
+
+    return X
+
+
+def filter_tracks(Z, time_step=SIMULATION_TIMESTEP, process_std=0.2 * MAX_VEL, position_std=0.1, velocity_std=None,
+                  x_0=None):
+    """
+    Filter position (and velocity) measurement tracks with the steady-state constant velocity Kalman filter
+
+    With the constant gain K, the filtered state follows the linear recursion x[t] = (I - K H) F x[t - 1] + K z[t],
+    which is evaluated for whole tracks (and batches of tracks) at once; no covariances are propagated. The steady-state
+    gain is suboptimal for the first few steps, while a time-varying filter's gain would still be converging.
+
+    :param Z: measurement tracks (..., T, 3) of positions, or (..., T, 6) of positions and velocities if velocity_std is
+    given
+    :param time_step: time step [s]
+    :param process_std: standard deviation of the velocity change per time step [m/s]
+    :param position_std: standard deviation of position measurements [m]
+    :param velocity_std: standard deviation of velocity measurements [m/s], or None if velocity is not measured
+    :param x_0: state estimate (..., 6) before the first measurement, [position; velocity]. Defaults to the first
+    position measurement (and velocity measurement, or zero velocity).
+    :return: filtered state tracks (..., T, 6) of [position; velocity]
+    """
+
+    Z = np.asarray(Z, dtype=np.float64)
+    num_measured = 3 if velocity_std is None else 6
+    if Z.shape[-1] != num_measured:
+        raise ValueError("Measurements must have {} columns".format(num_measured))
+
+    K, _ = steady_state_gain(float(time_step), float(process_std), float(position_std),
+                             None if velocity_std is None else float(velocity_std))
+    F, _ = constant_velocity_model(time_step, process_std)
+    H, _ = measurement_model(position_std, velocity_std)
+    A = np.dot(np.eye(2) - np.dot(K, H), F)
+
+    # per axis layout (..., T, 3 axes, m)
+    Z_axes = Z.reshape(Z.shape[:-1] + (num_measured // 3, 3)).swapaxes(-1, -2)
+    Y = np.einsum("ij,...j->...i", K, Z_axes)
+
+    if x_0 is None:
+        x_0 = np.zeros(Z.shape[:-2] + (6,))
+        x_0[..., :num_measured] = Z[..., 0, :]
+    x_0 = np.broadcast_to(np.asarray(x_0, dtype=np.float64), Z.shape[:-2] + (6,))
+    Y[..., 0, :, :] += np.einsum("ij,...j->...i", A, x_0.reshape(x_0.shape[:-1] + (2, 3)).swapaxes(-1, -2))
+
+    X = _linear_recursion(A, Y)
+
+    return X.swapaxes(-1, -2).reshape(Z.shape[:-1] + (6,))
@@ -1,13 +1,6 @@
 # Various transforms between reference frames and coordinate systems
 
-import os
-if os.environ.get("USE_JAX", False):
-    import jax.numpy as np
-    from jax.config import config
-    # check that JAX is set to 64-bit precision
-    assert config.values["jax_enable_x64"]
-else:
-    import numpy as np
+from python.lib.backend import np
 
 
 def rigid_transform_local_to_world(R, t, p_local):
@@ -86,3 +79,41 @@ def angle_to_rotation_matrix(angle_rad):
 
     return np.array([[np.cos(angle_rad), -np.sin(angle_rad)],
                      [np.sin(angle_rad), np.cos(angle_rad)]])
+
+
+class PoseContext:
+    """
+    Trigonometry of a robot pose (x, y, alpha), computed once and shared by the sensor, transform and Jacobian
+    functions evaluated at that pose (pass it as their ctx argument)
+
+    version identifies the pose it was computed for (see EKFSLAM.pose_context), so that it can be memoised until the
+    pose changes.
+    """
+
+    __slots__ = ("x", "y", "alpha", "c", "s", "t", "R", "version")
+
+    def __init__(self, X_r, version=None):
+        """
+        :param X_r: robot pose [x; y; alpha]
+        :param version: version of the pose (optional)
+        """
+
+        self.x, self.y, self.alpha = X_r[0], X_r[1], X_r[2]
+        self.c = np.cos(self.alpha)
+        self.s = np.sin(self.alpha)
+        self.t = X_r[:2]
+        self.R = np.array([[self.c, -self.s],
+                           [self.s, self.c]])
+        self.version = version
+
+
+def pose_context(X_r, ctx=None):
+    """
+    Return ctx if given, otherwise compute the PoseContext of X_r
+
+    :param X_r: robot pose [x; y; alpha]
+    :param ctx: PoseContext of X_r, or None
+    :return: PoseContext
+    """
+
+    return PoseContext(X_r) if ctx is None else ctx
@@ -0,0 +1,265 @@
+# Unscented Kalman filter SLAM estimator: no Jacobians of the motion or sensor models are needed
+
+import numpy as onp
+
+from python.lib.ekf import EKFSLAM
+from python.lib.sensors import RangeBearingSensor
+
+
+def sigma_points(mean, cov, alpha=1., beta=2., kappa=0.):
+    """
+    Scaled sigma points of a Gaussian and their weights
+
+    The square root of cov is taken with an eigendecomposition, so cov may be singular (e.g. a robot pose that is known
+    exactly).
+
+    :param mean: mean (..., d)
+    :param cov: covariance (..., d, d)
+    :param alpha: spread of the sigma points
+    :param beta: prior knowledge of the distribution (2 is optimal for a Gaussian)
+    :param kappa: secondary scaling parameter
+    :return: sigma points (..., 2d + 1, d), mean weights (2d + 1,) and covariance weights (2d + 1,)
+    """
+
+    d = mean.shape[-1]
+    lambda_ = alpha ** 2 * (d + kappa) - d
+
+    eigenvalues, eigenvectors = onp.linalg.eigh(cov)
+    S = eigenvectors * onp.sqrt(onp.maximum(eigenvalues, 0) * (d + lambda_))[..., None, :]
+    S = onp.swapaxes(S, -1, -2)     # rows are the columns of the matrix square root
+
+    points = onp.concatenate([mean[..., None, :], mean[..., None, :] + S, mean[..., None, :] - S], axis=-2)
+
+    w_m = onp.full(2 * d + 1, 1. / (2 * (d + lambda_)))
+    w_c = w_m.copy()
+    w_m[0] = lambda_ / (d + lambda_)
+    w_c[0] = lambda_ / (d + lambda_) + 1 - alpha ** 2 + beta
+
+    return points, w_m, w_c
+
+
+def wrap_angle(angle):
+    """
+    Wrap angles to [-pi, pi)
+    """
+
+    return (angle + onp.pi) % (2 * onp.pi) - onp.pi
+
+
+def unscented_mean(points, w_m, angles=()):
+    """
+    Weighted mean of sigma points. Angle components are averaged as offsets from the central sigma point.
+
+    :param points: transformed sigma points (..., 2d + 1, k)
+    :param w_m: mean weights (2d + 1,)
+    :param angles: indices of angle components
+    :return: mean (..., k) and deviations of the points from it (..., 2d + 1, k), with angles wrapped
+    """
+
+    reference = points[..., :1, :].copy()
+    offsets = points - reference
+    for a in angles:
+        offsets[..., a] = wrap_angle(offsets[..., a])
+
+    mean_offset = onp.einsum("s,...sk->...k", w_m, offsets)
+    deviations = offsets - mean_offset[..., None, :]
+
+    return reference[..., 0, :] + mean_offset, deviations
+
+
+class UKFSLAM(EKFSLAM):
+    """
+    SLAM estimator using the unscented transform instead of the Jacobians of EKFSLAM
+
+    All sigma points of a step are pushed through the models (EKFSLAM.state_propagation and
+    RangeBearingSensor.observe_range_bearing_batch) in one batched call. Only the states that a model depends on are
+    sampled: the robot pose and process noise in prediction, and the robot pose and landmark of each measurement in a
+    measurement update (a scan or joint update stacks the sigma points of its measurements, see
+    _statistical_linearisation). Their effect on the rest of the state is carried through the cross covariances by
+    statistical linearisation (the regression F = P_yx P_xx^+ of the transformed sigma points on the sampled states), so
+    prediction and updates stay O(n) and O(n^2) as in EKFSLAM, rather than propagating 2n + 1 sigma points of the full
+    state.
+
+    As the statistically linearised F takes the place of F_x, deferred cross covariance propagation and mixed
+    precision work as in EKFSLAM.
+    """
+
+    def __init__(self, landmark_capacity=0, dtype=onp.float64, kernels=None, alpha=1., beta=2., kappa=0.):
+        """
+        :param landmark_capacity: see EKFSLAM
+        :param dtype: see EKFSLAM
+        :param kernels: see EKFSLAM
+        :param alpha: sigma point spread
+        :param beta: prior knowledge of the distribution (2 is optimal for a Gaussian)
+        :param kappa: secondary scaling parameter
+        """
+
+        super().__init__(landmark_capacity=landmark_capacity, dtype=dtype, kernels=kernels)
+
+        self.alpha = alpha
+        self.beta = beta
+        self.kappa = kappa
+
+    def _sigma_points(self, mean, cov):
+        return sigma_points(mean, cov, self.alpha, self.beta, self.kappa)
+
+    def _robot_propagation(self, U):
+        """
+        Propagate the robot pose and its covariance P_rr forward one time step with the unscented transform (O(1))
+
+        :param U: control input (d_x, d_alpha)
+        :return: statistically linearised transition matrix F of the robot pose
+        """
+
+        self.num_steps += 1
+
+        # sigma points of the robot pose and process noise
+        P_rr = self.robot_covariance()
+        cov = onp.zeros((5, 5))
+        cov[:3, :3] = P_rr
+        cov[3:, 3:] = self.Q
+        points, w_m, w_c = self._sigma_points(onp.concatenate([self.X[:3], [0., 0.]]), cov)
+
+        X_r_new = onp.asarray(self.state_propagation(points[:, :3], onp.asarray(U, dtype=onp.float64), points[:, 3:]))
+        mean, d_new = unscented_mean(X_r_new, w_m, angles=(2,))
+        d_old = points[:, :3] - self.X[:3]
+
+        P_rr_new = onp.dot(w_c * d_new.T, d_new)
+        P_rr_new = (P_rr_new + P_rr_new.T) / 2
+        F = onp.dot(onp.dot(w_c * d_new.T, d_old), onp.linalg.pinv(P_rr, hermitian=True))
+
+        self.X[:3] = mean
+        self.X[2] = wrap_angle(self.X[2])
+        self._P_buf[:3, :3] = P_rr_new
+        if self._P_rr is not None:
+            self._P_rr = P_rr_new
+
+        return F
+
+    def _landmark_initialisation(self, X_r, Y_meas):
+        """
+        Initial estimates of new landmarks, from the unscented transform of the inverse observation function over the
+        robot pose and measurement noise (one batch of sigma points per landmark)
+
+        :param X_r: robot pose estimate
+        :param Y_meas: range-bearing measurements (K, 2)
+        :return: see EKFSLAM._landmark_initialisation (G_r is the statistically linearised Jacobian)
+        """
+
+        return self._unscented_landmark_initialisation(RangeBearingSensor.inv_observe_range_bearing_batch, X_r, Y_meas,
+                                                       self.R)
+
+    def _model_landmark_initialisation(self, model, X_r, Y_meas):
+        """
+        Initial estimates of new landmarks from the measurements of a sensor model, with the unscented transform of
+        its inverse observation function (see _landmark_initialisation)
+
+        :param model: sensor model that can initialise landmarks (sensor_models.SensorModel)
+        :param X_r: robot pose estimate
+        :param Y_meas: measurements (K, model.dim)
+        :return: see EKFSLAM._landmark_initialisation
+        """
+
+        return self._unscented_landmark_initialisation(model.inverse_observe, X_r, Y_meas, model.R)
+
+    def _unscented_landmark_initialisation(self, inverse_observe, X_r, Y_meas, R):
+        """
+        Unscented transform of an inverse observation function g(X_r, y) over the robot pose and measurement noise
+
+        :param inverse_observe: inverse observation function, vectorised over sigma points
+        :param X_r: robot pose estimate
+        :param Y_meas: measurements (K, m)
+        :param R: measurement noise covariance (m, m)
+        :return: see EKFSLAM._landmark_initialisation
+        """
+
+        K, m = Y_meas.shape
+        P_rr = self.robot_covariance()
+        cov = onp.zeros((3 + m, 3 + m))
+        cov[:3, :3] = P_rr
+        cov[3:, 3:] = R
+        mean = onp.concatenate([onp.broadcast_to(X_r, (K, 3)), Y_meas], axis=1)
+        points, w_m, w_c = self._sigma_points(mean, onp.broadcast_to(cov, (K, 3 + m, 3 + m)))
+
+        L_points = onp.asarray(inverse_observe(points[..., :3], points[..., 3:]), dtype=onp.float64)
+        L, d_L = unscented_mean(L_points, w_m)
+        d_r = points[..., :3] - mean[:, None, :3]
+
+        P_LL = onp.einsum("s,ksi,ksj->kij", w_c, d_L, d_L)
+        G_r = onp.matmul(onp.einsum("s,ksi,ksj->kij", w_c, d_L, d_r), onp.linalg.pinv(P_rr, hermitian=True))
+
+        # the part of P_LL not explained by the robot pose uncertainty (G_r P_rr G_r^T) is due to measurement noise
+        return L, G_r, P_LL - onp.matmul(onp.matmul(G_r, P_rr), onp.swapaxes(G_r, -1, -2))
+
+    def _linearise_range_bearing(self, Y_meas, l):
+        """
+        Statistically linearised range-bearing measurements of landmarks (see _statistical_linearisation)
+
+        :param Y_meas: range-bearing measurements (K, 2)
+        :param l: state indices of the landmarks (K,)
+        :return: see EKFSLAM._linearise_range_bearing
+        """
+
+        return self._statistical_linearisation(RangeBearingSensor.observe_range_bearing_batch, Y_meas, l, self.R,
+                                               angles=(1,))
+
+    def _linearise(self, model, Y_meas, l=None):
+        """
+        Statistically linearised measurements of a sensor model (see _statistical_linearisation)
+
+        :param model: sensor model (sensor_models.SensorModel)
+        :param Y_meas: measurements (K, model.dim)
+        :param l: state indices of the observed landmarks (K,), or None for models that observe the robot pose only
+        :return: see EKFSLAM._linearise
+        """
+
+        return self._statistical_linearisation(model.observe, Y_meas, l, model.R, angles=model.angles)
+
+    def _statistical_linearisation(self, observe, Y_meas, l, R, angles=()):
+        """
+        Linearise measurements with the unscented transform of the observation function over the robot pose and the
+        observed landmark of each measurement
+
+        The sigma points of all measurements (K, 2d + 1, d) are pushed through the observation function in one batched
+        call. The Jacobian of each measurement is the statistically linearised H = P_yx P_xx^+, and the part of the
+        transformed covariance P_yy that it does not explain is added to the measurement noise, so that
+        H P H^T + R = P_yy + R as in the unscented update. For a single measurement, the update of
+        EKFSLAM._stacked_update is then the unscented update, and several measurements are updated jointly.
+
+        :param observe: observation function f(X_r, L), vectorised over sigma points, or f(X_r) if l is None
+        :param Y_meas: measurements (K, m)
+        :param l: state indices of the observed landmarks (K,), or None for measurements of the robot pose only
+        :param R: measurement noise covariance (m, m)
+        :param angles: indices of angle components of the measurements
+        :return: see EKFSLAM._linearise
+        """
+
+        K = Y_meas.shape[0]
+        if l is None:
+            sub = onp.arange(3)[None]       # (1, 3): the robot pose only, the same for all measurements
+        else:
+            sub = onp.concatenate([onp.broadcast_to(onp.arange(3), (K, 3)), l[:, None] + onp.arange(2)], axis=1)
+
+        P_sub = self.P[sub[:, :, None], sub[:, None, :]].astype(onp.float64)
+        P_sub[:, :3, :3] = self.robot_covariance()
+        mean = self.X[sub]
+        points, w_m, w_c = self._sigma_points(mean, P_sub)
+
+        Y_points = observe(points[..., :3]) if l is None else observe(points[..., :3], points[..., 3:])
+        h, d_y = unscented_mean(onp.asarray(Y_points, dtype=onp.float64), w_m, angles=angles)
+        d_x = points - mean[:, None, :]
+
+        H = onp.matmul(onp.einsum("s,ksi,ksj->kij", w_c, d_y, d_x), onp.linalg.pinv(P_sub, hermitian=True))
+        P_yy = onp.einsum("s,ksi,ksj->kij", w_c, d_y, d_y)
+        R = R + P_yy - onp.matmul(onp.matmul(H, P_sub), onp.swapaxes(H, -1, -2))
+        R = (R + onp.swapaxes(R, -1, -2)) / 2
+
+        z = Y_meas - h
+        for a in angles:
+            z[:, a] = wrap_angle(z[:, a])
+
+        m = Y_meas.shape[1]
+        H_R = onp.broadcast_to(H[..., :3], (K, m, 3))
+        H_L = None if l is None else H[..., 3:]
+
+        return (z, H_R, H_L, l), onp.broadcast_to(R, (K, m, m))
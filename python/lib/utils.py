@@ -1,6 +1,4 @@
 import numpy as np
-from matplotlib.patches import Ellipse
-import matplotlib.transforms as transforms
 
 
 def confidence_ellipse(mean, cov, ax, n_std=3.0, facecolor='g', **kwargs):
@@ -22,6 +20,10 @@ def confidence_ellipse(mean, cov, ax, n_std=3.0, facecolor='g', **kwargs):
     kwargs : `~matplotlib.patches.Patch` properties
     """
 
+    # matplotlib is imported here so that headless runs never load it
+    from matplotlib.patches import Ellipse
+    import matplotlib.transforms as transforms
+
     if mean.shape != (2,):
         raise ValueError("Only works with 2D mean")
 
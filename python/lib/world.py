@@ -0,0 +1,148 @@
+# Simulated world: large landmark fields stored in a uniform spatial hash grid, for sensing only the landmarks in view
+#
+# The plane is divided into square cells. Each cell (i, j) is hashed into one of a fixed number of buckets, and the
+# landmarks are stored sorted by bucket (with the offset of each bucket), so the grid is unbounded and its memory is
+# fixed by the number of landmarks and buckets. A query hashes the cells overlapping the sensor range, gathers the
+# landmarks of those buckets (which may include a few from other cells, in colliding buckets) and keeps those within
+# range and field of view. Its cost scales with the landmarks near the robot, not with the size of the world.
+
+import numpy as np
+
+# hash of cell (i, j): ((i * P_1) xor (j * P_2)) mod num_buckets (Teschner et al., 2003)
+_HASH_PRIME_1 = 73856093
+_HASH_PRIME_2 = 19349663
+
+
+def generate_landmarks(num_landmarks, bounds, seed=0, num_clusters=0, cluster_std=1.):
+    """
+    Procedurally generate a landmark field
+
+    :param num_landmarks: number of landmarks
+    :param bounds: area (min_x, min_y, max_x, max_y) [m]
+    :param seed: random seed (the same seed gives the same field)
+    :param num_clusters: if > 0, landmarks are drawn around this many uniformly placed cluster centres (e.g. buildings,
+    trees), otherwise uniformly over the area
+    :param cluster_std: standard deviation of the landmarks around their cluster centre [m]
+    :return: landmark positions (N, 2), within bounds
+    """
+
+    min_x, min_y, max_x, max_y = bounds
+    low, high = np.array([min_x, min_y], dtype=float), np.array([max_x, max_y], dtype=float)
+    rng = np.random.default_rng(seed)
+
+    if num_clusters <= 0:
+        return rng.uniform(low, high, (num_landmarks, 2))
+
+    centres = rng.uniform(low, high, (num_clusters, 2))
+    landmarks = centres[rng.integers(num_clusters, size=num_landmarks)]
+    landmarks += rng.normal(0., cluster_std, (num_landmarks, 2))
+
+    return np.clip(landmarks, low, high, out=landmarks)
+
+
+class LandmarkGrid:
+    """
+    Landmarks in a uniform spatial hash grid, queried by sensor range and field of view
+
+    Landmark IDs default to the row index in the positions passed in, so they are stable between queries and can be
+    passed to the estimators as they are.
+    """
+
+    def __init__(self, positions, cell_size=10., ids=None, num_buckets=None):
+        """
+        :param positions: landmark positions (N, 2) [m]
+        :param cell_size: side of the grid cells [m]. About the sensor's max range is a good choice: a query then
+        visits 3 x 3 to 4 x 4 cells.
+        :param ids: landmark IDs (N,) (defaults to 0, ..., N - 1)
+        :param num_buckets: number of hash buckets (defaults to N, at least 1)
+        """
+
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        N = positions.shape[0]
+
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+
+        self.cell_size = float(cell_size)
+        self.num_buckets = max(N if num_buckets is None else int(num_buckets), 1)
+
+        buckets = self._hash(*self._cells(positions).T)
+        order = np.argsort(buckets, kind="stable")
+
+        # landmarks of bucket b are positions[offsets[b]:offsets[b + 1]]
+        self.positions = positions[order]
+        self.ids = (np.arange(N) if ids is None else np.asarray(ids).reshape(N))[order]
+        self.offsets = np.zeros(self.num_buckets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(buckets, minlength=self.num_buckets), out=self.offsets[1:])
+
+    def __len__(self):
+        return self.positions.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.positions.nbytes + self.ids.nbytes + self.offsets.nbytes
+
+    def _cells(self, points):
+        return np.floor(points / self.cell_size).astype(np.int64)
+
+    def _hash(self, i, j):
+        return ((i * _HASH_PRIME_1) ^ (j * _HASH_PRIME_2)) % self.num_buckets
+
+    def candidates(self, centre, radius):
+        """
+        Indices (into self.positions) of the landmarks in the buckets of the cells overlapping a disc: a superset of
+        the landmarks within the disc
+
+        :param centre: centre of the disc (2,) [m]
+        :param radius: radius of the disc [m]
+        :return: indices (K,)
+        """
+
+        centre = np.asarray(centre, dtype=np.float64)[:2]
+        (i_min, j_min), (i_max, j_max) = self._cells(centre - radius), self._cells(centre + radius)
+        i, j = np.meshgrid(np.arange(i_min, i_max + 1), np.arange(j_min, j_max + 1), indexing="ij")
+
+        # cells may share a bucket, which must only be gathered once
+        buckets = np.unique(self._hash(i.ravel(), j.ravel()))
+        starts, ends = self.offsets[buckets], self.offsets[buckets + 1]
+        counts = ends - starts
+
+        # concatenation of the ranges starts[k]:ends[k]
+        first = np.cumsum(counts) - counts
+
+        return np.repeat(starts - first, counts) + np.arange(counts.sum())
+
+    def query(self, centre, radius):
+        """
+        Landmarks within a distance of a point
+
+        :param centre: point (2,) [m]
+        :param radius: distance [m]
+        :return: IDs (K,) in ascending order, and positions (K, 2)
+        """
+
+        return self.visible(np.array([centre[0], centre[1], 0.]), radius)
+
+    def visible(self, X_r, max_range, fov=2 * np.pi):
+        """
+        Landmarks within the sensor range and field of view of a robot
+
+        :param X_r: robot pose (x [m], y [m], alpha [rad])
+        :param max_range: sensor max range [m]
+        :param fov: sensor field of view, centred on the robot heading [rad]
+        :return: IDs (K,) in ascending order, and positions (K, 2)
+        """
+
+        X_r = np.asarray(X_r, dtype=np.float64)
+        index = self.candidates(X_r[:2], max_range)
+        d = self.positions[index] - X_r[:2]
+        keep = np.einsum("ij,ij->i", d, d) <= max_range ** 2
+
+        if fov < 2 * np.pi:
+            bearing = np.arctan2(d[:, 1], d[:, 0]) - X_r[2]
+            keep &= np.abs((bearing + np.pi) % (2 * np.pi) - np.pi) <= fov / 2
+
+        index = index[keep]
+        index = index[np.argsort(self.ids[index], kind="stable")]
+
+        return self.ids[index], self.positions[index]
@@ -0,0 +1,29 @@
+# Simulate drones in Python (without building the C++ simulator) and write the data in the sim.dat format
+
+import argparse
+import time
+
+from python.lib.drone_sim import SIMULATION_DURATION, SIMULATION_TIMESTEP, simulate_drones, write_sim_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate drones and write the data in the sim.dat format")
+    parser.add_argument("--num-drones", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=SIMULATION_DURATION, help="simulation duration [s]")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first drone (drone k uses seed + k)")
+    parser.add_argument("--output", default="sim.dat")
+    args = parser.parse_args()
+
+    num_timesteps = int(args.duration / SIMULATION_TIMESTEP)
+
+    t_start = time.time()
+    records = simulate_drones(args.num_drones, num_timesteps, seeds=range(args.seed, args.seed + args.num_drones))
+    print("Simulated {} drones for {} timesteps in {:.3f} seconds".format(args.num_drones, num_timesteps,
+                                                                         time.time() - t_start))
+
+    write_sim_data(args.output, records)
+    print("Written simulation data to", args.output)
+
+
+if __name__ == "__main__":
+    main()
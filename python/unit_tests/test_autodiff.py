@@ -0,0 +1,87 @@
+import numpy as np
+from numpy.testing import assert_allclose
+import pytest
+
+from python.lib import backend
+from python.lib.autodiff import AutodiffKernels, range_bearing_linearisation_function, robot_propagation_function
+from python.lib.ekf import EKFSLAM
+from python.lib.kernels import NumpyKernels, get_kernels
+from python.lib.robot import move
+from python.lib.sensors import RangeBearingSensor
+
+requires_jax = pytest.mark.skipif(not backend.USE_JAX, reason="needs USE_JAX=True (and JAX_ENABLE_X64=True)")
+
+
+def run(jacobians, num_steps=20, seed=0):
+    rng = np.random.RandomState(seed)
+    landmarks = rng.uniform(-10, 10, (6, 2))
+
+    est = EKFSLAM(jacobians=jacobians)
+    est.P = np.diag([0.01, 0.01, 0.001])
+    est.Q = np.diag([0.05 ** 2, np.deg2rad(1.) ** 2])
+    est.R = np.diag([0.1 ** 2, np.deg2rad(2.) ** 2])
+
+    r_true = np.zeros(3)
+    U = np.array([0.2, np.deg2rad(5.)])
+    for step in range(num_steps):
+        r_true = np.asarray(move(r_true, U, np.zeros(2)))
+        est.state_and_state_cov_propagation(U)
+        Y = np.asarray(RangeBearingSensor.observe_range_bearing_batch(r_true, landmarks))
+        Y = Y + rng.randn(*Y.shape) * np.sqrt(np.diag(est.R))
+        if step == 0:
+            est.new_landmark_range_bearing(Y[0], landmark_id=0)
+        est.range_bearing_scan_update(Y, list(range(6)))
+
+    return est
+
+
+@requires_jax
+def test_ekf_with_autodiff_jacobians_matches_analytic_jacobians():
+    analytic = run("analytic")
+    autodiff = run("autodiff")
+
+    assert autodiff.kernels is AutodiffKernels
+    assert_allclose(autodiff.X, analytic.X, atol=1e-10)
+    assert_allclose(autodiff.P, analytic.P, atol=1e-12)
+
+
+@requires_jax
+def test_autodiff_jacobian_functions_are_cached_per_process():
+    run("autodiff", num_steps=2)
+    propagation = robot_propagation_function(EKFSLAM.state_propagation)
+    linearisation = range_bearing_linearisation_function()
+    hits = robot_propagation_function.cache_info().hits
+
+    run("autodiff", num_steps=2)
+
+    assert robot_propagation_function.cache_info().hits > hits
+    assert robot_propagation_function(EKFSLAM.state_propagation) is propagation
+    assert range_bearing_linearisation_function() is linearisation
+
+
+@requires_jax
+def test_autodiff_kernels_match_numpy_kernels():
+    X_r = np.array([1., -2., 2.5])
+    L = np.array([[3., 4.], [-5., 1.], [0.5, -7.]])
+
+    for expected, actual in zip(NumpyKernels.observe_jacobians(X_r, L), AutodiffKernels.observe_jacobians(X_r, L)):
+        assert_allclose(actual, expected, atol=1e-12)
+
+    Y = np.array([[5., 0.3], [6., -2.], [7., 3.1]])
+    for expected, actual in zip(NumpyKernels.linearise(X_r, L, Y), AutodiffKernels.linearise(X_r, L, Y)):
+        assert_allclose(actual, expected, atol=1e-12)
+
+    assert get_kernels("autodiff") is AutodiffKernels
+
+
+def test_unknown_jacobians_raise_error():
+    with pytest.raises(ValueError):
+        EKFSLAM(jacobians="numeric")
+
+
+@pytest.mark.skipif(backend.USE_JAX, reason="checks the error without USE_JAX")
+def test_autodiff_without_jax_raises_error():
+    with pytest.raises(RuntimeError):
+        EKFSLAM(jacobians="autodiff")
+    with pytest.raises(RuntimeError):
+        get_kernels("autodiff")
@@ -0,0 +1,54 @@
+import struct
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from python.lib.drone_sim import MAX_VEL, RECORD_DTYPE, SIMULATION_TIMESTEP, STRUCT_FMT, read_sim_data, \
+    simulate_drones, write_sim_data
+
+
+def test_simulate_drones_starts_from_initial_state_and_integrates_velocity():
+    records = simulate_drones(4, 100, pos=[1., 2., 3.])
+
+    assert records.shape == (4, 100)
+    assert_array_equal(records["timestep"][0], np.arange(100))
+    assert_array_equal(records["pos"][:, 0], np.tile([1., 2., 3.], (4, 1)))
+    assert_array_equal(records["vel"][:, 0], np.zeros((4, 3)))
+
+    # position is integrated with the velocity after each step's velocity change
+    d_pos = np.diff(records["pos"].astype(np.float64), axis=1)
+    assert_allclose(d_pos, SIMULATION_TIMESTEP * records["vel"][:, 1:], atol=1e-5)
+
+
+def test_simulate_drones_velocity_random_walk_has_model_standard_deviation():
+    records = simulate_drones(50, 200)
+
+    d_vel = np.diff(records["vel"].astype(np.float64), axis=1)
+    assert abs(d_vel.std() - 0.2 * MAX_VEL) < 0.005
+    assert abs(d_vel.mean()) < 0.005
+
+
+def test_simulate_drones_trajectory_only_depends_on_the_drone_seed():
+    records = simulate_drones(3, 50, seeds=[7, 8, 9])
+
+    assert_array_equal(simulate_drones(1, 50, seeds=[8])[0], records[1])
+    assert not np.array_equal(records["vel"][0], records["vel"][1])
+
+
+def test_sim_data_is_written_in_cpp_record_layout(tmp_path):
+    records = simulate_drones(2, 10, seeds=[1, 2])
+    path = str(tmp_path / "sim.dat")
+
+    write_sim_data(path, records)
+
+    with open(path, "rb") as f:
+        data = f.read()
+    assert len(data) == 20 * struct.calcsize(STRUCT_FMT)
+
+    # read the records of the second drone as plot_sim_data.py does
+    first = struct.unpack_from(STRUCT_FMT, data, 10 * struct.calcsize(STRUCT_FMT))
+    assert_array_equal(first[:3], records["pos"][1, 0])
+    assert first[6] == 0
+
+    assert RECORD_DTYPE.itemsize == struct.calcsize(STRUCT_FMT)
+    assert_array_equal(read_sim_data(path, num_drones=2), records)
@@ -1,9 +1,12 @@
 # import jax.numpy as np
 import numpy as np
-from numpy.testing import assert_array_almost_equal, assert_array_equal
+from numpy.testing import assert_allclose, assert_array_almost_equal, assert_array_equal
 import jax
+import pytest
 
-from python.lib.ekf import EKFSLAM
+from python.lib.ekf import EKFSLAM, least_recently_observed_landmarks, landmarks_beyond
+from python.lib.sensor_models import RangeBearingModel
+from python.lib.sensors import RangeBearingSensor
 
 
 def test_jacobian_f_X_r_at_specific_test_points_compared_to_auto_diff():
@@ -110,3 +113,410 @@ def test_ekf_state_propagation_forward_control_input_updates_state_covariance():
     assert assert_array_almost_equal(est.P, np.array([[0.4, 0, 0],
                                                       [0, 1.5, 0.9],
                                                       [0, 0.9, 0.6]])) is None
+
+
+def make_estimator_with_robot_uncertainty(landmark_capacity=0):
+    est = EKFSLAM(landmark_capacity=landmark_capacity)
+    est.X = np.array([1., -2., np.deg2rad(30.)])
+    est.P = np.array([[0.3, 0.05, 0.02],
+                      [0.05, 0.2, 0.01],
+                      [0.02, 0.01, 0.1]])
+    est.Q = np.array([[0.2, 0], [0, 0.3]])
+    est.R = np.array([[0.1 ** 2, 0], [0, np.deg2rad(5.) ** 2]])
+
+    return est
+
+
+def test_new_landmark_range_bearing_appends_landmark_to_state_vector():
+    est = make_estimator_with_robot_uncertainty()
+    y = np.array([4., np.deg2rad(20.)])
+
+    est.new_landmark_range_bearing(y, landmark_id=7)
+
+    assert est.X.shape == (5,)
+    assert est.P.shape == (5, 5)
+    assert est.get_num_landmarks() == 1
+    assert est.get_landmark_id(0) == 7
+    assert est.get_landmark_index(7) == 0
+    assert assert_array_almost_equal(est.X[3:], RangeBearingSensor.inv_observe_range_bearing(est.X[:3], y)) is None
+
+
+def test_new_landmark_range_bearing_covariance_matches_full_jacobian_augmentation():
+    est = make_estimator_with_robot_uncertainty()
+    est.new_landmark_range_bearing(np.array([4., np.deg2rad(20.)]), landmark_id=0)
+
+    X_r = est.X[:3].copy()
+    P = est.P.copy()
+    y = np.array([6., np.deg2rad(-45.)])
+
+    est.new_landmark_range_bearing(y, landmark_id=1)
+
+    # dense reference: P_new = J P J^T + J_y R J_y^T, where J = [I; G_r 0] and J_y = [0; G_y]
+    G_r = RangeBearingSensor.jacobian_G_X_r(x_r=X_r[0], y_r=X_r[1], alpha_r=X_r[2], rho=y[0], psi=y[1])
+    G_y = RangeBearingSensor.jacobian_G_y_i(x_r=X_r[0], y_r=X_r[1], alpha_r=X_r[2], rho=y[0], psi=y[1])
+    J = np.zeros((7, 5))
+    J[:5, :5] = np.eye(5)
+    J[5:, :3] = G_r
+    J_y = np.zeros((7, 2))
+    J_y[5:, :] = G_y
+    P_expected = np.dot(np.dot(J, P), J.T) + np.dot(np.dot(J_y, est.R), J_y.T)
+
+    assert assert_array_almost_equal(est.P, P_expected) is None
+
+
+def test_new_landmark_range_bearing_raises_error_if_landmark_id_already_exists():
+    est = make_estimator_with_robot_uncertainty()
+    est.new_landmark_range_bearing(np.array([4., 0.]), landmark_id=3)
+
+    with pytest.raises(ValueError):
+        est.new_landmark_range_bearing(np.array([5., 0.]), landmark_id=3)
+
+
+def test_new_landmark_range_bearing_without_id_gets_the_next_free_id():
+    est = make_estimator_with_robot_uncertainty()
+
+    assert est.new_landmark_range_bearing(np.array([2., 0.1])) == 0
+    est.new_landmarks_range_bearing(np.array([[3., 0.2], [3., -0.2]]), [np.int64(5), "a"])
+    assert est.new_landmark_range_bearing(np.array([4., 0.3])) == 6
+    assert est.landmark_lookup == [0, 5, "a", 6]
+
+
+def test_new_landmark_range_bearing_writes_into_preallocated_space():
+    est = make_estimator_with_robot_uncertainty(landmark_capacity=4)
+    P_buffer = est.P
+
+    for j in range(4):
+        est.new_landmark_range_bearing(np.array([4. + j, 0.]), landmark_id=j)
+
+    assert np.shares_memory(P_buffer, est.P)
+
+    # growing beyond the preallocated capacity keeps the existing states
+    X, P = est.X.copy(), est.P.copy()
+    est.new_landmark_range_bearing(np.array([10., 0.]), landmark_id=4)
+
+    assert assert_array_equal(est.X[:11], X) is None
+    assert assert_array_equal(est.P[:11, :11], P) is None
+
+
+def test_ekf_state_propagation_with_landmarks_updates_cross_covariance():
+    est = make_estimator_with_robot_uncertainty()
+    est.new_landmark_range_bearing(np.array([4., np.deg2rad(20.)]), landmark_id=0)
+    P = est.P.copy()
+    alpha_r = est.X[2]
+
+    est.state_and_state_cov_propagation([1., np.deg2rad(10.)])
+
+    F_x = EKFSLAM.jacobian_f_X_r(x_u=1., x_n=0, alpha_r=alpha_r, alpha_u=np.deg2rad(10.), alpha_n=0)
+
+    assert assert_array_almost_equal(est.P[:3, 3:], np.dot(F_x, P[:3, 3:])) is None
+    assert assert_array_almost_equal(est.P[3:, :3], est.P[:3, 3:].T) is None
+    assert assert_array_equal(est.P[3:, 3:], P[3:, 3:]) is None
+
+
+def test_new_landmarks_range_bearing_matches_adding_landmarks_one_at_a_time():
+    Y = np.array([[4., np.deg2rad(20.)], [6., np.deg2rad(-45.)], [2.5, np.deg2rad(170.)]])
+
+    est_bulk = make_estimator_with_robot_uncertainty()
+    est_bulk.new_landmark_range_bearing(np.array([3., 0.]), landmark_id="a")
+    est_bulk.new_landmarks_range_bearing(Y, ["b", "c", "d"])
+
+    est_single = make_estimator_with_robot_uncertainty()
+    est_single.new_landmark_range_bearing(np.array([3., 0.]), landmark_id="a")
+    for landmark_id, y in zip(["b", "c", "d"], Y):
+        est_single.new_landmark_range_bearing(y, landmark_id=landmark_id)
+
+    assert est_bulk.landmark_lookup == ["a", "b", "c", "d"]
+    assert assert_array_almost_equal(est_bulk.X, est_single.X) is None
+    assert assert_array_almost_equal(est_bulk.P, est_single.P) is None
+
+
+def test_new_landmarks_range_bearing_raises_error_if_landmark_ids_are_not_unique():
+    est = make_estimator_with_robot_uncertainty()
+    est.new_landmark_range_bearing(np.array([3., 0.]), landmark_id=0)
+
+    with pytest.raises(ValueError):
+        est.new_landmarks_range_bearing(np.array([[4., 0.], [5., 0.]]), [1, 1])
+
+    with pytest.raises(ValueError):
+        est.new_landmarks_range_bearing(np.array([[4., 0.], [5., 0.]]), [1, 0])
+
+    assert est.get_num_landmarks() == 1
+
+
+def make_estimator_with_landmarks(landmark_ids):
+    est = make_estimator_with_robot_uncertainty()
+    Y = np.array([[2. + k, np.deg2rad(10. * k)] for k in range(len(landmark_ids))])
+    est.new_landmarks_range_bearing(Y, landmark_ids)
+
+    return est
+
+
+def test_remove_landmarks_marginalises_and_remaps_remaining_landmarks():
+    est = make_estimator_with_landmarks([10, 11, 12, 13])
+    X, P = est.X.copy(), est.P.copy()
+    P_buffer = est.P
+
+    est.remove_landmarks([11, 13])
+
+    keep = [0, 1, 2, 3, 4, 7, 8]
+    assert est.landmark_lookup == [10, 12]
+    assert est.get_landmark_index(12) == 1
+    assert assert_array_equal(est.X, X[keep]) is None
+    assert assert_array_equal(est.P, P[np.ix_(keep, keep)]) is None
+    assert np.shares_memory(P_buffer, est.P)
+
+
+def test_remove_landmarks_raises_error_for_unknown_landmark_id():
+    est = make_estimator_with_landmarks([0, 1])
+
+    with pytest.raises(ValueError):
+        est.remove_landmarks([1, 5])
+
+    assert est.landmark_lookup == [0, 1]
+
+
+def test_max_landmarks_removes_farthest_landmarks_by_default():
+    est = make_estimator_with_landmarks([0, 1, 2])
+    est.max_landmarks = 3
+
+    est.new_landmarks_range_bearing(np.array([[10., 0.], [1., 0.]]), [3, 4])
+
+    assert est.landmark_lookup == [0, 1, 4]
+
+
+def test_max_landmarks_with_least_recently_observed_policy():
+    est = make_estimator_with_landmarks([0, 1])
+    est.max_landmarks = 2
+    est.landmark_pruning_policy = least_recently_observed_landmarks
+
+    # landmark 0 is observed again after a step, so landmark 1 (added first with it) is the least recently observed
+    est.state_and_state_cov_propagation([0.1, 0])
+    est.measurement_update_range_bearing(np.array([1.9, 0.]), 0)
+    assert est.landmark_last_observed == {0: 1, 1: 0}
+
+    est.new_landmark_range_bearing(np.array([30., 0.]), landmark_id=2)
+
+    assert est.landmark_lookup == [0, 2]
+    assert landmarks_beyond(est, 20.) == [2]
+
+
+def test_measurement_update_range_bearing_matches_dense_kalman_update():
+    est = make_landmark_estimator_for_update()
+    X, P = est.X.copy(), est.P.copy()
+    y = np.array([5.1, np.deg2rad(-12.)])
+
+    est.measurement_update_range_bearing(y, 1)
+
+    # dense reference with full measurement Jacobian H (2 x n)
+    L = X[5:7]
+    H = np.zeros((2, 7))
+    H[:, :3] = RangeBearingSensor.jacobian_H_X_r(x_r=X[0], y_r=X[1], alpha_r=X[2], l_i_x=L[0], l_i_y=L[1])
+    H[:, 5:7] = RangeBearingSensor.jacobian_H_L_i(x_r=X[0], y_r=X[1], alpha_r=X[2], l_i_x=L[0], l_i_y=L[1])
+    Z = np.dot(np.dot(H, P), H.T) + est.R
+    K = np.dot(np.dot(P, H.T), np.linalg.inv(Z))
+    z = y - RangeBearingSensor.observe_range_bearing(X[:3], L)
+
+    assert assert_array_almost_equal(est.X, X + np.dot(K, z)) is None
+    assert assert_array_almost_equal(est.P, P - np.dot(np.dot(K, Z), K.T)) is None
+    assert est.landmark_num_observations[1] == 2
+
+
+def make_landmark_estimator_for_update():
+    est = make_estimator_with_robot_uncertainty()
+    est.new_landmarks_range_bearing(np.array([[4., np.deg2rad(20.)], [5., np.deg2rad(-10.)]]), [0, 1])
+    est.state_and_state_cov_propagation([0.5, np.deg2rad(3.)])
+
+    return est
+
+
+def test_state_and_state_cov_propagation_many_matches_propagating_one_step_at_a_time():
+    U_list = [[0.5, np.deg2rad(3.)], [0.4, np.deg2rad(-8.)], [0.6, np.deg2rad(20.)]]
+
+    est_many = make_landmark_estimator_for_update()
+    est_many.state_and_state_cov_propagation_many(U_list)
+
+    est_single = make_landmark_estimator_for_update()
+    for U in U_list:
+        est_single.state_and_state_cov_propagation(U)
+
+    assert est_many.num_steps == est_single.num_steps
+    assert assert_array_almost_equal(est_many.X, est_single.X) is None
+    assert assert_array_almost_equal(est_many.P, est_single.P) is None
+
+
+def test_deferred_cross_covariance_propagation_matches_eager_propagation():
+    U_list = [[0.5, np.deg2rad(3.)], [0.4, np.deg2rad(-8.)], [0.6, np.deg2rad(20.)]]
+    y = np.array([5.1, np.deg2rad(-12.)])
+
+    est_deferred = make_landmark_estimator_for_update()
+    est_deferred.defer_cross_covariance = True
+    P_view = est_deferred.P
+    P_rm = P_view[:3, 3:].copy()
+
+    est_eager = make_landmark_estimator_for_update()
+
+    for U in U_list:
+        est_deferred.state_and_state_cov_propagation(U)
+        est_eager.state_and_state_cov_propagation(U)
+
+    # robot block is propagated on every time step, but the cross covariance is not applied until needed
+    assert assert_array_almost_equal(P_view[:3, :3], est_eager.P[:3, :3]) is None
+    assert assert_array_equal(P_view[:3, 3:], P_rm) is None
+
+    est_deferred.measurement_update_range_bearing(y, 1)
+    est_eager.measurement_update_range_bearing(y, 1)
+
+    assert assert_array_almost_equal(est_deferred.X, est_eager.X) is None
+    assert assert_array_almost_equal(est_deferred.P, est_eager.P) is None
+
+    est_deferred.state_and_state_cov_propagation(U_list[0])
+    est_eager.state_and_state_cov_propagation(U_list[0])
+    est_deferred.new_landmark_range_bearing(y, landmark_id=2)
+    est_eager.new_landmark_range_bearing(y, landmark_id=2)
+
+    assert assert_array_almost_equal(est_deferred.P, est_eager.P) is None
+
+
+def run_long_simulation(dtype, num_steps=500, num_landmarks=20):
+    rng = np.random.RandomState(4)
+    landmarks = rng.uniform(-20., 20., size=(num_landmarks, 2))
+    R = np.array([[0.1 ** 2, 0], [0, np.deg2rad(2.) ** 2]])
+
+    est = EKFSLAM(dtype=dtype)
+    est.Q = np.array([[0.02 ** 2, 0], [0, np.deg2rad(0.5) ** 2]])
+    est.R = R
+
+    r = np.array([0., 0., 0.])
+    for k in range(num_steps):
+        u = [0.1, np.deg2rad(0.6)]
+        r = EKFSLAM.state_propagation(r, u, rng.randn(2) * [0.02, np.deg2rad(0.5)])
+        est.state_and_state_cov_propagation(u)
+        if k % 5 == 0:
+            Y = np.array([RangeBearingSensor.observe_range_bearing(r, l) for l in landmarks])
+            Y += rng.randn(*Y.shape) * np.sqrt(np.diag(R))
+            est.range_bearing_scan_update(Y, list(range(num_landmarks)))
+
+    return est
+
+
+def test_mixed_precision_covariance_is_consistent_with_float64_over_a_long_run():
+    est_64 = run_long_simulation(np.float64)
+    est_32 = run_long_simulation(np.float32)
+
+    assert est_32.P.dtype == np.float32
+    assert est_32.robot_covariance().dtype == np.float64
+    assert assert_allclose(est_32.X, est_64.X, atol=1e-3) is None
+    assert assert_allclose(est_32.robot_covariance(), est_64.P[:3, :3], rtol=1e-3, atol=1e-8) is None
+    assert assert_allclose(est_32.P, est_64.P, rtol=1e-2, atol=1e-5) is None
+
+    # covariance stays symmetric positive semi definite
+    P = est_32.P.astype(np.float64)
+    assert assert_allclose(P, P.T, atol=1e-7) is None
+    assert np.linalg.eigvalsh(P).min() > -1e-5
+
+
+def test_pose_context_is_memoised_until_the_pose_changes():
+    est = EKFSLAM()
+    est.X = np.array([1., 2., 0.3])
+    est.P = np.diag([0.1, 0.1, 0.01])
+    est.Q = np.diag([0.01, 0.001])
+    est.R = np.diag([0.01, 0.001])
+
+    ctx = est.pose_context()
+    assert est.pose_context() is ctx
+    assert_allclose([ctx.c, ctx.s], [np.cos(0.3), np.sin(0.3)])
+
+    est.new_landmark_range_bearing(np.array([5., 0.2]), landmark_id=7)
+    assert est.pose_context() is ctx
+
+    est.state_and_state_cov_propagation(np.array([1., 0.1]))
+    ctx_propagated = est.pose_context()
+    assert ctx_propagated is not ctx
+    assert_allclose(ctx_propagated.alpha, est.X[2])
+
+    est.measurement_update_range_bearing(np.array([4.2, 0.1]), 0)
+    assert est.pose_context() is not ctx_propagated
+    assert_allclose(est.pose_context().t, est.X[:2])
+
+    est.X = np.concatenate([[0., 0., 1.], est.X[3:]])
+    assert_allclose(est.pose_context().alpha, 1.)
+
+
+def test_range_bearing_scan_update_linearises_all_landmarks_in_one_kernel_call():
+    est = EKFSLAM()
+    est.P = np.diag([0.1, 0.1, 0.01])
+    est.new_landmarks_range_bearing(np.array([[4., 0.3], [5., -0.2], [6., 1.]]), [0, 1, 2])
+    est.state_and_state_cov_propagation([0.5, np.deg2rad(3.)])
+    X, P = est.X.copy(), est.P.copy()
+    Y = np.array([[3.6, 0.35], [4.4, -0.25], [5.5, 1.1]])
+
+    calls = []
+    observe_jacobians = est.kernels.observe_jacobians
+
+    class CountingKernels(est.kernels):
+        @staticmethod
+        def observe_jacobians(X_r, L, ctx=None):
+            calls.append(L.shape[0])
+            return observe_jacobians(X_r, L, ctx=ctx)
+
+    est.kernels = CountingKernels
+    est.range_bearing_scan_update(Y, [0, 1, 2])
+    assert calls == [3]
+
+    # same as the dense Kalman update with the stacked measurements
+    h, H_R, H_L = observe_jacobians(X[:3], X[3:].reshape(-1, 2))
+    H = np.zeros((6, 9))
+    for k in range(3):
+        H[2 * k:2 * k + 2, :3] = H_R[k]
+        H[2 * k:2 * k + 2, 3 + 2 * k:5 + 2 * k] = H_L[k]
+    z = (Y - h).ravel()
+    K = P @ H.T @ np.linalg.inv(H @ P @ H.T + np.kron(np.eye(3), est.R))
+    assert assert_allclose(est.X, X + K @ z, atol=1e-12) is None
+    assert assert_allclose(est.P, P - K @ H @ P, atol=1e-12) is None
+
+
+def test_batched_and_joint_updates_use_the_linearisation_of_subclasses():
+    calls = []
+
+    class Linearisation(EKFSLAM):
+        def _linearise_range_bearing(self, Y_meas, l):
+            calls.append(("range_bearing", l.shape[0]))
+            return super()._linearise_range_bearing(Y_meas, l)
+
+        def _linearise(self, model, Y_meas, l=None):
+            calls.append((type(model).__name__, Y_meas.shape[0]))
+            return super()._linearise(model, Y_meas, l)
+
+    est = Linearisation()
+    est.P = np.diag([0.1, 0.1, 0.01])
+    est.new_landmarks_range_bearing(np.array([[4., 0.3], [5., -0.2]]), [0, 1])
+    Y = np.array([[3.6, 0.35], [4.4, -0.25]])
+
+    est.measurement_update_range_bearing(Y[0], 0)
+    est.range_bearing_scan_update(Y, [0, 1])
+    est.joint_update([(RangeBearingModel(est.R), Y, [0, 1])])
+
+    assert calls == [("range_bearing", 1), ("range_bearing", 2), ("RangeBearingModel", 2)]
+
+
+def test_measurement_update_passes_the_memoised_pose_context_to_the_kernels():
+    est = EKFSLAM()
+    est.P = np.diag([0.1, 0.1, 0.01])
+    est.new_landmarks_range_bearing(np.array([[4., 0.3], [5., -0.2]]), [0, 1])
+    est.state_and_state_cov_propagation([0.5, np.deg2rad(3.)])
+    ctx = est.pose_context()
+
+    contexts = []
+    observe_jacobians = est.kernels.observe_jacobians
+
+    class RecordingKernels(est.kernels):
+        @staticmethod
+        def observe_jacobians(X_r, L, ctx=None):
+            contexts.append(ctx)
+            return observe_jacobians(X_r, L, ctx=ctx)
+
+    est.kernels = RecordingKernels
+    est.range_bearing_scan_update(np.array([[3.6, 0.35], [4.4, -0.25]]), [0, 1])
+
+    assert contexts == [ctx]
+    assert est.pose_context() is not ctx       # the update changed the pose
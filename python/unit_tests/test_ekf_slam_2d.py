@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HEAVY_MODULES = ["jax", "matplotlib", "sympy"]
+
+
+def run_import(module):
+    """
+    Import a module in a fresh interpreter (NumPy backend) and report which heavy modules it loaded
+
+    :param module: name of module to import
+    :return: list of heavy modules found in sys.modules after the import
+    """
+
+    env = dict(os.environ)
+    env.pop("USE_JAX", None)
+    code = "import sys; import {}; print(','.join(m for m in {} if m in sys.modules))".format(module, HEAVY_MODULES)
+    out = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env, check=True, capture_output=True,
+                         text=True).stdout.strip()
+
+    return [m for m in out.split(",") if m]
+
+
+@pytest.mark.parametrize("module", ["python.ekf_slam_2d", "python.lib.ekf", "python.lib.utils"])
+def test_import_does_not_load_jax_matplotlib_or_sympy(module):
+    assert run_import(module) == []
+
+
+def test_import_time_of_simulation_entry_point_is_small():
+    env = dict(os.environ)
+    env.pop("USE_JAX", None)
+
+    # -X importtime reports the cumulative import time [us] of each module on stderr
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import python.ekf_slam_2d"], cwd=REPO_ROOT,
+                         env=env, check=True, capture_output=True, text=True).stderr
+    times = {line.split("|")[2].strip(): int(line.split("|")[1]) for line in err.splitlines()
+             if line.startswith("import time:") and line.split("|")[1].strip().isdigit()}
+
+    # numpy dominates the remaining import time; the simulation modules themselves should add very little on top
+    assert times["python.ekf_slam_2d"] - times.get("numpy", 0) < 200000
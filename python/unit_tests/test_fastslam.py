@@ -0,0 +1,117 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+from python.lib.ekf import EKFSLAM
+from python.lib.fastslam import FastSLAM
+from python.lib.robot import move
+from python.lib.sensors import RangeBearingSensor
+
+
+def make_fastslam(num_particles=50, seed=0):
+    est = FastSLAM(num_particles=num_particles, seed=seed)
+    est.X = np.array([1., 2., np.deg2rad(30.)])
+    est.Q = np.diag([0.05 ** 2, np.deg2rad(1.) ** 2])
+    est.R = np.diag([0.1 ** 2, np.deg2rad(2.) ** 2])
+
+    return est
+
+
+def test_state_propagation_without_process_noise_moves_all_particles_like_robot_move():
+    est = make_fastslam()
+    est.Q = np.zeros((2, 2))
+    U = [0.5, np.deg2rad(10.)]
+
+    est.state_and_state_cov_propagation(U)
+
+    expected = move(np.array([1., 2., np.deg2rad(30.)]), U, [0., 0.])
+    assert assert_array_almost_equal(est.poses, np.tile(expected, (est.num_particles, 1))) is None
+    assert assert_array_almost_equal(est.X, expected) is None
+    assert est.num_steps == 1
+
+
+def test_landmark_update_with_known_robot_pose_matches_ekf_slam():
+    Y_new = np.array([[4., np.deg2rad(20.)], [5., np.deg2rad(-10.)]])
+    y = np.array([4.1, np.deg2rad(22.)])
+
+    fast = make_fastslam(num_particles=3)
+    fast.new_landmarks_range_bearing(Y_new, [0, 1])
+    fast.measurement_update_range_bearing(y, 0)
+
+    ekf = EKFSLAM()
+    ekf.X = fast.X[:3]
+    ekf.R = fast.R
+    ekf.new_landmarks_range_bearing(Y_new, [0, 1])
+    ekf.measurement_update_range_bearing(y, 0)
+
+    # with all particles at the (certain) robot pose, each particle's landmark EKF is the EKF-SLAM landmark estimate
+    assert assert_array_almost_equal(fast.X, ekf.X) is None
+    assert assert_array_almost_equal(fast.P, ekf.P) is None
+    assert fast.landmark_num_observations == {0: 2, 1: 1}
+
+
+def test_systematic_resampling_selects_particles_in_proportion_to_weights():
+    est = make_fastslam(num_particles=4)
+    est.poses[:, 0] = np.arange(4.)
+    est.log_weights = np.array([np.log(0.5), np.log(0.25), np.log(0.25), -np.inf])
+
+    est.resample()
+
+    assert_array_equal(np.sort(est.poses[:, 0]), [0., 0., 1., 2.])
+    assert assert_array_almost_equal(est.weights, np.full(4, 0.25)) is None
+
+
+def test_resampling_shares_landmarks_and_updates_copy_on_write():
+    est = make_fastslam(num_particles=6)
+    est.new_landmarks_range_bearing(np.array([[4., np.deg2rad(20.)], [5., np.deg2rad(-10.)]]), [0, 1])
+    est.log_weights = np.array([0.] + [-np.inf] * 5)
+    means = est.landmark_means[0].copy()
+    pool_size = est._means.shape[0]
+
+    est.resample()
+
+    # all particles now refer to the landmark entries of particle 0, without copying them
+    assert_array_equal(est._map_index[:, :2], np.tile(est._map_index[0, :2], (6, 1)))
+    assert_array_equal(est._refcounts[est._map_index[0, :2]], [6, 6])
+    assert est._means.shape[0] == pool_size
+
+    est.poses[:, 0] += np.linspace(-0.1, 0.1, 6)
+    est.measurement_update_range_bearing(np.array([4.1, np.deg2rad(22.)]), 0)
+
+    # landmark 0 was copied for each particle, landmark 1 is still shared
+    assert len(set(est._map_index[:, 0])) == 6
+    assert len(set(est._map_index[:, 1])) == 1
+    assert est._refcounts.sum() == 12
+    assert not np.allclose(est.landmark_means[:, 0], means[0])
+    assert assert_array_almost_equal(est.landmark_means[:, 1], np.tile(means[1], (6, 1))) is None
+
+
+def test_fastslam_tracks_robot_on_noisy_circle():
+    np.random.seed(3)
+    est = make_fastslam(num_particles=200, seed=1)
+    landmarks = np.array([[3., 4.], [-2., 5.], [0., -3.], [4., -1.]])
+    r_true = np.array([1., 2., np.deg2rad(30.)])
+    sigma_u = np.sqrt(np.diag(est.Q))
+    sigma_y = np.sqrt(np.diag(est.R))
+
+    for step in range(60):
+        U = np.array([0.1, np.deg2rad(6.)])
+        r_true = move(r_true, U, sigma_u * np.random.randn(2))
+        est.state_and_state_cov_propagation(U)
+
+        if step % 5 == 0:
+            Y = np.array([RangeBearingSensor.observe_range_bearing(r_true, l) for l in landmarks])
+            est.range_bearing_scan_update(Y + sigma_y * np.random.randn(*Y.shape), [0, 1, 2, 3])
+
+    X = est.X
+    assert np.linalg.norm(X[:2] - r_true[:2]) < 0.3
+    assert np.linalg.norm(X[3:].reshape(-1, 2) - landmarks, axis=1).max() < 0.5
+    assert est.P.shape == (11, 11)
+
+
+def test_new_landmark_without_id_gets_the_next_free_id():
+    est = FastSLAM(num_particles=10, seed=0)
+
+    assert est.new_landmark_range_bearing(np.array([2., 0.1])) == 0
+    est.new_landmarks_range_bearing(np.array([[3., 0.2]]), [5])
+    assert est.new_landmark_range_bearing(np.array([4., 0.3])) == 6
+    assert est.landmark_lookup == [0, 5, 6]
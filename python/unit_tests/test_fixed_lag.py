@@ -0,0 +1,102 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+
+from python.lib.ekf import EKFSLAM
+from python.lib.fixed_lag import FixedLagBuffer
+from python.lib.sensors import RangeBearingSensor as rbs
+
+
+def make_estimator():
+    est = EKFSLAM()
+    est.Q = np.array([[0.01, 0], [0, 0.001]])
+    est.R = np.array([[0.1 ** 2, 0], [0, np.deg2rad(2.) ** 2]])
+
+    return est
+
+
+def make_inputs():
+    """
+    Generate a sequence of timestamped controls (every 0.02 s) and measurements of two landmarks (every 0.1 s)
+    """
+
+    landmarks = np.array([[3., 2.], [5., -1.]])
+    r = np.array([0., 0., 0.])
+    inputs = []
+    for k in range(1, 31):
+        t = 0.02 * k
+        u = np.array([0.05, np.deg2rad(1.)])
+        r = np.array([r[0] + u[0] * np.cos(r[2] + u[1]), r[1] + u[0] * np.sin(r[2] + u[1]), r[2] + u[1]])
+        inputs.append(("control", t, u))
+        if k % 5 == 0:
+            for j in range(landmarks.shape[0]):
+                inputs.append(("measurement", t, (rbs.observe_range_bearing(r, landmarks[j]), j)))
+
+    return inputs
+
+
+def feed(buffer, inputs):
+    accepted = []
+    for kind, t, payload in inputs:
+        if kind == "control":
+            accepted.append(buffer.add_control(t, payload))
+        else:
+            accepted.append(buffer.add_measurement(t, *payload))
+
+    return accepted
+
+
+def test_late_measurements_give_same_estimate_as_in_order_inputs():
+    inputs = make_inputs()
+
+    in_order = FixedLagBuffer(make_estimator(), checkpoint_interval=0.02, max_checkpoints=50)
+    feed(in_order, inputs)
+
+    # delay each measurement by 3 controls
+    delayed = list(inputs)
+    for k in range(len(delayed) - 1, -1, -1):
+        if delayed[k][0] == "measurement":
+            delayed.insert(min(k + 4, len(delayed)), delayed.pop(k))
+
+    out_of_order = FixedLagBuffer(make_estimator(), checkpoint_interval=0.02, max_checkpoints=50)
+    assert all(feed(out_of_order, delayed))
+
+    assert out_of_order.estimator.landmark_lookup == in_order.estimator.landmark_lookup
+    assert assert_array_almost_equal(out_of_order.estimator.X, in_order.estimator.X) is None
+    assert assert_array_almost_equal(out_of_order.estimator.P, in_order.estimator.P) is None
+    assert out_of_order.time == in_order.time
+
+
+def test_late_control_is_replayed_in_order():
+    in_order = FixedLagBuffer(make_estimator())
+    in_order.add_control(0.1, [1., 0.1])
+    in_order.add_control(0.2, [1., -0.2])
+
+    out_of_order = FixedLagBuffer(make_estimator())
+    out_of_order.add_control(0.2, [1., -0.2])
+    out_of_order.add_control(0.1, [1., 0.1])
+
+    assert assert_array_almost_equal(out_of_order.estimator.X, in_order.estimator.X) is None
+    assert assert_array_almost_equal(out_of_order.estimator.P, in_order.estimator.P) is None
+
+
+def test_input_older_than_oldest_checkpoint_is_rejected():
+    buffer = FixedLagBuffer(make_estimator(), checkpoint_interval=0.1, max_checkpoints=3)
+    for k in range(1, 11):
+        buffer.add_control(0.1 * k, [0.1, 0.])
+    X = buffer.estimator.X.copy()
+
+    assert not buffer.add_measurement(0.15, np.array([2., 0.]), 0)
+    assert assert_array_almost_equal(buffer.estimator.X, X) is None
+    assert len(buffer.checkpoints) == 3
+
+
+def test_checkpoints_between_measurement_updates_only_store_robot_rows():
+    buffer = FixedLagBuffer(make_estimator(), checkpoint_interval=0.015, max_checkpoints=10)
+    buffer.add_measurement(0.02, np.array([2., 0.3]), 0)
+    buffer.add_control(0.04, [0.1, 0.])
+    buffer.add_control(0.06, [0.1, 0.])
+
+    full, delta_1, delta_2 = list(buffer.checkpoints)[-3:]
+    assert full.P is not None and full.base is None
+    assert delta_1.P is None and delta_1.base is full
+    assert delta_2.base is full and delta_2.P_rows.shape == (3, 5)
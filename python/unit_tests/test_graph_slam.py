@@ -0,0 +1,116 @@
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_almost_equal
+
+from python.lib.ekf import EKFSLAM
+from python.lib.graph_slam import GraphSLAM
+from python.lib.robot import move
+from python.lib.sensors import RangeBearingSensor
+
+
+LANDMARKS = np.array([[3., 4.], [-2., 5.], [0., -3.], [4., -1.], [6., 2.]])
+
+
+def record_run(num_steps=40, noise=True, seed=0):
+    rng = np.random.RandomState(seed)
+    Q = np.diag([0.05 ** 2, np.deg2rad(2.) ** 2])
+    R = np.diag([0.1 ** 2, np.deg2rad(2.) ** 2])
+    graph = GraphSLAM(Q, R)
+
+    r_true = np.zeros(3)
+    poses = [r_true]
+    for step in range(num_steps):
+        U = np.array([0.2, np.deg2rad(6.)])
+        r_true = np.asarray(move(r_true, U, np.zeros(2)))
+        poses.append(r_true)
+        U_meas = U + np.sqrt(np.diag(Q)) * rng.randn(2) if noise else U
+        graph.state_and_state_cov_propagation(U_meas)
+
+        if step % 4 == 3:
+            Y = np.array([RangeBearingSensor.observe_range_bearing(r_true, l) for l in LANDMARKS])
+            if noise:
+                Y = Y + np.sqrt(np.diag(R)) * rng.randn(*Y.shape)
+            graph.range_bearing_scan_update(Y, [10, 11, 12, 13, 14])
+
+    return graph, np.array(poses)
+
+
+def test_batch_motion_jacobians():
+    x_u, x_n, alpha_r, alpha_u, alpha_n = 0.3, 0.01, np.array([0.2, -2.5]), 0.1, -0.02
+
+    F_x = np.asarray(EKFSLAM.jacobian_f_X_r_batch(x_u, x_n, alpha_r, alpha_u, alpha_n))
+    F_n = np.asarray(EKFSLAM.jacobian_f_N_batch(x_u, x_n, alpha_r, alpha_u, alpha_n))
+    for k in range(2):
+        assert assert_array_almost_equal(
+            F_x[k], EKFSLAM.jacobian_f_X_r(x_u, x_n, alpha_r[k], alpha_u, alpha_n)) is None
+        assert assert_array_almost_equal(
+            F_n[k], EKFSLAM.jacobian_f_N(x_u, x_n, alpha_r[k], alpha_u, alpha_n)) is None
+
+
+def test_jacobian_matches_finite_differences():
+    graph, _ = record_run(num_steps=8)
+    poses = graph.poses + 0.05
+    landmarks = graph.landmarks - 0.1
+    x = np.concatenate([poses.ravel(), landmarks.ravel()])
+
+    W_odometry = graph._odometry_whitening(poses)
+
+    def errors(x):
+        return graph._linearise(x[:poses.size].reshape(-1, 3), x[poses.size:].reshape(-1, 2), W_odometry)[0]
+
+    J = graph._linearise(poses, landmarks, W_odometry)[1].toarray()
+    eps = 1e-6
+    J_numeric = np.stack([(errors(x + eps * e) - errors(x - eps * e)) / (2 * eps) for e in np.eye(x.size)], axis=1)
+
+    assert_allclose(J, J_numeric, rtol=1e-5, atol=1e-3)
+
+
+def test_recovers_noise_free_run_from_perturbed_guess():
+    for method in ("gn", "lm"):
+        for ordering in ("COLAMD", "MMD_AT_PLUS_A"):
+            graph, poses_true = record_run(noise=False)
+            poses_true[:, 2] = (poses_true[:, 2] + np.pi) % (2 * np.pi) - np.pi
+            rng = np.random.RandomState(1)
+            graph._poses[1:] = list(graph.poses[1:] + 0.1 * rng.randn(len(poses_true) - 1, 3))
+            graph._landmarks = list(graph.landmarks + 0.3 * rng.randn(*LANDMARKS.shape))
+
+            result = graph.optimise(method=method, ordering=ordering)
+
+            assert result["converged"]
+            assert result["cost"][-1] < 1e-12
+            assert assert_array_almost_equal(graph.poses, poses_true, decimal=5) is None
+            assert assert_array_almost_equal(graph.landmarks, LANDMARKS, decimal=5) is None
+
+
+def test_optimisation_reduces_error_of_noisy_run():
+    graph, poses_true = record_run(num_steps=80)
+    error_before = np.abs(graph.poses[:, :2] - poses_true[:, :2]).mean()
+
+    result = graph.optimise()
+
+    assert result["converged"]
+    assert all(np.diff(result["cost"]) <= 0)
+    assert np.abs(graph.poses[:, :2] - poses_true[:, :2]).mean() < error_before
+    # the minimum cost is about half the chi-square degrees of freedom (number of residuals minus number of states)
+    num_residuals = 3 + 3 * 80 + 2 * 5 * 20
+    dof = num_residuals - 3 * 81 - 2 * 5
+    assert 0.25 * dof < result["cost"][-1] < dof
+    assert assert_array_almost_equal(graph.X[:3], graph.poses[-1]) is None
+
+
+def test_gauss_newton_from_far_guess_never_increases_the_cost():
+    for scale, seed in ((0.5, 9), (0.8, 8), (1.2, 1), (1.2, 2)):
+        graph, poses_true = record_run(noise=False)
+        poses_true[:, 2] = (poses_true[:, 2] + np.pi) % (2 * np.pi) - np.pi
+        rng = np.random.RandomState(seed)
+        graph._poses[1:] = list(graph.poses[1:] + scale * rng.randn(len(poses_true) - 1, 3))
+        graph._landmarks = list(graph.landmarks + 3 * scale * rng.randn(*LANDMARKS.shape))
+
+        result = graph.optimise(method="gn")
+
+        # steps that would increase the cost are halved (or rejected), so a diverging step is never kept
+        assert all(np.diff(result["cost"]) <= 0)
+        if scale < 1:
+            # these starts diverged with full Gauss-Newton steps
+            assert result["converged"]
+            assert result["cost"][-1] < 1e-12
+            assert assert_array_almost_equal(graph.poses, poses_true, decimal=5) is None
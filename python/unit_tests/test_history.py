@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from python.lib.ekf import EKFSLAM
+from python.lib.history import HistoryRecorder, MirroredRingBuffer, merge_buckets, samples_to_buckets
+
+
+def make_estimator():
+    est = EKFSLAM()
+    est.X = np.zeros(3)
+    est.P = np.diag([0.01, 0.01, 0.001])
+    est.Q = np.diag([0.01, 0.001])
+    est.R = np.diag([0.01, 0.001])
+
+    return est
+
+
+def test_mirrored_ring_buffer_view_is_in_order_and_not_a_copy():
+    ring = MirroredRingBuffer(4, np.dtype([("value", np.int64)]))
+    evicted = [ring.append((k,)) for k in range(10)]
+
+    view = ring.view()
+    assert_array_equal(view["value"], [6, 7, 8, 9])
+    assert np.shares_memory(view, ring._buf)
+    assert not view.flags.writeable
+    assert [e["value"] for e in evicted if e is not None] == [0, 1, 2, 3, 4, 5]
+
+
+def test_history_records_estimator_steps_with_decimation():
+    est = make_estimator()
+    est.history = HistoryRecorder(capacity=100, decimation=2, landmark_ids=[5, 9])
+
+    est.state_and_state_cov_propagation([0.1, 0.])
+    est.new_landmark_range_bearing(np.array([2., 0.5]), landmark_id=9)
+    est.state_and_state_cov_propagation_many([[0.1, 0.]] * 4)
+
+    samples = est.history.samples()
+    assert_array_equal(samples["step"], [0, 2, 4])
+    assert_allclose(samples["pose"][-1], [0.4, 0., 0.])
+    assert np.isnan(samples["landmarks"][:, 0]).all()
+    assert np.isnan(samples["landmarks"][0, 1]).all()
+    assert_allclose(samples["landmarks"][-1, 1], est.X[3:5])
+    assert_allclose(samples["P_rr"][0], np.diag([0.01, 0.01, 0.001]))
+
+
+def test_merge_buckets_matches_statistics_of_the_samples():
+    est = make_estimator()
+    history = HistoryRecorder(capacity=10, landmark_ids=[0])
+    rng = np.random.RandomState(0)
+    for step in range(10):
+        est.X = np.concatenate([rng.randn(3), rng.randn(2)]) if step >= 3 else rng.randn(3)
+        est.landmark_lookup = [0] if step >= 3 else []
+        history.record(est, step=step)
+
+    samples = history.samples()
+    buckets = samples_to_buckets(samples, 1)
+    merged = merge_buckets(np.concatenate([merge_buckets(buckets[:4])[None], merge_buckets(buckets[4:])[None]]))
+
+    assert merged["step_first"] == 0 and merged["step_last"] == 9 and merged["count"] == 10
+    assert_allclose(merged["pose_mean"], samples["pose"].mean(axis=0))
+    assert_allclose(merged["pose_min"], samples["pose"].min(axis=0))
+    assert_allclose(merged["pose_max"], samples["pose"].max(axis=0))
+    assert_array_equal(merged["landmarks_count"], [7])
+    assert_allclose(merged["landmarks_mean"], samples["landmarks"][3:].mean(axis=0))
+
+
+def test_long_run_memory_is_bounded_and_old_data_is_downsampled_and_spilled(tmp_path):
+    est = make_estimator()
+    path = os.path.join(str(tmp_path), "history.bin")
+    history = HistoryRecorder(capacity=8, bucket_size=4, num_levels=3, level_capacity=2, spill_path=path)
+    nbytes = history.nbytes
+
+    for step in range(100):
+        est.X = np.array([step, 0., 0.])
+        history.record(est, step=step)
+
+    assert history.nbytes == nbytes
+    assert_array_equal(history.samples()["step"], np.arange(92, 100))
+
+    # level 1: buckets of 4 samples, level 2: buckets of 4 level 1 buckets
+    level_1 = history.buckets(1)
+    assert_array_equal(level_1["step_first"], [84, 88])
+    assert_array_equal(level_1["count"], [4, 4])
+    assert_allclose(level_1["pose_mean"][:, 0], [85.5, 89.5])
+
+    level_2 = history.buckets(2)
+    assert_array_equal(level_2["step_first"], [48, 64])
+    assert_array_equal(level_2["step_last"], [63, 79])
+    assert_allclose(level_2["pose_min"][:, 0], [48, 64])
+    assert_allclose(level_2["pose_max"][:, 0], [63, 79])
+
+    # buckets 80-83 wait for 3 more level 1 buckets before they are merged into level 2
+    spilled = history.spilled()
+    assert_array_equal(spilled["step_first"], [0, 16, 32])
+    assert_array_equal(spilled["count"], [16, 16, 16])
+    history.close()
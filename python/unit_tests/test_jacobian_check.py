@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from python.lib import backend
+from python.lib.jacobian_check import JacobianCase, check_case, check_jacobians, sample_points
+from python.lib.sensors import RangeBearingSensor
+
+pytestmark = pytest.mark.skipif(not backend.USE_JAX, reason="needs USE_JAX=True (and JAX_ENABLE_X64=True)")
+
+
+def test_analytic_jacobians_match_auto_diff_at_thousands_of_points():
+    reports = check_jacobians(num_points=2000, seed=1)
+
+    assert len(reports) == 12
+    for report in reports:
+        assert report.num_points == 2000
+        assert report.max_error < 1e-9, report
+
+
+def test_check_reports_where_a_wrong_jacobian_is_wrong():
+    points = sample_points(500, seed=2)
+
+    def wrong_jacobian(p):
+        H = RangeBearingSensor.jacobian_H_L_i_batch(p["X_r"], p["L"])
+        return H.at[123, 1, 0].add(1e-3)
+
+    report = check_case(JacobianCase("wrong", RangeBearingSensor.observe_range_bearing, ("X_r", "L"), 1,
+                                     wrong_jacobian), points)
+
+    assert np.isclose(report.max_error, 1e-3)
+    assert report.index == 123
+    assert report.entry == (1, 0)
+    assert np.array_equal(report.point["L"], points["L"][123])
+    assert report.analytic_time > 0 and report.autodiff_time > 0
+
+
+def test_sampled_landmarks_are_away_from_the_robot():
+    points = sample_points(1000)
+    ranges = np.linalg.norm(points["L"] - points["X_r"][:, :2], axis=1)
+
+    assert ranges.min() >= 0.5
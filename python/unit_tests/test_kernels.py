@@ -0,0 +1,88 @@
+import sys
+
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+import pytest
+
+from python.lib.ekf import EKFSLAM
+from python.lib.kernels import NumpyKernels, get_kernels
+from python.lib.sensors import RangeBearingSensor as rbs
+
+
+def make_test_points():
+    X_r = np.array([1.5, -0.5, np.deg2rad(160.)])
+    L = np.array([[4., 2.], [-3., 1.], [1., -6.], [-2., -2.5]])
+
+    return X_r, L
+
+
+def test_numpy_observe_jacobians_match_range_bearing_sensor():
+    X_r, L = make_test_points()
+
+    h, H_R, H_L = NumpyKernels.observe_jacobians(X_r, L)
+
+    for k in range(L.shape[0]):
+        kwargs = dict(x_r=X_r[0], y_r=X_r[1], alpha_r=X_r[2], l_i_x=L[k, 0], l_i_y=L[k, 1])
+        assert assert_array_almost_equal(h[k], rbs.observe_range_bearing(X_r, L[k])) is None
+        assert assert_array_almost_equal(H_R[k], rbs.jacobian_H_X_r(**kwargs)) is None
+        assert assert_array_almost_equal(H_L[k], rbs.jacobian_H_L_i(**kwargs)) is None
+
+
+def test_numpy_innovation_wraps_bearing():
+    Y = np.array([[2., np.deg2rad(170.)]])
+    h = np.array([[1.5, np.deg2rad(-170.)]])
+
+    assert assert_array_almost_equal(NumpyKernels.innovation(Y, h), [[0.5, np.deg2rad(-20.)]]) is None
+
+
+def test_numba_kernels_match_numpy_kernels():
+    pytest.importorskip("numba")
+    kernels = get_kernels("numba")
+    X_r, L = make_test_points()
+
+    for actual, expected in zip(kernels.observe_jacobians(X_r, L), NumpyKernels.observe_jacobians(X_r, L)):
+        assert assert_array_almost_equal(actual, expected) is None
+
+    Y = np.array([[2., np.deg2rad(170.)], [1., 0.]])
+    h = np.array([[1.5, np.deg2rad(-170.)], [1.2, 0.1]])
+    assert assert_array_almost_equal(kernels.innovation(Y, h), NumpyKernels.innovation(Y, h)) is None
+
+    A = np.random.RandomState(0).randn(9, 9)
+    W = np.random.RandomState(1).randn(9, 2)
+    P, P_expected = np.dot(A, A.T), np.dot(A, A.T)
+    kernels.symmetric_rank_update(P, W)
+    NumpyKernels.symmetric_rank_update(P_expected, W)
+    assert assert_array_almost_equal(P, P_expected) is None
+
+
+def test_get_kernels_falls_back_to_numpy_if_numba_is_not_installed(monkeypatch):
+    monkeypatch.setitem(sys.modules, "numba", None)
+    monkeypatch.delitem(sys.modules, "python.lib.kernels_numba", raising=False)
+
+    with pytest.warns(UserWarning):
+        assert get_kernels("numba") is NumpyKernels
+    assert get_kernels("auto") is NumpyKernels
+
+
+def test_get_kernels_uses_environment_variable(monkeypatch):
+    monkeypatch.setenv("EKF_KERNELS", "numpy")
+    assert get_kernels() is NumpyKernels
+
+    monkeypatch.setenv("EKF_KERNELS", "fortran")
+    with pytest.raises(ValueError):
+        get_kernels()
+
+
+def test_ekf_measurement_update_with_numba_kernels_matches_numpy_kernels():
+    pytest.importorskip("numba")
+    estimators = []
+    for kernels in ("numpy", "numba"):
+        est = EKFSLAM(kernels=kernels)
+        est.P = np.diag([0.1, 0.1, 0.01])
+        est.new_landmarks_range_bearing(np.array([[4., np.deg2rad(20.)], [5., np.deg2rad(-10.)]]), [0, 1])
+        est.state_and_state_cov_propagation([0.5, np.deg2rad(3.)])
+        est.range_bearing_scan_update(np.array([[3.6, np.deg2rad(18.)], [5.1, np.deg2rad(-12.)]]), [0, 1])
+        estimators.append(est)
+
+    assert assert_array_almost_equal(estimators[1].X, estimators[0].X) is None
+    assert assert_array_almost_equal(estimators[1].P, estimators[0].P) is None
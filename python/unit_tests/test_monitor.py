@@ -0,0 +1,85 @@
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_array_equal
+
+from python.lib.ekf import EKFSLAM
+from python.lib.monitor import ConsistencyMonitor, RingBuffer, chi2_quantile
+from python.lib.sensors import RangeBearingSensor
+
+
+def test_chi2_quantile_matches_tabulated_values():
+    assert_almost_equal(chi2_quantile(0.99, 2), 9.2103, decimal=3)
+    assert abs(chi2_quantile(0.99, 3) - 11.345) < 0.05
+    assert abs(chi2_quantile(0.005, 200) - 152.24) < 0.1
+    assert abs(chi2_quantile(0.995, 200) - 255.26) < 0.1
+
+
+def test_ring_buffer_keeps_most_recent_values_and_their_sum():
+    buffer = RingBuffer(3)
+    for value in [1., 2., 3., 4., 5.]:
+        buffer.append(value)
+
+    assert len(buffer) == 3
+    assert_array_equal(buffer.to_array(), [3., 4., 5.])
+    assert buffer.total == 12.
+
+
+def test_ekf_update_records_normalised_innovation_squared():
+    est = EKFSLAM()
+    est.P = np.diag([0.1, 0.1, 0.01])
+    est.R = np.diag([0.1 ** 2, np.deg2rad(2.) ** 2])
+    est.new_landmark_range_bearing(np.array([4., np.deg2rad(20.)]), 0)
+    est.state_and_state_cov_propagation([0.5, np.deg2rad(3.)])
+    est.monitor = ConsistencyMonitor()
+    X, P = est.X.copy(), est.P.copy()
+    y = np.array([3.6, np.deg2rad(18.)])
+
+    est.measurement_update_range_bearing(y, 0)
+
+    H = np.zeros((2, 5))
+    H[:, :3] = RangeBearingSensor.jacobian_H_X_r(X[0], X[1], X[2], X[3], X[4])
+    H[:, 3:] = RangeBearingSensor.jacobian_H_L_i(X[0], X[1], X[2], X[3], X[4])
+    z = y - RangeBearingSensor.observe_range_bearing(X[:3], X[3:])
+    Z = np.dot(np.dot(H, P), H.T) + est.R
+
+    assert len(est.monitor.nis) == 1
+    assert_almost_equal(est.monitor.mean_nis(), np.dot(z, np.linalg.solve(Z, z)))
+
+
+def test_monitor_alerts_when_values_exceed_chi_square_bounds():
+    alerts = []
+    monitor = ConsistencyMonitor(window=10, on_alert=alerts.append)
+
+    monitor.record_whitened_innovation(np.array([0.5, -0.3]), step=1)
+    assert alerts == []
+
+    monitor.record_whitened_innovation(np.array([4., 3.]), step=2)
+    assert [(alert.step, alert.kind) for alert in alerts] == [(2, "nis")]
+
+    # a window of tiny innovations means the filter is too pessimistic
+    for step in range(10):
+        monitor.record_whitened_innovation(np.array([0.01, 0.01]), step=3 + step)
+    assert alerts[-1].kind == "nis_window"
+    assert alerts[-1].value < alerts[-1].lower
+
+
+def test_monitor_nees_of_consistent_errors_is_within_bounds():
+    rng = np.random.RandomState(0)
+    monitor = ConsistencyMonitor(window=200)
+    P_rr = np.diag([0.04, 0.09, 0.01])
+
+    for step in range(200):
+        monitor.record_pose_error(rng.multivariate_normal(np.zeros(3), P_rr), P_rr, step)
+
+    lower, upper = monitor.bounds(600, 200)
+    assert lower <= monitor.mean_nees() <= upper
+    assert not any(alert.kind == "nees_window" for alert in monitor.alerts)
+
+
+def test_monitor_nees_uses_rank_of_singular_pose_covariance():
+    monitor = ConsistencyMonitor()
+
+    nees = monitor.record_pose_error([0.2, 0.1, 0.], np.diag([0.04, 0.01, 0.]))
+
+    assert_almost_equal(nees, 2.)
+    assert monitor.nees_dof.total == 2
+    assert np.isnan(monitor.record_pose_error([0.2, 0.1, 0.], np.zeros((3, 3))))
@@ -2,7 +2,7 @@ from numpy.testing import assert_array_equal, assert_array_almost_equal
 import numpy as np
 from pytest import mark
 
-from python.lib.robot import move
+from python.lib.robot import move, move_batch
 
 
 # @mark.skip(reason="Getting other tests working first")
@@ -70,3 +70,14 @@ def test_robot_move_right_from_non_zero_position_and_45_deg_angle_when_applying_
     r_new = move(r, u, n)
 
     assert assert_array_equal(r_new, np.array([1.+1./np.sqrt(2), 3.-1./np.sqrt(2), np.deg2rad(-45.)])) is None
+
+
+def test_robot_move_batch_matches_moving_each_robot():
+    R = np.array([[0., 0., 0.], [1., -2., np.deg2rad(30.)], [-3., 4., np.deg2rad(-100.)]])
+    u = np.array([0.5, np.deg2rad(10.)])
+    N = np.array([[0.1, 0.], [-0.05, np.deg2rad(2.)], [0., np.deg2rad(-5.)]])
+
+    R_new = move_batch(R, u, N)
+
+    for m in range(R.shape[0]):
+        assert assert_array_almost_equal(R_new[m], move(R[m], u, N[m])) is None
@@ -0,0 +1,79 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+
+from python.lib.ekf import EKFSLAM
+from python.lib.robot import move
+from python.lib.scheduler import Scheduler
+from python.lib.sensors import RangeBearingSensor as rbs
+
+LANDMARKS = np.array([[3., 2.], [5., -1.], [-2., 4.]])
+
+
+def make_estimator():
+    est = EKFSLAM()
+    est.Q = np.array([[0.01, 0], [0, 0.001]])
+    est.R = np.array([[0.1 ** 2, 0], [0, np.deg2rad(2.) ** 2]])
+
+    return est
+
+
+def read_odometry(t):
+    return [0.04, np.deg2rad(0.5)]
+
+
+def test_scheduler_runs_sources_at_their_own_rates():
+    times = {"control": [], "measurement": []}
+
+    def read_control(t):
+        times["control"].append(t)
+        return read_odometry(t)
+
+    def read_measurements(t):
+        times["measurement"].append(t)
+        return np.zeros((0, 2)), []
+
+    scheduler = Scheduler(make_estimator())
+    scheduler.add_control_source(0.02, read_control, offset=0.02)
+    scheduler.add_measurement_source(0.5, read_measurements, offset=0.5)
+    scheduler.run(until=2.)
+
+    assert len(times["control"]) == 100
+    assert assert_array_almost_equal(times["measurement"], [0.5, 1., 1.5, 2.]) is None
+    assert scheduler.estimator.num_steps == 100
+
+
+def read_measurements(t):
+    """
+    Range-bearing measurements of all landmarks from the true robot pose at time t
+    """
+
+    r = np.array([0., 0., 0.])
+    for _ in range(int(round(t / 0.02))):
+        r = move(r, read_odometry(None), [0., 0.])
+
+    return np.array([rbs.observe_range_bearing(r, l) for l in LANDMARKS]), [0, 1, 2]
+
+
+def test_scheduler_coalesced_predictions_match_propagating_every_control():
+    updates = []
+    scheduler = Scheduler(make_estimator(), on_update=lambda t, est: updates.append(t))
+    scheduler.add_control_source(0.02, read_odometry, offset=0.02)
+    scheduler.add_measurement_source(0.1, read_measurements, offset=0.1)
+    scheduler.run(until=0.5)
+
+    # reference: propagate on every control and update on every 5th control
+    est = make_estimator()
+    for k in range(1, 26):
+        est.state_and_state_cov_propagation(read_odometry(0.02 * k))
+        if k % 5 == 0:
+            Y, landmark_ids = read_measurements(0.02 * k)
+            if est.landmark_lookup:
+                for y, landmark_id in zip(Y, landmark_ids):
+                    est.measurement_update_range_bearing(y, est.get_landmark_index(landmark_id))
+            else:
+                est.new_landmarks_range_bearing(Y, landmark_ids)
+
+    assert assert_array_almost_equal(updates, [0.1, 0.2, 0.3, 0.4, 0.5]) is None
+    assert scheduler.estimator.landmark_lookup == [0, 1, 2]
+    assert assert_array_almost_equal(scheduler.estimator.X, est.X) is None
+    assert assert_array_almost_equal(scheduler.estimator.P, est.P) is None
@@ -0,0 +1,166 @@
+import numpy as np
+from numpy.testing import assert_allclose
+import pytest
+
+from python.lib.ekf import EKFSLAM
+from python.lib.sensor_models import BearingOnlyModel, PositionModel, RangeBearingModel, RangeOnlyModel
+
+
+def make_estimator():
+    est = EKFSLAM()
+    est.X = np.array([1., 2., 0.4])
+    est.P = np.diag([0.04, 0.03, 0.01])
+    est.Q = np.diag([0.01, 0.001])
+    est.R = np.diag([0.1 ** 2, np.deg2rad(2.) ** 2])
+    est.new_landmarks_range_bearing(np.array([[5., 0.3], [4., -1.2], [7., 2.]]), [10, 11, 12])
+    est.state_and_state_cov_propagation([0.5, 0.1])
+
+    return est
+
+
+def numerical_jacobian(f, x, eps=1e-6):
+    return np.stack([(np.asarray(f(x + eps * e)) - np.asarray(f(x - eps * e))) / (2 * eps) for e in np.eye(x.size)],
+                    axis=-1)
+
+
+@pytest.mark.parametrize("model", [RangeBearingModel(np.eye(2)), BearingOnlyModel(1.), RangeOnlyModel(1.),
+                                   PositionModel(np.eye(2))])
+def test_sensor_model_jacobians_match_finite_differences(model):
+    X_r = np.array([1., -2., 2.8])
+    L = np.array([[4., 3.], [-2., 1.]])
+
+    H_R, H_L = model.jacobians(X_r, L)
+    for k in range(L.shape[0]):
+        assert_allclose(np.asarray(H_R)[k] if np.ndim(H_R) == 3 else H_R,
+                        numerical_jacobian(lambda x: model.observe(x, L[k]), X_r), atol=1e-8)
+        if model.observes_landmarks:
+            assert_allclose(np.asarray(H_L)[k], numerical_jacobian(lambda l: model.observe(X_r, l), L[k]), atol=1e-8)
+
+    if model.initialises_landmarks:
+        Y = np.asarray(model.observe(X_r, L))
+        assert_allclose(model.inverse_observe(X_r, Y), L)
+        G_r, G_y = model.inverse_jacobians(X_r, Y)
+        assert_allclose(np.asarray(G_y)[0], numerical_jacobian(lambda y: model.inverse_observe(X_r, y), Y[0]),
+                        atol=1e-8)
+
+
+def test_joint_update_with_one_measurement_matches_range_bearing_update():
+    est, joint = make_estimator(), make_estimator()
+    y = np.array([4.3, -1.1])
+
+    est.measurement_update_range_bearing(y, 1)
+    joint.joint_update([(RangeBearingModel(joint.R), y[None], [11])])
+
+    assert_allclose(joint.X, est.X, atol=1e-12)
+    assert_allclose(joint.P, est.P, atol=1e-12)
+
+
+def test_joint_update_matches_dense_kalman_update_with_stacked_measurements():
+    est = make_estimator()
+    X, P = np.array(est.X), np.array(est.P)
+    models = [RangeBearingModel(est.R), BearingOnlyModel(np.deg2rad(1.) ** 2), RangeOnlyModel(0.2 ** 2),
+              PositionModel(np.diag([0.5, 0.5]))]
+    measurements = [(models[0], np.array([[4.9, 0.2]]), [10]),
+                    (models[1], np.array([[-0.9], [1.7]]), [11, 12]),
+                    (models[2], np.array([[6.5]]), [12]),
+                    (models[3], np.array([1.6, 2.1]), None)]
+
+    # dense H over all states
+    H, z, R = [], [], []
+    for model, Y, ids in measurements:
+        Y = Y.reshape(-1, model.dim)
+        for k in range(Y.shape[0]):
+            H_k = np.zeros((model.dim, X.shape[0]))
+            if ids is None:
+                h, (H_R, _) = model.observe(X[:3]), model.jacobians(X[:3])
+            else:
+                l = 3 + 2 * est.get_landmark_index(ids[k])
+                h, (H_R, H_L) = model.observe(X[:3], X[l:l + 2]), model.jacobians(X[:3], X[l:l + 2])
+                H_k[:, l:l + 2] = np.asarray(H_L)
+            H_k[:, :3] = np.asarray(H_R)
+            z_k = np.array(Y[k] - h)
+            for a in model.angles:
+                z_k[a] = (z_k[a] + np.pi) % (2 * np.pi) - np.pi
+            H.append(H_k)
+            z.append(z_k)
+            R.append(np.asarray(model.R))
+    H, z = np.concatenate(H), np.concatenate(z)
+    R_full = np.zeros((z.shape[0], z.shape[0]))
+    start = 0
+    for R_k in R:
+        R_full[start:start + R_k.shape[0], start:start + R_k.shape[0]] = R_k
+        start += R_k.shape[0]
+    K = P @ H.T @ np.linalg.inv(H @ P @ H.T + R_full)
+
+    skipped = est.joint_update(measurements)
+
+    assert skipped == []
+    assert_allclose(est.X, X + K @ z, atol=1e-10)
+    assert_allclose(est.P, P - K @ H @ P, atol=1e-10)
+
+
+def test_joint_update_of_linear_measurements_matches_sequential_updates():
+    est, joint = make_estimator(), make_estimator()
+    gps_1, gps_2 = PositionModel(np.diag([0.3, 0.2])), PositionModel(np.diag([0.1, 0.4]))
+
+    est.joint_update([(gps_1, np.array([1.5, 2.2]), None)])
+    est.joint_update([(gps_2, np.array([1.4, 2.4]), None)])
+    joint.joint_update([(gps_1, np.array([1.5, 2.2]), None), (gps_2, np.array([1.4, 2.4]), None)])
+
+    assert_allclose(joint.X, est.X, atol=1e-12)
+    assert_allclose(joint.P, est.P, atol=1e-12)
+
+
+def test_joint_update_adds_new_landmarks_it_can_initialise_and_skips_others():
+    est, expected = make_estimator(), make_estimator()
+    Y = np.array([[3., 0.5], [6., -0.4]])
+
+    skipped = est.joint_update([(RangeBearingModel(est.R), Y, [20, 21]),
+                                (BearingOnlyModel(0.01), np.array([[0.1]]), [30])])
+    expected.new_landmarks_range_bearing(Y, [20, 21])
+
+    assert skipped == [30]
+    assert est.landmark_lookup == [10, 11, 12, 20, 21]
+    assert_allclose(est.X, expected.X)
+    assert_allclose(est.P, expected.P)
+
+
+def test_joint_update_initialises_a_landmark_seen_by_two_sensors_once():
+    est, expected = make_estimator(), make_estimator()
+    y_1, y_2 = np.array([3., 0.5]), np.array([3.1, 0.52])
+
+    skipped = est.joint_update([(RangeBearingModel(est.R), y_1[None], [20]),
+                                (RangeBearingModel(2 * est.R), y_2[None], [20]),
+                                (RangeOnlyModel(0.01), np.array([[3.]]), [20])])
+    expected.new_landmarks_range_bearing(y_1[None], [20])
+
+    assert skipped == []
+    assert est.landmark_lookup == [10, 11, 12, 20]
+    assert_allclose(est.X, expected.X)
+    assert_allclose(est.P, expected.P)
+
+
+def test_joint_update_checks_all_measurements_before_updating():
+    est, expected = make_estimator(), make_estimator()
+
+    with pytest.raises(ValueError):
+        est.joint_update([(RangeBearingModel(est.R), np.array([[3., 0.5]]), [10]),
+                          (RangeBearingModel(est.R), np.array([[3., 0.5]]), [20, 21])])
+
+    assert est.landmark_lookup == expected.landmark_lookup
+    assert_allclose(est.X, expected.X)
+    assert_allclose(est.P, expected.P)
+
+
+def test_joint_update_only_records_observations_after_the_update():
+    est = make_estimator()
+    num_observations = dict(est.landmark_num_observations)
+
+    # the innovation covariance is not positive definite, so its Cholesky factorisation fails
+    with pytest.raises(np.linalg.LinAlgError):
+        est.joint_update([(RangeOnlyModel(-100.), np.array([[3.]]), [10])])
+
+    assert est.landmark_num_observations == num_observations
+
+    est.joint_update([(RangeOnlyModel(0.01), np.array([[3.]]), [10])])
+    assert est.landmark_num_observations[10] == num_observations[10] + 1
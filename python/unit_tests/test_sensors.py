@@ -1,16 +1,9 @@
-# import numpy as np
-import os
-if os.environ.get("USE_JAX", False):
-    import jax.numpy as np
-    from jax.config import config
-    # check that JAX is set to 64-bit precision
-    assert config.values["jax_enable_x64"]
-else:
-    import numpy as np
+from python.lib.backend import np
 from numpy.testing import assert_almost_equal, assert_array_almost_equal
 import jax
 
 from python.lib.sensors import RangeBearingSensor as rbs
+from python.lib.transforms import PoseContext
 
 
 def test_observe_range_bearing_when_robot_is_at_origin_and_landmark_is_directly_in_front():
@@ -124,3 +117,66 @@ def test_jacobian_G_y_i_at_specific_test_points_compared_to_auto_diff():
     J = jax.jacfwd(f, argnums=1)(X, p_local_polar)
 
     assert assert_array_almost_equal(J, G_x) is None
+
+
+def test_batch_inverse_observation_and_jacobians_match_single_landmark_versions():
+    X = np.array([23.5, -14.6, np.deg2rad(45.)])
+    Y = np.array([[11.6, .25], [3., -1.2], [0.5, 3.]])    # range-bearing measurements
+
+    L = rbs.inv_observe_range_bearing_batch(X, Y)
+    G_x = rbs.jacobian_G_X_r_batch(X, Y)
+    G_y = rbs.jacobian_G_y_i_batch(X, Y)
+
+    assert L.shape == (3, 2)
+    assert G_x.shape == (3, 2, 3)
+    assert G_y.shape == (3, 2, 2)
+
+    for k in range(Y.shape[0]):
+        rho, psi = Y[k]
+        assert assert_array_almost_equal(L[k], rbs.inv_observe_range_bearing(X, Y[k])) is None
+        assert assert_array_almost_equal(G_x[k], rbs.jacobian_G_X_r(X[0], X[1], X[2], rho, psi)) is None
+        assert assert_array_almost_equal(G_y[k], rbs.jacobian_G_y_i(X[0], X[1], X[2], rho, psi)) is None
+
+
+def test_batch_observation_and_jacobians_match_single_landmark_versions():
+    X = np.array([[23.5, -14.6, np.deg2rad(45.)], [20., -10., np.deg2rad(-170.)]])
+    L = np.array([[30., -5.], [18., -11.5]])
+
+    Y = rbs.observe_range_bearing_batch(X[:, None], L)
+    H_x = rbs.jacobian_H_X_r_batch(X[:, None], L)
+    H_l = rbs.jacobian_H_L_i_batch(X[:, None], L)
+
+    assert Y.shape == (2, 2, 2)
+    assert H_x.shape == (2, 2, 2, 3)
+    assert H_l.shape == (2, 2, 2, 2)
+
+    for m in range(X.shape[0]):
+        for k in range(L.shape[0]):
+            x_r, y_r, alpha_r = X[m]
+            assert assert_array_almost_equal(Y[m, k], rbs.observe_range_bearing(X[m], L[k])) is None
+            assert assert_array_almost_equal(H_x[m, k], rbs.jacobian_H_X_r(x_r, y_r, alpha_r, L[k, 0], L[k, 1])) is None
+            assert assert_array_almost_equal(H_l[m, k], rbs.jacobian_H_L_i(x_r, y_r, alpha_r, L[k, 0], L[k, 1])) is None
+
+
+def test_functions_with_pose_context_match_functions_without_it():
+    X = np.array([23.5, -14.6, np.deg2rad(135.)])
+    ctx = PoseContext(X)
+    L = np.array([[30., -5.], [18., -11.5]])
+
+    for k in range(L.shape[0]):
+        l_x, l_y = L[k]
+        y = rbs.observe_range_bearing(X, L[k])
+        rho, psi = y
+        assert assert_array_almost_equal(rbs.observe_range_bearing(X, L[k], ctx=ctx), y) is None
+        assert assert_array_almost_equal(rbs.inv_observe_range_bearing(X, y, ctx=ctx), L[k]) is None
+        assert assert_array_almost_equal(rbs.jacobian_H_X_r(X[0], X[1], X[2], l_x, l_y, ctx=ctx),
+                                         rbs.jacobian_H_X_r(X[0], X[1], X[2], l_x, l_y)) is None
+        assert assert_array_almost_equal(rbs.jacobian_H_L_i(X[0], X[1], X[2], l_x, l_y, ctx=ctx),
+                                         rbs.jacobian_H_L_i(X[0], X[1], X[2], l_x, l_y)) is None
+        assert assert_array_almost_equal(rbs.jacobian_G_X_r(X[0], X[1], X[2], rho, psi, ctx=ctx),
+                                         rbs.jacobian_G_X_r(X[0], X[1], X[2], rho, psi)) is None
+        assert assert_array_almost_equal(rbs.jacobian_G_y_i(X[0], X[1], X[2], rho, psi, ctx=ctx),
+                                         rbs.jacobian_G_y_i(X[0], X[1], X[2], rho, psi)) is None
+
+    assert assert_array_almost_equal(rbs.observe_range_bearing_batch(X, L, ctx=ctx),
+                                     rbs.observe_range_bearing_batch(X, L)) is None
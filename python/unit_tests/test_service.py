@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+
+from python.lib.ekf import EKFSLAM
+from python.lib.robot import move
+from python.lib.sensor_models import RangeBearingModel
+from python.lib.sensors import RangeBearingSensor as rbs
+from python.lib.service import EstimatorService, iter_file_lines, start_replay_server
+
+LANDMARKS = np.array([[3., 2.], [5., -1.], [-2., 4.]])
+
+
+def make_estimator():
+    est = EKFSLAM()
+    est.Q = np.array([[0.01, 0], [0, 0.001]])
+    est.R = np.array([[0.1 ** 2, 0], [0, np.deg2rad(2.) ** 2]])
+
+    return est
+
+
+def write_messages(path, num_steps=50):
+    """
+    Write controls every 0.02 s and measurements of all landmarks every 0.1 s
+    """
+
+    r = np.array([0., 0., 0.])
+    messages = []
+    for k in range(1, num_steps + 1):
+        u = [0.04, np.deg2rad(1.)]
+        r = move(r, u, [0., 0.])
+        messages.append({"type": "control", "t": 0.02 * k, "u": u})
+        if k % 5 == 0:
+            messages.append({"type": "measurement", "t": 0.02 * k, "ids": [0, 1, 2],
+                             "y": [rbs.observe_range_bearing(r, l).tolist() for l in LANDMARKS]})
+
+    with open(path, "w") as f:
+        for message in messages:
+            f.write(json.dumps(message) + "\n")
+
+    return messages
+
+
+def reference_estimate(messages):
+    est = make_estimator()
+    for message in messages:
+        if message["type"] == "control":
+            est.state_and_state_cov_propagation(message["u"])
+        else:
+            est.range_bearing_scan_update(np.array(message["y"]), message["ids"])
+
+    return est
+
+
+def test_service_fed_from_file_matches_applying_messages_in_order(tmp_path):
+    path = str(tmp_path / "messages.jsonl")
+    messages = write_messages(path)
+    published = []
+
+    with EstimatorService(make_estimator(), tick=0.001, max_queue_size=4, publish_period=1e6,
+                          publish=published.append) as service:
+        asyncio.run(service.run(iter_file_lines(path, batch_size=7)))
+
+    est = reference_estimate(messages)
+    assert service.num_messages == len(messages)
+    assert assert_array_almost_equal(service.estimator.X, est.X) is None
+    assert assert_array_almost_equal(service.estimator.P, est.P) is None
+
+    # rate limited: the first batch, and the final estimate
+    assert len(published) == 2
+    assert published[-1]["t"] == messages[-1]["t"]
+    assert sorted(published[-1]["landmarks"]) == [0, 1, 2]
+
+
+def test_service_fed_from_replay_server_over_socket(tmp_path):
+    path = str(tmp_path / "messages.jsonl")
+    messages = write_messages(path, num_steps=20)
+
+    async def run():
+        server = await start_replay_server(path)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+        async with EstimatorService(make_estimator(), tick=0.001) as service:
+            await service.run(reader)
+
+        writer.close()
+        server.close()
+        await server.wait_closed()
+
+        return service
+
+    service = asyncio.run(run())
+
+    est = reference_estimate(messages)
+    assert service.num_messages == len(messages)
+    assert assert_array_almost_equal(service.estimator.X, est.X) is None
+
+
+async def lines_of(messages):
+    for message in messages:
+        yield json.dumps(message)
+
+
+def test_service_merges_scans_of_a_tick_into_one_joint_update_and_drops_stale_messages():
+    u = [0.04, np.deg2rad(1.)]
+    r = move(np.array([0., 0., 0.]), u, [0., 0.])
+    Y = np.array([rbs.observe_range_bearing(r, l) for l in LANDMARKS]) + 0.01
+    first = [{"type": "control", "t": 0.02, "u": u},
+             {"type": "measurement", "t": 0.02, "ids": [0, 1], "y": Y[:2].tolist()},
+             {"type": "measurement", "t": 0.02, "ids": [1, 2], "y": Y[1:].tolist()}]
+    late = [{"type": "control", "t": 0.01, "u": u},
+            {"type": "measurement", "t": 0.04, "ids": [0], "y": Y[:1].tolist()}]
+
+    est = make_estimator()
+    joint_updates = []
+    joint_update = est.joint_update
+    est.joint_update = lambda measurements: joint_updates.append(len(measurements)) or joint_update(measurements)
+
+    with EstimatorService(est, tick=0.05) as service:
+        asyncio.run(service.run(lines_of(first)))
+        asyncio.run(service.run(lines_of(late)))
+
+    # both scans of the first tick in one update, and the late control dropped
+    assert joint_updates == [2, 1]
+    assert service.num_messages == 4 and service.num_dropped == 1
+    assert service.time == 0.04
+
+    expected = make_estimator()
+    model = RangeBearingModel(expected.R)
+    expected.state_and_state_cov_propagation(u)
+    expected.joint_update([(model, Y[:2], [0, 1]), (model, Y[1:], [1, 2])])
+    expected.joint_update([(model, Y[:1], [0])])
+    assert assert_array_almost_equal(service.estimator.X, expected.X) is None
+    assert assert_array_almost_equal(service.estimator.P, expected.P) is None
@@ -0,0 +1,139 @@
+import multiprocessing
+
+import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
+
+from python.lib.ekf import EKFSLAM
+from python.lib.shared_state import StatePublisher, StateSubscriber
+
+
+def make_estimator(num_landmarks=3):
+    est = EKFSLAM()
+    est.X = np.array([1., 2., 0.4])
+    est.P = np.diag([0.04, 0.03, 0.01])
+    est.R = np.diag([0.1 ** 2, np.deg2rad(2.) ** 2])
+    est.new_landmarks_range_bearing(np.column_stack([np.arange(1., num_landmarks + 1), np.zeros(num_landmarks)]),
+                                    list(range(10, 10 + num_landmarks)))
+
+    return est
+
+
+class ConstantState:
+    """
+    Estimator-like state with every entry of X and P equal to value, to detect torn reads
+    """
+
+    def __init__(self, n, value):
+        self.X = np.full(n, value)
+        self.P = np.full((n, n), value)
+        self.landmark_lookup = [int(value)] * ((n - 3) // 2)
+        self.num_steps = int(value)
+
+
+def test_subscriber_reads_published_state_as_read_only_views():
+    est = make_estimator()
+
+    with StatePublisher(capacity=11) as publisher, StateSubscriber(publisher.name) as subscriber:
+        assert subscriber.read() is None
+
+        assert publisher.publish(est) == 1
+        state = subscriber.read()
+
+        assert state.version == 1 and subscriber.version == 1
+        assert state.step == est.num_steps
+        assert_array_equal(state.X, est.X)
+        assert_array_equal(state.P, est.P)
+        assert_array_equal(state.landmark_ids, [10, 11, 12])
+        assert not state.X.flags.writeable and not state.P.flags.writeable
+        assert state.valid()
+        del state
+
+
+def test_views_become_invalid_when_their_slot_is_overwritten_and_copies_do_not():
+    est = make_estimator()
+
+    with StatePublisher(capacity=9, num_slots=2) as publisher, StateSubscriber(publisher.name) as subscriber:
+        publisher.publish(est)
+        view, copy = subscriber.read(), subscriber.read(copy=True)
+
+        est.state_and_state_cov_propagation([0.5, 0.1])
+        publisher.publish(est)
+        assert view.valid()
+
+        publisher.publish(est)
+        assert not view.valid()
+        assert copy.valid() and copy.version == 1
+
+        state = subscriber.read()
+        assert state.version == 3
+        assert_array_equal(state.P, est.P)
+        del view, state
+
+
+def test_publish_raises_if_state_exceeds_capacity():
+    with StatePublisher(capacity=7) as publisher:
+        with pytest.raises(ValueError):
+            publisher.publish(make_estimator(num_landmarks=3))
+
+
+def test_failed_publish_leaves_slots_readable():
+    est = make_estimator()
+    invalid_ids = make_estimator()
+    invalid_ids.landmark_lookup = [10, "a", 12]
+    invalid_step = ConstantState(9, 1.)
+    invalid_step.num_steps = "a"       # fails while the slot is written
+
+    with StatePublisher(capacity=9, num_slots=2) as publisher, StateSubscriber(publisher.name) as subscriber:
+        for invalid in (invalid_ids, invalid_step):
+            publisher.publish(est)
+            with pytest.raises((TypeError, ValueError)):
+                publisher.publish(invalid)
+
+            # both slots, including the one of the failed publish, are written and read again
+            for _ in range(2):
+                version = publisher.publish(est)
+                state = subscriber.read(max_retries=1)
+                assert state.version == version and state.valid()
+                assert_array_equal(state.landmark_ids, [10, 11, 12])
+                del state
+
+
+def consume(name, num_reads, queue):
+    """
+    Read states in another process, and report how many were torn (entries of different publishes)
+    """
+
+    torn = 0
+    versions = []
+    with StateSubscriber(name) as subscriber:
+        while len(versions) < num_reads:
+            state = subscriber.read(copy=True)
+            if state is None:
+                continue
+            values = np.concatenate([state.X, state.P.ravel(), state.landmark_ids])
+            torn += int(np.any(values != values[0]))
+            versions.append(state.version)
+    queue.put((torn, versions))
+
+
+def test_concurrent_consumer_process_reads_consistent_states():
+    n = 101
+    ctx = multiprocessing.get_context("spawn")
+
+    with StatePublisher(capacity=n) as publisher:
+        publisher.publish(ConstantState(n, 1.))
+        queue = ctx.Queue()
+        consumer = ctx.Process(target=consume, args=(publisher.name, 500, queue))
+        consumer.start()
+
+        value = 1.
+        while consumer.is_alive() and queue.empty():
+            value += 1.
+            publisher.publish(ConstantState(n, value))
+
+        torn, versions = queue.get(timeout=60)
+        consumer.join(timeout=60)
+
+    assert torn == 0
+    assert versions == sorted(versions)
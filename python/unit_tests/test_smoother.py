@@ -0,0 +1,73 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from python.lib.ekf import EKFSLAM
+from python.lib.robot import move
+from python.lib.sensors import RangeBearingSensor
+from python.lib.smoother import TrajectoryLog, rts_smooth
+
+
+def run_logged_simulation(num_steps=200, seed=0):
+    rng = np.random.RandomState(seed)
+    landmarks = np.array([[3., 4.], [-2., 5.], [0., -3.], [4., -1.]])
+    P_rr = np.diag([0.01, 0.01, 0.001])
+
+    # landmarks start (almost) known, so that the errors are not dominated by the offset of the map as a whole
+    est = EKFSLAM()
+    est.X = np.concatenate([np.zeros(3), landmarks.ravel()])
+    est.P = np.diag(np.concatenate([np.diag(P_rr), np.full(8, 1e-6)]))
+    est.Q = np.diag([0.05 ** 2, np.deg2rad(2.) ** 2])
+    est.R = np.diag([0.1 ** 2, np.deg2rad(2.) ** 2])
+    est.trajectory_log = TrajectoryLog(capacity=16)
+
+    r_true = rng.multivariate_normal(np.zeros(3), P_rr)
+    poses = [r_true]
+    for step in range(num_steps):
+        U = np.array([0.1, np.deg2rad(4.)])
+        r_true = np.asarray(move(r_true, U, np.sqrt(np.diag(est.Q)) * rng.randn(2)))
+        poses.append(r_true)
+        est.state_and_state_cov_propagation(U)
+
+        if step % 10 == 9:
+            Y = np.array([RangeBearingSensor.observe_range_bearing(r_true, l) for l in landmarks])
+            est.range_bearing_scan_update(Y + np.sqrt(np.diag(est.R)) * rng.randn(*Y.shape), [0, 1, 2, 3])
+
+    return est, np.array(poses)
+
+
+def test_chunked_smoother_matches_step_by_step_rts_recursion():
+    est, _ = run_logged_simulation(num_steps=60)
+    log = est.trajectory_log
+    X_f, P_f, F, X_p, P_p = log.arrays()
+
+    X_s = est.X[:3].copy()
+    P_s = est.robot_covariance()
+    expected = [(X_s, P_s)]
+    for t in range(len(log) - 1, -1, -1):
+        C = np.dot(np.dot(P_f[t], F[t].T), np.linalg.pinv(P_p[t]))
+        X_s = X_f[t] + np.dot(C, X_s - X_p[t])
+        P_s = P_f[t] + np.dot(np.dot(C, P_s - P_p[t]), C.T)
+        expected.append((X_s, P_s))
+    expected = expected[::-1]
+
+    assert len(log) == 60
+    assert log.steps[-1] == 60
+    for chunk_size in (1, 7, 4096):
+        X_smoothed, P_smoothed = rts_smooth(log, est.X[:3], est.robot_covariance(), chunk_size=chunk_size)
+        assert_allclose(X_smoothed, [X for X, _ in expected], atol=1e-9)
+        assert_allclose(P_smoothed, [P for _, P in expected], atol=1e-9)
+
+
+def test_smoothed_trajectory_is_more_accurate_than_filtered_trajectory():
+    est, poses = run_logged_simulation()
+
+    X_smoothed, P_smoothed = est.trajectory_log.smooth(est, chunk_size=64)
+    X_f = np.concatenate([est.trajectory_log.arrays()[0], est.X[None, :3]])
+
+    filtered_error = np.sqrt(np.mean((X_f[:, :2] - poses[:, :2]) ** 2))
+    smoothed_error = np.sqrt(np.mean((X_smoothed[:, :2] - poses[:, :2]) ** 2))
+    assert smoothed_error < 0.8 * filtered_error
+
+    # smoothing never increases the uncertainty
+    P_f = np.concatenate([est.trajectory_log.arrays()[1], est.robot_covariance()[None]])
+    assert np.all(np.trace(P_smoothed, axis1=1, axis2=2) <= np.trace(P_f, axis1=1, axis2=2) + 1e-12)
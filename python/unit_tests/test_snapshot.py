@@ -0,0 +1,138 @@
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_almost_equal, assert_array_equal
+import pytest
+
+from python.lib.ekf import EKFSLAM
+from python.lib.snapshot import load_snapshot, save_snapshot
+
+
+def make_estimator(num_landmarks=6, dtype=np.float64):
+    est = EKFSLAM(dtype=dtype)
+    est.X = np.array([1., -2., np.deg2rad(30.)])
+    est.P = np.diag([0.3, 0.2, 0.1])
+    est.Q = np.array([[0.01, 0], [0, 0.001]])
+    est.R = np.array([[0.1 ** 2, 0], [0, np.deg2rad(2.) ** 2]])
+    Y = np.array([[2. + k, np.deg2rad(15. * k)] for k in range(num_landmarks)])
+    est.new_landmarks_range_bearing(Y, ["l{}".format(k) for k in range(num_landmarks)])
+    est.state_and_state_cov_propagation([0.5, np.deg2rad(5.)])
+    est.measurement_update_range_bearing(Y[2], 2)
+
+    return est
+
+
+@pytest.mark.parametrize("packed", [True, False])
+@pytest.mark.parametrize("compress", [True, False])
+@pytest.mark.parametrize("mmap", [True, False])
+def test_snapshot_restores_estimator_state(tmp_path, packed, compress, mmap):
+    est = make_estimator()
+    path = str(tmp_path / "state.snap")
+
+    save_snapshot(est, path, packed=packed, compress=compress)
+    restored = load_snapshot(path, mmap=mmap).to_estimator()
+
+    assert assert_array_equal(restored.X, est.X) is None
+    assert assert_array_equal(restored.P, est.P) is None
+    assert assert_array_equal(restored.Q, est.Q) is None
+    assert assert_array_equal(restored.R, est.R) is None
+    assert restored.landmark_lookup == est.landmark_lookup
+    assert restored.num_steps == est.num_steps
+    assert restored.landmark_num_observations == est.landmark_num_observations
+
+    # the restored estimator can continue running
+    restored.state_and_state_cov_propagation([0.5, 0.])
+    est.state_and_state_cov_propagation([0.5, 0.])
+    assert assert_array_almost_equal(restored.P, est.P) is None
+
+
+def test_packed_float32_snapshot_is_about_a_quarter_of_the_size(tmp_path):
+    est = make_estimator(num_landmarks=40)
+    full_path, packed_path = str(tmp_path / "full.snap"), str(tmp_path / "packed.snap")
+
+    save_snapshot(est, full_path, packed=False)
+    save_snapshot(est, packed_path, dtype=np.float32)
+
+    size_full = (tmp_path / "full.snap").stat().st_size
+    size_packed = (tmp_path / "packed.snap").stat().st_size
+    assert size_packed < 0.3 * size_full
+
+    restored = load_snapshot(packed_path).to_estimator()
+    assert assert_allclose(restored.P, est.P, rtol=1e-6, atol=1e-7) is None
+
+
+@pytest.mark.parametrize("lazy", [True, False])
+@pytest.mark.parametrize("packed", [True, False])
+def test_mixed_precision_snapshot_round_trips(tmp_path, lazy, packed):
+    est = make_estimator(dtype=np.float32)
+    path = str(tmp_path / "state.snap")
+
+    save_snapshot(est, path, dtype=np.float32, packed=packed)
+    restored = load_snapshot(path).to_estimator(lazy=lazy)
+
+    assert restored.dtype == np.float32
+    assert isinstance(restored._P_buf, np.memmap) == (lazy and not packed)
+    assert assert_array_equal(restored.P, est.P) is None
+
+    # the float64 robot pose covariance is restored too, so the restored estimator continues exactly as the original
+    assert assert_array_equal(restored.robot_covariance(), est.robot_covariance()) is None
+    for e in (est, restored):
+        e.state_and_state_cov_propagation([0.5, 0.])
+        e.measurement_update_range_bearing(np.array([3.2, np.deg2rad(16.)]), 1)
+    assert assert_array_equal(restored.X, est.X) is None
+    assert assert_array_equal(restored.P, est.P) is None
+
+
+def test_lazy_restore_is_copy_on_write_and_blocks_can_be_read_without_unpacking(tmp_path):
+    est = make_estimator()
+    path = str(tmp_path / "state.snap")
+    save_snapshot(est, path, packed=False)
+
+    snapshot = load_snapshot(path)
+    fork = snapshot.to_estimator(lazy=True)
+    assert isinstance(fork._P_buf, np.memmap)
+
+    fork.measurement_update_range_bearing(np.array([3.2, np.deg2rad(16.)]), 1)
+
+    # the file is unchanged by the fork
+    assert assert_array_equal(load_snapshot(path).to_estimator().P, est.P) is None
+
+    packed_path = str(tmp_path / "packed.snap")
+    save_snapshot(est, packed_path)
+    packed = load_snapshot(packed_path)
+    assert assert_array_equal(packed.covariance_block(slice(0, 3), slice(3, 9)), est.P[:3, 3:9]) is None
+    assert assert_array_equal(packed.covariance_block(slice(5, 9), slice(0, 7)), est.P[5:9, :7]) is None
+
+
+def test_landmark_ids_of_supported_types_round_trip(tmp_path):
+    est = make_estimator(num_landmarks=4)
+    landmark_ids = [np.int64(3), 7, "a", (1, ("b", np.int32(2)))]
+    est.landmark_lookup = list(landmark_ids)
+    est.landmark_num_observations = {landmark_id: k for k, landmark_id in enumerate(landmark_ids)}
+    path = str(tmp_path / "state.snap")
+
+    save_snapshot(est, path)
+    restored = load_snapshot(path).to_estimator()
+
+    assert restored.landmark_lookup == [3, 7, "a", (1, ("b", 2))]
+    assert [type(landmark_id) for landmark_id in restored.landmark_lookup] == [int, int, str, tuple]
+    assert restored.landmark_num_observations == est.landmark_num_observations
+    assert restored.get_landmark_index((1, ("b", 2))) == 3
+
+
+@pytest.mark.parametrize("landmark_id", [1.5, None, True, frozenset([1])])
+def test_save_snapshot_rejects_unsupported_landmark_ids(tmp_path, landmark_id):
+    est = make_estimator()
+    est.landmark_lookup = [0, 1, 2, 3, 4, landmark_id]
+    path = tmp_path / "state.snap"
+
+    with pytest.raises(TypeError):
+        save_snapshot(est, str(path))
+
+    assert not path.exists()
+
+
+def test_load_snapshot_raises_error_for_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a snapshot")
+
+    with pytest.raises(ValueError):
+        load_snapshot(str(path))
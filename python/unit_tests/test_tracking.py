@@ -0,0 +1,54 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from python.lib.drone_sim import SIMULATION_TIMESTEP, records_to_tracks, simulate_drones
+from python.lib.tracking import constant_velocity_model, filter_tracks, measurement_model, steady_state_gain
+
+
+def test_steady_state_gain_solves_riccati_equation_and_is_cached():
+    steady_state_gain.cache_clear()
+
+    K, P = steady_state_gain(0.02, 0.1, 0.05)
+    F, Q = constant_velocity_model(0.02, 0.1)
+    H, R = measurement_model(0.05)
+
+    PH_T = np.dot(P, H.T)
+    P_next = np.dot(np.dot(F, P - np.dot(np.dot(PH_T, np.linalg.inv(np.dot(H, PH_T) + R)), PH_T.T)), F.T) + Q
+    assert_allclose(P_next, P, rtol=1e-10)
+    assert_allclose(K, np.dot(PH_T, np.linalg.inv(np.dot(H, PH_T) + R)))
+
+    assert steady_state_gain(0.02, 0.1, 0.05)[0] is K
+    assert steady_state_gain.cache_info().hits == 1
+    assert not K.flags.writeable
+
+
+def test_filter_tracks_matches_step_by_step_steady_state_filter():
+    rng = np.random.RandomState(0)
+    Z = rng.randn(2, 40, 6)
+    kwargs = dict(time_step=0.02, process_std=0.1, position_std=0.05, velocity_std=0.2)
+
+    X = filter_tracks(Z, **kwargs)
+
+    K, _ = steady_state_gain(0.02, 0.1, 0.05, 0.2)
+    F, _ = constant_velocity_model(0.02, 0.1)
+    for b in range(Z.shape[0]):
+        for axis in range(3):
+            x = Z[b, 0, [axis, 3 + axis]]
+            for t in range(Z.shape[1]):
+                x_pred = np.dot(F, x)
+                x = x_pred + np.dot(K, Z[b, t, [axis, 3 + axis]] - x_pred)
+                assert_allclose(X[b, t, [axis, 3 + axis]], x, atol=1e-10)
+
+
+def test_filter_tracks_reduces_position_error_of_simulated_drones():
+    records = simulate_drones(20, 500)
+    tracks = records_to_tracks(records)
+    position_std = 0.05
+    Z = tracks[..., :3] + position_std * np.random.RandomState(1).randn(*tracks[..., :3].shape)
+
+    X = filter_tracks(Z, time_step=SIMULATION_TIMESTEP, position_std=position_std)
+
+    assert X.shape == (20, 500, 6)
+    error = X[:, 50:] - tracks[:, 50:]      # after the initial transient
+    assert np.sqrt(np.mean(error[..., :3] ** 2)) < 0.7 * position_std
+    assert np.sqrt(np.mean(error[..., 3:] ** 2)) < 0.5     # finite differences of Z are off by about 3.5 m/s
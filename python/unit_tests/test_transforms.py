@@ -1,7 +1,7 @@
 import numpy as np
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 
-from python.lib.transforms import rigid_transform_local_to_world, angle_to_rotation_matrix
+from python.lib.transforms import rigid_transform_local_to_world, angle_to_rotation_matrix, PoseContext, pose_context
 
 
 def test_rigid_transform_local_to_world_when_rotation_is_zero_and_position_is_zero():
@@ -34,3 +34,12 @@ def test_angle_to_rotation_matrix_if_angle_is_zero():
 
 def test_angle_to_rotation_matrix_if_angle_is_180_deg():
     assert assert_array_almost_equal(angle_to_rotation_matrix(np.deg2rad(180.)), np.array([[-1, 0], [0, -1.]])) is None
+
+
+def test_pose_context_rotation_matches_angle_to_rotation_matrix():
+    ctx = PoseContext(np.array([1., -2., np.deg2rad(30.)]), version=4)
+
+    assert assert_array_almost_equal(ctx.R, angle_to_rotation_matrix(np.deg2rad(30.))) is None
+    assert assert_array_equal(ctx.t, np.array([1., -2.])) is None
+    assert ctx.version == 4
+    assert pose_context(None, ctx) is ctx
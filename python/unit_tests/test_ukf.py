@@ -0,0 +1,155 @@
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_almost_equal
+
+from python.lib.ekf import EKFSLAM
+from python.lib.kernels import NumpyKernels
+from python.lib.robot import move
+from python.lib.sensor_models import RangeBearingModel
+from python.lib.sensors import RangeBearingSensor
+from python.lib.ukf import UKFSLAM, sigma_points, unscented_mean
+
+
+def test_sigma_points_match_mean_and_covariance():
+    mean = np.array([1., -2., 0.5])
+    A = np.array([[0.3, 0., 0.], [0.1, 0.2, 0.], [-0.05, 0.02, 0.1]])
+    cov = np.dot(A, A.T)
+
+    points, w_m, w_c = sigma_points(mean, cov, alpha=0.5)
+    mean_est, d = unscented_mean(points, w_m)
+
+    assert points.shape == (7, 3)
+    assert assert_array_almost_equal(mean_est, mean) is None
+    assert assert_array_almost_equal(np.dot(w_c * d.T, d), cov) is None
+
+
+def run_filter(est):
+    est.X = np.array([1., 2., np.deg2rad(30.)])
+    est.P = np.diag([1e-6, 1e-6, 1e-8])
+    est.Q = np.diag([1e-3 ** 2, np.deg2rad(0.05) ** 2])
+    est.R = np.diag([1e-3 ** 2, np.deg2rad(0.05) ** 2])
+
+    est.new_landmarks_range_bearing(np.array([[4., np.deg2rad(20.)], [5., np.deg2rad(-10.)]]), [0, 1])
+    est.state_and_state_cov_propagation([0.5, np.deg2rad(3.)])
+    est.range_bearing_scan_update(np.array([[3.55, np.deg2rad(19.)], [5.1, np.deg2rad(-13.)], [3., 0.5]]), [0, 1, 2])
+
+    return est
+
+
+def test_ukf_slam_matches_ekf_slam_for_small_uncertainties():
+    ukf = run_filter(UKFSLAM())
+    ekf = run_filter(EKFSLAM())
+
+    # with little uncertainty the models are close to linear over the sigma point spread (the UKF means differ by the
+    # second order terms, e.g. range * bearing variance / 2 ~ 2e-6 m for the new landmarks)
+    assert_allclose(ukf.X, ekf.X, atol=1e-5)
+    assert_allclose(ukf.P, ekf.P, rtol=1e-3, atol=1e-10)
+
+
+def uncertain_estimator(est, num_landmarks=1):
+    est.X = np.array([1., 2., 0.8])
+    est.P = np.diag([0.3, 0.3, 0.2])
+    est.R = np.diag([0.05 ** 2, np.deg2rad(1.) ** 2])
+    est.new_landmarks_range_bearing(np.array([[2., 0.3], [3., -0.6]])[:num_landmarks], list(range(num_landmarks)))
+
+    return est
+
+
+def test_ukf_scan_update_is_the_unscented_update():
+    ukf = uncertain_estimator(UKFSLAM())
+    ekf = uncertain_estimator(EKFSLAM())
+    X, P = ukf.X.copy(), ukf.P.copy()
+    y = np.array([2.3, 0.1])
+
+    ukf.range_bearing_scan_update(y[None], [0])
+    ekf.range_bearing_scan_update(y[None], [0])
+
+    # unscented transform of the full state (robot pose and the only landmark)
+    points, w_m, w_c = sigma_points(X, P)
+    h, d_y = unscented_mean(np.asarray(RangeBearingSensor.observe_range_bearing_batch(points[:, :3], points[:, 3:])),
+                            w_m, angles=(1,))
+    z = y - h
+    Z = np.dot(w_c * d_y.T, d_y) + ukf.R
+    K = np.dot(np.dot(w_c * (points - X).T, d_y), np.linalg.inv(Z))
+
+    assert_allclose(ukf.X, X + np.dot(K, z), atol=1e-10)
+    assert_allclose(ukf.P, P - np.dot(np.dot(K, Z), K.T), atol=1e-10)
+
+    # the observation model is far from linear over this uncertainty, so the EKF update differs
+    assert np.abs(ekf.X - ukf.X).max() > 1e-2
+
+
+def test_ukf_scan_and_joint_updates_do_not_use_the_ekf_kernels():
+    class EKFKernels(NumpyKernels):
+        @staticmethod
+        def observe_jacobians(X_r, L, ctx=None):
+            raise AssertionError("EKF kernel called")
+
+    scan = uncertain_estimator(UKFSLAM(), num_landmarks=2)
+    joint = uncertain_estimator(UKFSLAM(), num_landmarks=2)
+    scan.kernels = joint.kernels = EKFKernels
+    Y = np.array([[2.3, 0.1], [2.6, -0.5]])
+
+    scan.range_bearing_scan_update(Y, [0, 1])
+    joint.joint_update([(RangeBearingModel(joint.R), Y, [0, 1])])
+
+    assert_allclose(joint.X, scan.X, atol=1e-12)
+    assert_allclose(joint.P, scan.P, atol=1e-12)
+
+
+def test_ukf_joint_update_initialises_new_landmarks_with_the_unscented_transform():
+    joint = uncertain_estimator(UKFSLAM(), num_landmarks=0)
+    scan = uncertain_estimator(UKFSLAM(), num_landmarks=0)
+    ekf = uncertain_estimator(EKFSLAM(), num_landmarks=0)
+    Y = np.array([[2.3, 0.1], [2.6, -0.5]])
+
+    joint.joint_update([(RangeBearingModel(joint.R), Y, [0, 1])])
+    scan.new_landmarks_range_bearing(Y, [0, 1])
+    ekf.new_landmarks_range_bearing(Y, [0, 1])
+
+    assert_allclose(joint.X, scan.X, atol=1e-12)
+    assert_allclose(joint.P, scan.P, atol=1e-12)
+    assert np.abs(ekf.X - joint.X).max() > 1e-2
+
+
+def test_ukf_prediction_propagates_all_sigma_points_in_one_batched_call(monkeypatch):
+    calls = []
+
+    def state_propagation(X, U, n=None):
+        calls.append(X.shape)
+        return EKFSLAM.state_propagation(X, U, n)
+
+    est = run_filter(UKFSLAM())
+    monkeypatch.setattr(est, "state_propagation", state_propagation)
+
+    est.state_and_state_cov_propagation([0.5, np.deg2rad(3.)])
+
+    # sigma points of the robot pose and process noise only (not of the landmarks)
+    assert calls == [(11, 3)]
+
+
+def test_ukf_slam_tracks_robot_on_noisy_circle():
+    np.random.seed(5)
+    est = UKFSLAM()
+    est.X = np.array([0., 0., 0.])
+    est.P = np.zeros((3, 3))
+    est.Q = np.diag([0.05 ** 2, np.deg2rad(2.) ** 2])
+    est.R = np.diag([0.1 ** 2, np.deg2rad(3.) ** 2])
+    landmarks = np.array([[3., 4.], [-2., 5.], [0., -3.], [4., -1.]])
+    r_true = est.X[:3].copy()
+
+    for step in range(100):
+        U = np.array([0.1, np.deg2rad(6.)])
+        r_true = np.asarray(move(r_true, U, np.sqrt(np.diag(est.Q)) * np.random.randn(2)))
+        est.state_and_state_cov_propagation(U)
+
+        if step % 5 == 0:
+            Y = np.array([RangeBearingSensor.observe_range_bearing(r_true, l) for l in landmarks])
+            Y += np.sqrt(np.diag(est.R)) * np.random.randn(*Y.shape)
+            est.range_bearing_scan_update(Y, [0, 1, 2, 3])
+
+    d = est.X[:3] - r_true
+    d[2] = (d[2] + np.pi) % (2 * np.pi) - np.pi
+
+    # estimation error is consistent with the estimated covariance (NEES well within the 99.9% bound for 3 DOF)
+    assert np.dot(d, np.linalg.solve(est.P[:3, :3], d)) < 16.3
+    assert np.all(np.linalg.eigvalsh(est.P) > -1e-12)
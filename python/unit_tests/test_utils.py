@@ -1,5 +1,5 @@
 def test_jax_using_64_bit_precision():
-    from jax.config import config
+    from jax import config
 
     # check that JAX is set to 64-bit precision
-    assert config.values["jax_enable_x64"]
+    assert config.jax_enable_x64
@@ -0,0 +1,71 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
+
+from python.lib.world import LandmarkGrid, generate_landmarks
+
+
+def brute_force_visible(landmarks, X_r, max_range, fov=2 * np.pi):
+    d = landmarks - X_r[:2]
+    bearing = (np.arctan2(d[:, 1], d[:, 0]) - X_r[2] + np.pi) % (2 * np.pi) - np.pi
+    keep = (np.hypot(d[:, 0], d[:, 1]) <= max_range) & (np.abs(bearing) <= fov / 2)
+
+    return np.flatnonzero(keep)
+
+
+def test_generate_landmarks_is_reproducible_and_within_bounds():
+    bounds = (-100., 20., 300., 50.)
+
+    for num_clusters in (0, 10):
+        landmarks = generate_landmarks(5000, bounds, seed=3, num_clusters=num_clusters, cluster_std=5.)
+
+        assert landmarks.shape == (5000, 2)
+        assert np.all(landmarks >= [-100., 20.]) and np.all(landmarks <= [300., 50.])
+        assert_array_equal(landmarks, generate_landmarks(5000, bounds, seed=3, num_clusters=num_clusters,
+                                                         cluster_std=5.))
+
+
+@pytest.mark.parametrize("cell_size, num_buckets", [(10., None), (3., 7), (50., 1)])
+def test_visible_matches_brute_force(cell_size, num_buckets):
+    landmarks = generate_landmarks(20000, (-200., -200., 200., 200.), seed=1)
+    grid = LandmarkGrid(landmarks, cell_size=cell_size, num_buckets=num_buckets)
+    rng = np.random.default_rng(0)
+
+    for _ in range(20):
+        X_r = np.array([*rng.uniform(-220., 220., 2), rng.uniform(-np.pi, np.pi)])
+        max_range, fov = rng.uniform(1., 30.), rng.uniform(0.1, 2 * np.pi)
+
+        ids, positions = grid.visible(X_r, max_range, fov)
+
+        assert_array_equal(ids, brute_force_visible(landmarks, X_r, max_range, fov))
+        assert_array_equal(positions, landmarks[ids])
+        assert_array_equal(grid.query(X_r[:2], max_range)[0], brute_force_visible(landmarks, X_r, max_range))
+
+
+def test_visible_returns_given_ids():
+    landmarks = np.array([[0., 1.], [5., 0.], [-3., 0.]])
+    grid = LandmarkGrid(landmarks, cell_size=2., ids=[30, 10, 20])
+
+    ids, positions = grid.visible([0., 0., 0.], 4.)
+    assert_array_equal(ids, [20, 30])
+    assert_array_equal(positions, [[-3., 0.], [0., 1.]])
+
+    # field of view of 90 deg around the heading (+y)
+    ids, _ = grid.visible([0., 0., np.pi / 2], 6., fov=np.pi / 2)
+    assert_array_equal(ids, [30])
+
+    ids, positions = LandmarkGrid(np.zeros((0, 2))).visible([0., 0., 0.], 10.)
+    assert ids.shape == (0,) and positions.shape == (0, 2)
+
+
+def test_query_cost_scales_with_landmarks_in_view_not_world_size():
+    # 1 million landmarks over 10 km x 10 km (1 per 100 m^2)
+    landmarks = generate_landmarks(1000000, (0., 0., 10000., 10000.), seed=0)
+    grid = LandmarkGrid(landmarks, cell_size=20.)
+
+    # a 20 m range query visits at most 3 x 3 cells of ~4 landmarks each, plus some from colliding buckets
+    num_candidates = grid.candidates([5000., 5000.], 20.).shape[0]
+    assert num_candidates < 200
+
+    ids, _ = grid.visible([5000., 5000., 0.], 20.)
+    assert 0 < ids.shape[0] <= num_candidates